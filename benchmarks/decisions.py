@@ -0,0 +1,59 @@
+"""
+Measures the replica decision pass on its own, without backends, on random usage of services
+with CPU and memory limits.
+
+Usage: python benchmarks/decisions.py --services 100,10000,100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "swarm_auto_pilot"))
+
+from decisions import ServiceColumns, decide_replicas  # noqa: E402
+
+
+def create_columns(services: int, seed: int) -> ServiceColumns:
+    random = np.random.default_rng(seed)
+    usage = random.uniform(0.0, 1.2, (services, 2))
+    return ServiceColumns(
+        replicas=random.integers(1, 20, services),
+        scale_min=np.ones(services),
+        scale_max=np.full(services, 50.0),
+        max_step_up=np.full(services, np.inf),
+        max_step_down=np.full(services, np.inf),
+        usage=usage,
+        fast_usage=usage * random.uniform(0.8, 1.2, (services, 2)),
+        up_threshold=np.full((services, 2), 0.8),
+        down_threshold=np.full((services, 2), 0.3),
+        target=np.full((services, 2), 0.55),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser("decisions-benchmark")
+    parser.add_argument("--services", dest="services", type=str, default="100,10000,100000")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=20)
+    parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for services in [int(services) for services in args.services.split(",")]:
+        columns = create_columns(services=services, seed=args.seed)
+        durations = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            replica_decisions = decide_replicas(columns)
+            durations.append(time.perf_counter() - started_at)
+        durations.sort()
+        print(
+            f"{services} services: {durations[len(durations) // 2] * 1000000:.0f} us, "
+            f"{len(replica_decisions.indexes)} changes"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compares the per-tick round-trip cost of one-off requests against the pooled backend sessions.
+
+Usage: python benchmarks/http_sessions.py --calls_per_tick 50 --ticks 20
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+import requests
+import requests_unixsocket
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "swarm_auto_pilot"))
+
+from sessions import create_session  # noqa: E402
+
+
+class BenchmarkRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    connections_lock = threading.Lock()
+
+    def setup(self):
+        with BenchmarkRequestHandler.connections_lock:
+            BenchmarkRequestHandler.connections += 1
+        super(BenchmarkRequestHandler, self).setup()
+
+    def do_GET(self):
+        body = json.dumps([{"ID": self.path, "Spec": {"Name": "service"}}]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return "benchmark"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TCPBenchmarkRequestHandler(BenchmarkRequestHandler):
+    disable_nagle_algorithm = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def run_ticks(get, base_url: str, ticks: int, calls_per_tick: int) -> dict:
+    BenchmarkRequestHandler.connections = 0
+    tick_durations = []
+    for _ in range(ticks):
+        started_at = time.perf_counter()
+        for call in range(calls_per_tick):
+            get(f"{base_url}/services/{call}").json()
+        tick_durations.append(time.perf_counter() - started_at)
+
+    return {
+        "tick_ms": round(sum(tick_durations) / ticks * 1000, 3),
+        "call_ms": round(sum(tick_durations) / (ticks * calls_per_tick) * 1000, 4),
+        "connections_per_tick": BenchmarkRequestHandler.connections / ticks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser("http-sessions-benchmark")
+    parser.add_argument("--ticks", dest="ticks", type=int, default=20)
+    parser.add_argument("--calls_per_tick", dest="calls_per_tick", type=int, default=50)
+    args = parser.parse_args()
+
+    tcp_server = ThreadingHTTPServer(("127.0.0.1", 0), TCPBenchmarkRequestHandler)
+    threading.Thread(target=tcp_server.serve_forever, daemon=True).start()
+    tcp_url = f"http://127.0.0.1:{tcp_server.server_address[1]}"
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "docker.sock")
+    unix_server = ThreadingUnixHTTPServer(socket_path, BenchmarkRequestHandler)
+    threading.Thread(target=unix_server.serve_forever, daemon=True).start()
+    unix_url = f"http+unix://{quote(socket_path, safe='')}"
+
+    unix_requests = requests_unixsocket.Session()
+    session = create_session(backend="benchmark", timeout=10, pool_size=10)
+
+    results = {
+        "tcp": {
+            "before": run_ticks(requests.get, tcp_url, args.ticks, args.calls_per_tick),
+            "after": run_ticks(session.get, tcp_url, args.ticks, args.calls_per_tick),
+        },
+        "unix_socket": {
+            "before": run_ticks(unix_requests.get, unix_url, args.ticks, args.calls_per_tick),
+            "after": run_ticks(session.get, unix_url, args.ticks, args.calls_per_tick),
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+    tcp_server.shutdown()
+    unix_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
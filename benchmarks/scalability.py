@@ -0,0 +1,377 @@
+"""
+Measures how a control loop tick scales with the number of services and nodes, against local
+Docker, Prometheus and Hetzner HTTP servers with injected latency. Every case runs the pilot in
+its own process, so peak RSS and CPU time only cover the pilot.
+
+Usage: python benchmarks/scalability.py --services 10,500,5000 --nodes 10,100 --output result.json
+       python benchmarks/scalability.py --services 10,500 --nodes 10 --compare result.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "swarm_auto_pilot"))
+
+import handlers.docker  # noqa: E402
+from autoscale_providers import hetzner  # noqa: E402
+from clock import Clock  # noqa: E402
+from main import add_main_arguments, create_pilot, main_parser, validate_main_args  # noqa: E402
+from providers import ProviderFactory  # noqa: E402
+from simulation.backends import (  # noqa: E402
+    SimulatedDockerAdapter,
+    SimulatedHetznerAdapter,
+    SimulatedPrometheusAdapter,
+)
+from simulation.traces import LoadTrace  # noqa: E402
+from simulation.world import SimulatedWorld  # noqa: E402
+from telemetry import backend_request_duration  # noqa: E402
+
+pilot_arguments = [
+    "--cpu_scale_up_threshold=0.8",
+    "--cpu_scale_down_threshold=0.3",
+    "--memory_scale_up_threshold=0.8",
+    "--memory_scale_down_threshold=0.3",
+    "--node_scale_enabled=True",
+    "--node_scale_provider=hetzner",
+    "--metrics_port=0",
+    "--api_key=benchmark",
+    "--node_image=benchmark",
+    "--node_type=benchmark",
+    "--node_location=benchmark",
+]
+
+
+class BackendRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    adapter = None
+    latency = 0.0
+    lock = threading.Lock()
+
+    def handle_request(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        content_length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(content_length)) if content_length else None
+
+        time.sleep(self.latency)
+        with self.lock:
+            status_code, response_body = self.adapter.handle(
+                method=self.command, path=url.path, query=query, body=body
+            )
+
+        data = json.dumps(response_body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+    do_DELETE = handle_request
+
+    def address_string(self):
+        return "benchmark"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixBackendRequestHandler(BackendRequestHandler):
+    disable_nagle_algorithm = False
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_world(services: int, nodes: int, replicas: int) -> SimulatedWorld:
+    cpu_limits = 0.5
+    memory_limits = 256.0
+    node_cpu_cores = max(2.0, math.ceil(services * replicas * cpu_limits / nodes) + 1)
+    node_memory = max(4096.0, math.ceil(services * replicas * memory_limits / nodes) + 1024)
+    now = time.time()
+
+    world = SimulatedWorld(
+        start=now - 3600,
+        node_cpu_cores=node_cpu_cores,
+        node_memory=node_memory,
+        node_boot_time=0.0,
+        task_start_time=0.0,
+    )
+    for index in range(nodes):
+        world.add_server(
+            name=f"node-autopilot-{index:06d}",
+            now=now - 86400,
+            managed=True,
+            labels={"Type": "autopilot", "Status": "Running"},
+        )
+    for index in range(services):
+        # Spreads usage across the thresholds, so some services scale and some don't.
+        usage = 0.1 + 0.9 * (index % 10) / 10
+        world.add_service(
+            name=f"service-{index:05d}",
+            replicas=replicas,
+            cpu_limits=cpu_limits,
+            memory_limits=memory_limits,
+            labels={
+                "autopilot.enabled": "true",
+                "autopilot.scale_min": "1",
+                "autopilot.scale_max": str(replicas * 4),
+            },
+            trace=LoadTrace.synthetic(
+                duration=7200,
+                step=60,
+                cpu=cpu_limits * replicas * usage,
+                memory=memory_limits * replicas * usage,
+            ),
+        )
+
+    # Places the tasks, then starts them.
+    world.advance(now - 1)
+    world.advance(now)
+    return world
+
+
+def start_backends(world: SimulatedWorld, latency: float) -> tuple[dict, list]:
+    clock = Clock()
+    backends = {}
+    servers = []
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "docker.sock")
+    docker_handler = type(
+        "DockerRequestHandler",
+        (UnixBackendRequestHandler,),
+        {"adapter": SimulatedDockerAdapter(world=world, clock=clock), "latency": latency},
+    )
+    servers.append(ThreadingUnixHTTPServer(socket_path, docker_handler))
+    backends["docker_url"] = f"http+unix://{quote(socket_path, safe='')}"
+
+    for backend, adapter in [
+        ("prometheus_url", SimulatedPrometheusAdapter(world=world, clock=clock)),
+        ("hetzner_url", SimulatedHetznerAdapter(world=world, clock=clock)),
+    ]:
+        request_handler = type(
+            "BackendRequestHandler",
+            (BackendRequestHandler,),
+            {"adapter": adapter, "latency": latency},
+        )
+        server = ThreadingHTTPServer(("127.0.0.1", 0), request_handler)
+        servers.append(server)
+        backends[backend] = f"http://127.0.0.1:{server.server_address[1]}"
+        if backend == "hetzner_url":
+            backends[backend] += "/v1"
+
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return backends, servers
+
+
+def get_request_counts() -> dict:
+    request_counts = {}
+    for metric in backend_request_duration.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count"):
+                backend = sample.labels["backend"]
+                request_counts[backend] = request_counts.get(backend, 0) + sample.value
+    return request_counts
+
+
+def get_peak_rss_mib() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak_rss / 1024 / 1024 if sys.platform == "darwin" else peak_rss / 1024
+
+
+def run_worker(args: argparse.Namespace) -> dict:
+    """
+    Runs the pilot against the backends for a number of ticks, in the worker process.
+    """
+    logging.basicConfig(level=logging.CRITICAL)
+    handlers.docker.docker_base_url = args.docker_url
+    hetzner.hetzner_base_url = args.hetzner_url
+
+    arguments = pilot_arguments + [f"--node_scale_max_scale={args.nodes}"]
+    add_main_arguments()
+    main_args, _ = main_parser.parse_known_args(arguments)
+    validate_main_args(main_args)
+    provider_client = ProviderFactory.get_provider(
+        main_args.node_scale_provider,
+        arguments,
+        timeout=main_args.http_timeout,
+        pool_size=main_args.http_pool_size,
+    )
+    pilot = create_pilot(main_args=main_args, provider_client=provider_client)
+    pilot.metrics_handler.base_url = args.prometheus_url
+
+    started_at = time.perf_counter()
+    pilot.docker_state.resync()
+    resync_duration = time.perf_counter() - started_at
+
+    request_counts = get_request_counts()
+    tick_durations = []
+    cpu_started_at = time.process_time()
+    for _ in range(args.ticks):
+        started_at = time.perf_counter()
+        with pilot.tracer.trace("tick"):
+            pilot.run_tick()
+        tick_durations.append(time.perf_counter() - started_at)
+    cpu_duration = time.process_time() - cpu_started_at
+
+    tick_requests = {
+        backend: (count - request_counts.get(backend, 0)) / args.ticks
+        for backend, count in get_request_counts().items()
+        if count - request_counts.get(backend, 0) > 0
+    }
+    phases = {}
+    for trace in pilot.tracer.traces:
+        for span in trace.children:
+            phases[span.name] = phases.get(span.name, 0.0) + span.duration * 1000 / args.ticks
+
+    tick_durations.sort()
+    return {
+        "services": args.services,
+        "nodes": args.nodes,
+        "latency_ms": args.latency * 1000,
+        "resync_ms": round(resync_duration * 1000, 3),
+        "tick_ms": round(sum(tick_durations) / args.ticks * 1000, 3),
+        "tick_p50_ms": round(tick_durations[len(tick_durations) // 2] * 1000, 3),
+        "tick_max_ms": round(tick_durations[-1] * 1000, 3),
+        "requests_per_tick": tick_requests,
+        "cpu_ms_per_tick": round(cpu_duration / args.ticks * 1000, 3),
+        "peak_rss_mib": round(get_peak_rss_mib(), 1),
+        "phases_ms": {name: round(duration, 3) for name, duration in phases.items()},
+    }
+
+
+def run_case(services: int, nodes: int, args: argparse.Namespace) -> dict:
+    world = create_world(services=services, nodes=nodes, replicas=args.replicas)
+    backends, servers = start_backends(world=world, latency=args.latency_ms / 1000)
+    try:
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--worker",
+                f"--services={services}",
+                f"--nodes={nodes}",
+                f"--ticks={args.ticks}",
+                f"--latency={args.latency_ms / 1000}",
+                f"--docker_url={backends['docker_url']}",
+                f"--prometheus_url={backends['prometheus_url']}",
+                f"--hetzner_url={backends['hetzner_url']}",
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+            text=True,
+        ).stdout
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    return json.loads(output)
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    baseline_cases = {(case["services"], case["nodes"]): case for case in baseline["results"]}
+
+    regressions = []
+    for case in results:
+        baseline_case = baseline_cases.get((case["services"], case["nodes"]))
+        if baseline_case is None:
+            continue
+        for metric in ["tick_ms", "cpu_ms_per_tick", "peak_rss_mib"]:
+            if case[metric] > baseline_case[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{case['services']} services, {case['nodes']} nodes: {metric} "
+                    f"{baseline_case[metric]} -> {case[metric]}"
+                )
+        requests = sum(case["requests_per_tick"].values())
+        baseline_requests = sum(baseline_case["requests_per_tick"].values())
+        if requests > baseline_requests:
+            regressions.append(
+                f"{case['services']} services, {case['nodes']} nodes: requests_per_tick "
+                f"{baseline_requests} -> {requests}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser("scalability-benchmark")
+    parser.add_argument("--services", dest="services", type=str, default="10,500,5000")
+    parser.add_argument("--nodes", dest="nodes", type=str, default="10,100")
+    parser.add_argument("--replicas", dest="replicas", type=int, default=2)
+    parser.add_argument("--ticks", dest="ticks", type=int, default=5)
+    parser.add_argument("--latency_ms", dest="latency_ms", type=float, default=1.0)
+    parser.add_argument("--output", dest="output", type=str, default=None)
+    parser.add_argument("--compare", dest="compare", type=str, default=None)
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.2)
+    parser.add_argument("--worker", dest="worker", action="store_true")
+    parser.add_argument("--latency", dest="latency", type=float, default=0.0)
+    parser.add_argument("--docker_url", dest="docker_url", type=str)
+    parser.add_argument("--prometheus_url", dest="prometheus_url", type=str)
+    parser.add_argument("--hetzner_url", dest="hetzner_url", type=str)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.services = int(args.services)
+        args.nodes = int(args.nodes)
+        print(json.dumps(run_worker(args)))
+        return
+
+    results = []
+    for services in [int(services) for services in args.services.split(",")]:
+        for nodes in [int(nodes) for nodes in args.nodes.split(",")]:
+            case = run_case(services=services, nodes=nodes, args=args)
+            print(
+                f"{services} services, {nodes} nodes: {case['tick_ms']} ms/tick, "
+                f"{sum(case['requests_per_tick'].values()):.0f} requests/tick, "
+                f"{case['peak_rss_mib']} MiB peak RSS",
+                file=sys.stderr,
+            )
+            results.append(case)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.time(),
+        "parameters": {
+            "replicas": args.replicas,
+            "ticks": args.ticks,
+            "latency_ms": args.latency_ms,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(results, baseline_path=args.compare, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from handlers.docker import DockerNode, DockerService
+from providers import Node, ProviderBase
+from telemetry import node_creations, node_operation_duration, scale_decisions, scale_duration
+
+
+class ScaleResult:
+    def __init__(
+        self,
+        service_name: str,
+        old_replicas: int,
+        new_replicas: int,
+        succeeded: bool,
+        latency: float,
+    ):
+        self.service_name = service_name
+        self.old_replicas = old_replicas
+        self.new_replicas = new_replicas
+        self.succeeded = succeeded
+        self.latency = latency
+
+
+class ScaleActuator:
+    def __init__(self, concurrency: int):
+        if concurrency < 1:
+            raise ValueError("Scale concurrency must be at least 1.")
+
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="scale-actuator"
+        )
+
+    def apply(self, decisions: list[tuple[DockerService, int]]) -> list[ScaleResult]:
+        logging.info(
+            "Applying %s scale decisions, concurrency: %s.",
+            len(decisions),
+            self.concurrency,
+        )
+        futures = [
+            self.executor.submit(self.__scale, docker_service, new_replicas)
+            for docker_service, new_replicas in decisions
+        ]
+        scale_results = [future.result() for future in futures]
+
+        for scale_result in scale_results:
+            logging.info(
+                "Scale of service: %s, from %s to %s replicas, succeeded: %s, latency: %.3fs.",
+                scale_result.service_name,
+                scale_result.old_replicas,
+                scale_result.new_replicas,
+                scale_result.succeeded,
+                scale_result.latency,
+            )
+        return scale_results
+
+    def __scale(self, docker_service: DockerService, new_replicas: int) -> ScaleResult:
+        old_replicas = docker_service.replicas
+        started_at = time.perf_counter()
+        try:
+            succeeded = docker_service.scale(new_replicas=new_replicas)
+        except Exception:
+            logging.exception("Scale of service: %s raised an error.", docker_service.name)
+            succeeded = False
+
+        latency = time.perf_counter() - started_at
+        scale_duration.observe(latency)
+        scale_decisions.labels(
+            service=docker_service.name,
+            direction="up" if new_replicas > old_replicas else "down",
+            result="succeeded" if succeeded else "failed",
+        ).inc()
+
+        return ScaleResult(
+            service_name=docker_service.name,
+            old_replicas=old_replicas,
+            new_replicas=new_replicas,
+            succeeded=succeeded,
+            latency=latency,
+        )
+
+
+class NodeActuator:
+    def __init__(self, provider: ProviderBase, concurrency: int):
+        if concurrency < 1:
+            raise ValueError("Node scale concurrency must be at least 1.")
+
+        self.provider = provider
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="node-actuator"
+        )
+
+    def create(self, count: int, standby: bool = False) -> list[Node]:
+        logging.info("Creating %s nodes, concurrency: %s.", count, self.concurrency)
+        futures = [self.executor.submit(self.__create, standby) for _ in range(count)]
+        created_nodes = [future.result() for future in futures]
+        return [node for node in created_nodes if node is not None]
+
+    def __create(self, standby: bool) -> Node | None:
+        started_at = time.perf_counter()
+        try:
+            node = self.provider.node_create(standby=standby)
+        except Exception:
+            logging.exception("Creation of node raised an error.")
+            node_creations.labels(result="failed").inc()
+            return None
+
+        node_creations.labels(result="succeeded").inc()
+        logging.info(
+            "Node: %s is being created, latency: %.3fs.",
+            node.name,
+            time.perf_counter() - started_at,
+        )
+        return node
+
+    def promote(self, nodes: list[tuple[Node, DockerNode]]) -> list[Node]:
+        """
+        Activates warm pool nodes at the same time, returning the nodes that were promoted.
+        """
+        logging.info(
+            "Promoting %s warm pool nodes, concurrency: %s.", len(nodes), self.concurrency
+        )
+        futures = [
+            self.executor.submit(self.__promote, node, docker_node) for node, docker_node in nodes
+        ]
+        return [node for (node, _), future in zip(nodes, futures) if future.result()]
+
+    def drain(self, nodes: list[tuple[Node, DockerNode]], status: str = "Draining") -> list[Node]:
+        """
+        Drains the nodes at the same time and labels them with the status, returning the nodes
+        that have begun draining.
+        """
+        if not nodes:
+            return []
+
+        logging.info("Draining %s nodes, concurrency: %s.", len(nodes), self.concurrency)
+        futures = [
+            self.executor.submit(self.__drain, node, docker_node, status)
+            for node, docker_node in nodes
+        ]
+        return [node for (node, _), future in zip(nodes, futures) if future.result()]
+
+    def update_labels(self, nodes: list[Node]) -> list[Node]:
+        """
+        Sends the labels of the nodes to the provider at the same time, returning the updated
+        nodes.
+        """
+        futures = [self.executor.submit(self.__update_labels, node) for node in nodes]
+        return [node for node, future in zip(nodes, futures) if future.result()]
+
+    def delete(self, nodes: list[Node]) -> list[Node]:
+        """
+        Deletes the nodes from the provider at the same time, returning the deleted nodes.
+        """
+        futures = [self.executor.submit(self.__delete, node) for node in nodes]
+        return [node for node, future in zip(nodes, futures) if future.result()]
+
+    def remove(self, nodes: list[tuple[Node, DockerNode]]) -> list[Node]:
+        """
+        Removes the drained nodes from the swarm and the provider at the same time, returning
+        the removed nodes. Nodes still draining are left alone.
+        """
+        futures = [
+            self.executor.submit(self.__remove, node, docker_node) for node, docker_node in nodes
+        ]
+        return [node for (node, _), future in zip(nodes, futures) if future.result()]
+
+    def __promote(self, node: Node, docker_node: DockerNode) -> bool:
+        started_at = time.perf_counter()
+        try:
+            activate_response = docker_node.activate()
+            if activate_response is False:
+                logging.error("Promotion of node: %s, has encountered an error.", node.name)
+                return False
+
+            labels = node.labels
+            labels["Status"] = "Running"
+            labels.pop("Pool", None)
+            if node.update_labels(labels) is False:
+                logging.error("Label update of promoted node: %s, has failed.", node.name)
+                return False
+        except Exception:
+            logging.exception("Promotion of node: %s raised an error.", node.name)
+            return False
+
+        latency = time.perf_counter() - started_at
+        node_operation_duration.labels(operation="promote").observe(latency)
+        logging.info(
+            "Node: %s is promoted from the warm pool, latency: %.3fs.", node.name, latency
+        )
+        return True
+
+    def __drain(self, node: Node, docker_node: DockerNode, status: str) -> bool:
+        try:
+            drain_response = docker_node.drain()
+            if drain_response is False:
+                logging.error("Drain of node: %s, has encountered an error.", node.name)
+                return False
+
+            labels = node.labels
+            labels["Status"] = status
+            if node.update_labels(labels) is False:
+                logging.error("Label update of drained node: %s, has failed.", node.name)
+                return False
+        except Exception:
+            logging.exception("Drain of node: %s raised an error.", node.name)
+            return False
+
+        logging.info("Drain of node: %s, has begun.", node.name)
+        return True
+
+    def __update_labels(self, node: Node) -> bool:
+        try:
+            return node.update_labels(node.labels) is not False
+        except Exception:
+            logging.exception("Label update of node: %s raised an error.", node.name)
+            return False
+
+    def __delete(self, node: Node) -> bool:
+        try:
+            return node.delete() is not False
+        except Exception:
+            logging.exception("Deletion of node: %s raised an error.", node.name)
+            return False
+
+    def __remove(self, node: Node, docker_node: DockerNode) -> bool:
+        try:
+            confirm_drain_response = docker_node.confirm_drain()
+            if confirm_drain_response is False:
+                logging.info("Drain of node: %s, hasn't completed, waiting.", node.name)
+                return False
+
+            logging.info("Deleting node: %s, from swarm.", node.name)
+            started_at = time.perf_counter()
+            delete_response = docker_node.remove()
+            if delete_response is False:
+                logging.error("Deletion of swarm node: %s, encountered an error.", node.name)
+                return False
+
+            logging.info("Deleting node from provider: %s", node.name)
+            if node.delete() is False:
+                logging.error("Deletion of node: %s, from provider has failed.", node.name)
+                return False
+        except Exception:
+            logging.exception("Removal of node: %s raised an error.", node.name)
+            return False
+
+        node_operation_duration.labels(operation="delete").observe(
+            time.perf_counter() - started_at
+        )
+        logging.info("Node: %s is set to remove on provider.", node.name)
+        return True
@@ -3,68 +3,281 @@ import base64
 import logging
 import random
 import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
-from main import main_parser
 from providers import Node, ProviderBase
+from sessions import BackendSession, create_session
+from telemetry import backend_rate_limit_remaining, cache_requests
 
 hetzner_base_url = "https://api.hetzner.cloud/v1"
 
 
-def get_hetzner_headers(self, api_key: str):
+def get_hetzner_headers(api_key: str):
     return {"Authorization": f"Bearer {api_key}"}
 
 
-class HetznerNode(Node):
-    def __init__(self, hetzner_json_object: dict, api_key: str):
-        self.__create_object(hetzner_json_object=hetzner_json_object)
-        self.__set_headers(api_key=api_key)
+class HetznerClient:
+    """
+    Hetzner Cloud API client that keeps under the rate limit, retries throttled and failed
+    requests, and caches the servers, updating the cache with the pilot's own changes.
+    """
 
-    def __create_object(self, hetzner_json_object: dict, api_key: str) -> None:
-        server_object = (
-            hetzner_json_object["server"]
-            if "server" in hetzner_json_object.keys()
-            else hetzner_json_object
+    max_retries = 4
+    backoff_base = 1.0
+    backoff_max = 30.0
+    # Requests kept in hand for the pilot's mutations when the rate limit runs low.
+    rate_limit_reserve = 20
+    # Server errors are only retried on methods that can safely be sent twice.
+    idempotent_methods = ("GET", "PUT", "DELETE")
+
+    def __init__(self, session: BackendSession, cache_ttl: float, page_concurrency: int):
+        self.session = session
+        self.cache_ttl = cache_ttl
+        self.servers = None
+        self.servers_fetched_at = None
+        self.rate_limit = None
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=page_concurrency, thread_name_prefix="hetzner-client"
         )
-        self.id = server_object["id"]
-        self.name = server_object["name"]
-        self.labels = server_object["labels"]
-        self.created_at = datetime.fromisoformat(server_object["created"])
 
-    def __set_headers(self, api_key: str) -> None:
-        self.headers = get_hetzner_headers(api_key=api_key)
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            self.__throttle()
+            response = self.session.request(method, f"{hetzner_base_url}{path}", **kwargs)
+            self.__update_rate_limit(response)
 
-    def delete(self) -> bool:
-        response = requests.delete(f"{hetzner_base_url}/servers/{self.id}", headers=self.headers)
+            retryable = response.status_code == 429 or (
+                response.status_code >= 500 and method in self.idempotent_methods
+            )
+            if not retryable or attempt == self.max_retries:
+                return response
+
+            delay = self.__get_backoff_delay(attempt)
+            if response.status_code == 429:
+                delay = max(delay, self.__get_refill_delay())
+            logging.warning(
+                "Hetzner Provider: %s %s returned %s, retrying in %.1fs.",
+                method,
+                path,
+                response.status_code,
+                delay,
+            )
+            time.sleep(delay)
+        return response
+
+    def __get_backoff_delay(self, attempt: int) -> float:
+        return min(self.backoff_max, self.backoff_base * 2**attempt)
+
+    def __update_rate_limit(self, response: requests.Response):
+        try:
+            rate_limit = int(response.headers["RateLimit-Limit"])
+            rate_limit_remaining = int(response.headers["RateLimit-Remaining"])
+            rate_limit_reset = float(response.headers["RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+            self.rate_limit = rate_limit
+            self.rate_limit_remaining = rate_limit_remaining
+            self.rate_limit_reset = rate_limit_reset
+        backend_rate_limit_remaining.labels(backend="hetzner").set(rate_limit_remaining)
+
+    def __get_refill_delay(self) -> float:
+        """
+        Returns the seconds until one more request is available, the limit refills evenly
+        until the reset time.
+        """
+        with self.lock:
+            if self.rate_limit_reset is None:
+                return 0.0
+            missing = max(1, self.rate_limit - self.rate_limit_remaining)
+            return max(0.0, self.rate_limit_reset - time.time()) / missing
+
+    def __throttle(self):
+        with self.lock:
+            if self.rate_limit_remaining is None:
+                return
+            throttled = self.rate_limit_remaining <= self.rate_limit_reserve
+            if throttled:
+                self.rate_limit_remaining -= 1
+        if throttled:
+            delay = self.__get_refill_delay()
+            logging.warning(
+                "Hetzner Provider: rate limit is running low, waiting %.1fs for the request.",
+                delay,
+            )
+            time.sleep(delay)
+
+    def get_servers(self, label_selector: str) -> list[dict]:
+        with self.lock:
+            if (
+                self.servers is not None
+                and time.monotonic() - self.servers_fetched_at < self.cache_ttl
+            ):
+                cache_requests.labels(cache="hetzner_servers", result="hit").inc()
+                return list(self.servers.values())
+        cache_requests.labels(cache="hetzner_servers", result="miss").inc()
+
+        fetched_at = time.monotonic()
+        first_page = self.__get_servers_page(label_selector=label_selector, page=1)
+        last_page = first_page["meta"]["pagination"]["last_page"] or 1
+        pages = [first_page] + list(
+            self.executor.map(
+                lambda page: self.__get_servers_page(label_selector=label_selector, page=page),
+                range(2, last_page + 1),
+            )
+        )
+
+        servers = {server["id"]: server for page in pages for server in page["servers"]}
+        with self.lock:
+            self.servers = servers
+            self.servers_fetched_at = fetched_at
+            return list(servers.values())
+
+    def __get_servers_page(self, label_selector: str, page: int) -> dict:
+        response = self.request(
+            "GET",
+            "/servers",
+            params={"page": page, "per_page": 50, "label_selector": label_selector},
+        )
+        if response.status_code != 200:
+            raise Exception(
+                f"Hetzner Provider: get_nodes request returned {response.status_code}, error: {response.text}"
+            )
+        return response.json()
+
+    def create_server(self, payload: dict) -> dict:
+        """
+        Creates the server, retrying a server error or a lost response only once Hetzner shows
+        no server by the name, since the server may have been created anyway.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.request("POST", "/servers", json=payload)
+                error = f"returned {response.status_code}, error: {response.text}"
+            except requests.exceptions.RequestException as exception:
+                response = None
+                error = f"raised {exception!r}"
+
+            if response is not None and response.status_code == 201:
+                server = response.json()["server"]
+                break
+            if response is not None and response.status_code < 500:
+                raise Exception(f"Hetzner Provider: create_node request {error}")
+
+            server = self.__get_server_by_name(name=payload["name"])
+            if server is not None:
+                logging.warning(
+                    "Hetzner Provider: create_node request %s, but server: %s was created.",
+                    error,
+                    payload["name"],
+                )
+                break
+            if attempt == self.max_retries:
+                raise Exception(f"Hetzner Provider: create_node request {error}")
+
+            delay = self.__get_backoff_delay(attempt)
+            logging.warning(
+                "Hetzner Provider: create_node request %s, retrying in %.1fs.", error, delay
+            )
+            time.sleep(delay)
+
+        self.__cache_server(server_id=server["id"], server=server)
+        return server
+
+    def __get_server_by_name(self, name: str) -> dict | None:
+        response = self.request("GET", "/servers", params={"name": name})
+        if response.status_code != 200:
+            raise Exception(
+                f"Hetzner Provider: get_nodes request returned {response.status_code}, error: {response.text}"
+            )
+        servers = response.json()["servers"]
+        return servers[0] if servers else None
+
+    def delete_server(self, server_id: int) -> bool:
+        response = self.request("DELETE", f"/servers/{server_id}")
         if response.status_code != 200:
             logging.error(
                 f"Hetzner Provider: delete_node request returned {response.status_code}, error: {response.text}"
             )
+            self.invalidate()
             return False
+
+        self.__cache_server(server_id=server_id, server=None)
         return True
 
-    def update_labels(self, labels: dict) -> list[dict]:
-        payload = {"labels": labels}
-        response = requests.put(
-            f"{hetzner_base_url}/servers/{self.id}", headers=self.headers, json=payload
-        )
+    def update_server_labels(self, server_id: int, labels: dict) -> dict | bool:
+        with self.lock:
+            cached_server = self.servers.get(server_id) if self.servers is not None else None
+            if cached_server is not None and cached_server["labels"] == labels:
+                return dict(labels)
+
+        response = self.request("PUT", f"/servers/{server_id}", json={"labels": labels})
         if response.status_code != 200:
             logging.error(
                 f"Hetzner Provider: node_update_labels request returned {response.status_code}, error: {response.text}"
             )
+            self.invalidate()
             return False
-        return response.json()["server"]["labels"]
+
+        server = response.json()["server"]
+        self.__cache_server(server_id=server_id, server=server)
+        return dict(server["labels"])
+
+    def __cache_server(self, server_id: int, server: dict | None):
+        with self.lock:
+            if self.servers is None:
+                return
+            if server is None:
+                self.servers.pop(server_id, None)
+            else:
+                self.servers[server_id] = server
+
+    def invalidate(self):
+        with self.lock:
+            self.servers = None
+            self.servers_fetched_at = None
+
+
+class HetznerNode(Node):
+    def __init__(self, hetzner_json_object: dict, client: HetznerClient):
+        self.client = client
+        self.__create_object(hetzner_json_object=hetzner_json_object)
+
+    def __create_object(self, hetzner_json_object: dict) -> None:
+        server_object = (
+            hetzner_json_object["server"]
+            if "server" in hetzner_json_object.keys()
+            else hetzner_json_object
+        )
+        self.id = server_object["id"]
+        self.name = server_object["name"]
+        # A copy, the pilot changes the labels in place before updating them.
+        self.labels = dict(server_object["labels"])
+        self.created_at = datetime.fromisoformat(server_object["created"])
+
+    def delete(self) -> bool:
+        return self.client.delete_server(server_id=self.id)
+
+    def update_labels(self, labels: dict) -> list[dict]:
+        return self.client.update_server_labels(server_id=self.id, labels=labels)
 
 
 class HetznerProvider(ProviderBase):
     def __str__(self):
         return "Hetzner Provider"
 
-    def __init__(self, parser_args):
+    def __init__(self, parser_args, timeout: float, pool_size: int):
         super(HetznerProvider, self).__init__()
 
-        hetzner_parser = argparse.ArgumentParser(parents=[main_parser], add_help=False)
+        hetzner_parser = argparse.ArgumentParser(add_help=False)
         hetzner_parser.add_argument(
             "--api_key",
             help="Sets the API key to be used with Hetzner cloud",
@@ -128,10 +341,24 @@ class HetznerProvider(ProviderBase):
             type=str,
             default="",
         )
+        hetzner_parser.add_argument(
+            "--node_warm_pool_size",
+            help="Sets how many nodes are kept joined and drained, ready to be activated on scale up.",
+            dest="node_warm_pool_size",
+            type=int,
+            default=0,
+        )
+        hetzner_parser.add_argument(
+            "--node_cache_ttl",
+            help="Sets how long (in seconds) the node list is cached between refreshes from Hetzner.",
+            dest="node_cache_ttl",
+            type=float,
+            default=300.0,
+        )
         hetzner_parser.add_argument(
             "-hh", "--hetzner_help", action="help", help="Help for Hetzner provider"
         )
-        hetzner_args, _ = hetzner_parser.parse_known_args()
+        hetzner_args, _ = hetzner_parser.parse_known_args(parser_args)
 
         if not hetzner_args.api_key:
             raise ValueError("API Key must be set when using Hetzner as a provider.")
@@ -144,8 +371,8 @@ class HetznerProvider(ProviderBase):
         else:
             self.node_user_data = ""
 
-        self.node_networks = hetzner_args.node_networks.split(",")
-        self.node_firewalls = hetzner_args.node_firewalls.split(",")
+        self.node_networks = [value for value in hetzner_args.node_networks.split(",") if value]
+        self.node_firewalls = [value for value in hetzner_args.node_firewalls.split(",") if value]
 
         if not hetzner_args.node_image:
             raise ValueError("Node image must be set when using Hetzner as a provider.")
@@ -154,48 +381,69 @@ class HetznerProvider(ProviderBase):
         if not hetzner_args.node_type:
             raise ValueError("Node type must be set when using Hetzner as a provider.")
         self.node_type = hetzner_args.node_type
+        self.node_resources = None
 
         if not hetzner_args.node_location:
             raise ValueError("Node location must be set when using Hetzner as a provider.")
         self.node_location = hetzner_args.node_location
 
-        self.node_ssh_keys = hetzner_args.node_ssh_keys.split(",")
+        self.node_ssh_keys = [value for value in hetzner_args.node_ssh_keys.split(",") if value]
 
-        self.__set_headers(api_key=hetzner_args.api_key)
+        if hetzner_args.node_warm_pool_size < 0:
+            raise ValueError("Node warm pool size can't be negative.")
+        self.node_warm_pool_size = hetzner_args.node_warm_pool_size
 
-    def __set_headers(self, api_key: str) -> None:
-        self.headers = get_hetzner_headers(api_key=api_key)
+        self.session = create_session(
+            backend="hetzner",
+            timeout=timeout,
+            pool_size=pool_size,
+            headers=get_hetzner_headers(api_key=hetzner_args.api_key),
+        )
+        self.client = HetznerClient(
+            session=self.session,
+            cache_ttl=hetzner_args.node_cache_ttl,
+            page_concurrency=pool_size,
+        )
 
     def get_nodes(self):
-        pages_found = True
-        current_page = 1
-        nodes = []
-
-        while pages_found:
-            response = requests.get(
-                f"{hetzner_base_url}/servers?page={current_page}&per_page=50&label_selector=Type={self.node_label}",
-                headers=self.headers,
+        servers = self.client.get_servers(label_selector=f"Type={self.node_label}")
+        hetzner_nodes = [
+            HetznerNode(hetzner_json_object=server, client=self.client) for server in servers
+        ]
+        return hetzner_nodes
+
+    def get_node_resources(self) -> tuple[float, float]:
+        if self.node_resources is not None:
+            return self.node_resources
+
+        response = self.client.request("GET", "/server_types", params={"name": self.node_type})
+        if response.status_code != 200:
+            raise Exception(
+                f"Hetzner Provider: get_node_resources request returned {response.status_code}, error: {response.text}"
             )
-            if response.status_code != 200:
-                raise Exception(
-                    f"Hetzner Provider: get_nodes request returned {response.status_code}, error: {response.text}"
-                )
 
-            json_response = response.json()
-            nodes.extend(json_response["servers"])
+        server_types = response.json()["server_types"]
+        if not server_types:
+            raise Exception(f"Hetzner Provider: server type {self.node_type} doesn't exist.")
+        # Hetzner reports memory in GB.
+        self.node_resources = (
+            float(server_types[0]["cores"]),
+            float(server_types[0]["memory"]) * 1024,
+        )
+        return self.node_resources
 
-            pagination = json_response["meta"]["pagination"]
-            if current_page == pagination["last_page"]:
-                pages_found = False
+    def get_warm_pool_size(self) -> int:
+        return self.node_warm_pool_size
 
-        hetzner_nodes = [HetznerNode(hetzner_json_object=node) for node in nodes]
-        return hetzner_nodes
+    def node_create(self, standby: bool = False):
+        labels = {"Type": self.node_label, "Status": "Creating"}
+        if standby:
+            labels["Pool"] = "warm"
 
-    def node_create(self):
         payload = {
             "firewalls": [{"firewall": firewall} for firewall in self.node_firewalls],
             "image": self.node_image,
-            "labels": {"Type": self.node_label, "Status": "Creating"},
+            "labels": labels,
             "location": self.node_location,
             "name": f"{self.node_prefix}{''.join(random.choices(string.ascii_lowercase + string.digits, k=15))}",
             "networks": [int(network) for network in self.node_networks],
@@ -204,11 +452,6 @@ class HetznerProvider(ProviderBase):
             "user_data": self.node_user_data,
         }
 
-        response = requests.post(f"{hetzner_base_url}/servers", headers=self.headers, json=payload)
-        if response.status_code != 201:
-            raise Exception(
-                f"Hetzner Provider: create_node request returned {response.status_code}, error: {response.text}"
-            )
-        response_json = response.json()
-        hetzner_node = HetznerNode(hetzner_json_object=response_json)
+        server = self.client.create_server(payload=payload)
+        hetzner_node = HetznerNode(hetzner_json_object=server, client=self.client)
         return hetzner_node
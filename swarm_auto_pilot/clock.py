@@ -0,0 +1,13 @@
+import time
+from datetime import datetime, timezone
+
+
+class Clock:
+    def time(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.time(), tz=timezone.utc)
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
@@ -0,0 +1,119 @@
+import numpy as np
+
+
+class ServiceColumns:
+    """
+    The decision inputs of every service, one array entry per service. The resource arrays
+    are (services, resources), a service with fewer resources than the widest has NaN usage
+    in the columns it doesn't use. max_step_up and max_step_down are inf when not set.
+    """
+
+    def __init__(
+        self,
+        replicas: np.ndarray,
+        scale_min: np.ndarray,
+        scale_max: np.ndarray,
+        max_step_up: np.ndarray,
+        max_step_down: np.ndarray,
+        usage: np.ndarray,
+        fast_usage: np.ndarray,
+        up_threshold: np.ndarray,
+        down_threshold: np.ndarray,
+        target: np.ndarray,
+    ):
+        self.replicas = replicas
+        self.scale_min = scale_min
+        self.scale_max = scale_max
+        self.max_step_up = max_step_up
+        self.max_step_down = max_step_down
+        self.usage = usage
+        self.fast_usage = fast_usage
+        self.up_threshold = up_threshold
+        self.down_threshold = down_threshold
+        self.target = target
+
+
+class ReplicaDecisions:
+    """
+    The desired replicas of every service, and the diff of the services whose replicas change:
+    their indexes in the columns and their new replicas.
+    """
+
+    def __init__(
+        self,
+        replicas: np.ndarray,
+        scale_up: np.ndarray,
+        scale_down: np.ndarray,
+        indexes: np.ndarray,
+        new_replicas: np.ndarray,
+    ):
+        self.replicas = replicas
+        self.scale_up = scale_up
+        self.scale_down = scale_down
+        self.indexes = indexes
+        self.new_replicas = new_replicas
+
+
+def decide_replicas(columns: ServiceColumns) -> ReplicaDecisions:
+    """
+    Any resource over its up threshold on the fast signal scales up, and scaling down needs
+    every resource under its down threshold on the slow signal. A scaling service goes to the
+    highest of desired = ceil(replicas * usage / target) over its resources, limited by the
+    max steps and kept within scale_min and scale_max, and a service that isn't scaling is
+    kept within its min and max.
+    """
+    replicas = columns.replicas.astype(float)
+    has_resource = ~np.isnan(columns.usage)
+    has_any_resource = has_resource.any(axis=1)
+
+    with np.errstate(invalid="ignore"):
+        over_threshold = has_resource & (columns.fast_usage > columns.up_threshold)
+        under_threshold = ~has_resource | (columns.usage < columns.down_threshold)
+    scale_up = over_threshold.any(axis=1)
+    scale_down = under_threshold.all(axis=1) & has_any_resource & ~scale_up
+
+    # Scale up takes the higher signal, so it isn't undone by the slow one next tick.
+    usage = np.where(scale_up[:, None], np.fmax(columns.fast_usage, columns.usage), columns.usage)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # The small epsilon keeps float noise (e.g. 3 * 0.5 / 0.5) from adding a replica.
+        target_replicas = np.ceil(replicas[:, None] * usage / columns.target - 1e-9)
+    target_replicas = np.minimum(target_replicas, (replicas + columns.max_step_up)[:, None])
+    target_replicas = np.maximum(target_replicas, (replicas - columns.max_step_down)[:, None])
+    target_replicas = np.maximum(
+        columns.scale_min[:, None], np.minimum(columns.scale_max[:, None], target_replicas)
+    )
+    target_replicas = np.where(has_resource, target_replicas, -np.inf).max(axis=1, initial=-np.inf)
+
+    kept_replicas = np.maximum(columns.scale_min, np.minimum(columns.scale_max, replicas))
+    desired_replicas = np.where(
+        scale_up,
+        np.maximum(target_replicas, replicas),
+        np.where(scale_down, target_replicas, kept_replicas),
+    )
+    desired_replicas = np.where(has_any_resource, desired_replicas, replicas).astype(int)
+
+    indexes = np.flatnonzero(desired_replicas != columns.replicas)
+    return ReplicaDecisions(
+        replicas=desired_replicas,
+        scale_up=scale_up,
+        scale_down=scale_down,
+        indexes=indexes,
+        new_replicas=desired_replicas[indexes],
+    )
+
+
+def get_busy_services(columns: ServiceColumns, margin: float) -> np.ndarray:
+    """
+    Returns which services have a resource about to cross a threshold: the fast signal just
+    under the up threshold, or the slow signal just over the down threshold. The margin is a
+    share of the gap between the thresholds.
+    """
+    margins = margin * np.abs(columns.up_threshold - columns.down_threshold)
+    with np.errstate(invalid="ignore"):
+        near_up_threshold = (columns.fast_usage <= columns.up_threshold) & (
+            columns.fast_usage >= columns.up_threshold - margins
+        )
+        near_down_threshold = (columns.usage >= columns.down_threshold) & (
+            columns.usage <= columns.down_threshold + margins
+        )
+    return ((near_up_threshold | near_down_threshold) & ~np.isnan(columns.usage)).any(axis=1)
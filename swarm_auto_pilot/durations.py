@@ -0,0 +1,23 @@
+import re
+
+duration_pattern = re.compile(r"^(\d+)(ms|s|m|h|d|w|y)$")
+duration_units = {
+    "ms": 0.001,
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": 86400,
+    "w": 604800,
+    "y": 31536000,
+}
+
+
+def parse_duration(duration: str) -> float | None:
+    """
+    Returns the seconds of a single unit Prometheus duration, e.g. 30s or 5m, or None when the
+    duration isn't valid.
+    """
+    match = duration_pattern.match(duration)
+    if match is None:
+        return None
+    return int(match.group(1)) * duration_units[match.group(2)]
@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def fill_gaps(values: np.ndarray) -> np.ndarray:
+    """
+    Forward fills NaN samples along the time axis, leading NaN samples take the first known value.
+    """
+    filled = np.array(values, dtype=float)
+    sample_indexes = np.arange(filled.shape[1])
+
+    known = ~np.isnan(filled)
+    last_known = np.where(known, sample_indexes, 0)
+    np.maximum.accumulate(last_known, axis=1, out=last_known)
+    filled = np.take_along_axis(filled, last_known, axis=1)
+
+    first_known = np.where(known.any(axis=1), known.argmax(axis=1), 0)
+    first_values = filled[np.arange(filled.shape[0]), first_known]
+    leading = sample_indexes < first_known[:, None]
+    filled[leading] = np.broadcast_to(first_values[:, None], filled.shape)[leading]
+    return np.nan_to_num(filled, nan=0.0)
+
+
+def forecast(
+    values: np.ndarray,
+    horizon: int,
+    season_length: int = 0,
+    alpha: float = 0.5,
+    beta: float = 0.1,
+    gamma: float = 0.1,
+) -> np.ndarray:
+    """
+    Additive Holt-Winters forecast of every row of values (services, samples), horizon samples
+    ahead of the last sample. Falls back to Holt's linear trend when season_length is 0 or the
+    history holds less than two seasons.
+    """
+    values = fill_gaps(values)
+    service_count, sample_count = values.shape
+    if service_count == 0 or sample_count == 0:
+        return np.zeros(service_count)
+    if sample_count == 1:
+        return values[:, 0]
+
+    seasonal_enabled = season_length > 1 and sample_count >= 2 * season_length
+    if seasonal_enabled:
+        first_season = values[:, :season_length]
+        level = first_season.mean(axis=1)
+        trend = (values[:, season_length : 2 * season_length].mean(axis=1) - level) / season_length
+        season_offsets = np.arange(season_length) - (season_length - 1) / 2
+        seasonal = first_season - (level[:, None] + trend[:, None] * season_offsets)
+        # The loop starts from the first sample, so the level starts one sample before it.
+        level = level - trend * (season_length + 1) / 2
+    else:
+        season_length = 1
+        trend = values[:, 1] - values[:, 0]
+        level = values[:, 0] - trend
+        seasonal = np.zeros((service_count, 1))
+
+    for sample_index in range(sample_count):
+        season_index = sample_index % season_length
+        season = seasonal[:, season_index] if seasonal_enabled else 0.0
+        observed = values[:, sample_index]
+
+        previous_level = level
+        level = alpha * (observed - season) + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+        if seasonal_enabled:
+            seasonal[:, season_index] = gamma * (observed - level) + (1 - gamma) * season
+
+    predicted = level + horizon * trend
+    if seasonal_enabled:
+        predicted = predicted + seasonal[:, (sample_count - 1 + horizon) % season_length]
+    return np.maximum(predicted, 0.0)
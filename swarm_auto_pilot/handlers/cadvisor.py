@@ -0,0 +1,291 @@
+import logging
+import re
+import socket
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Union
+
+from handlers.metrics import MetricsHandler
+from sessions import create_session
+
+sample_pattern = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)(?:\s+(-?\d+))?$")
+label_pattern = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+scraped_metrics = (
+    b"container_cpu_usage_seconds_total",
+    b"container_memory_working_set_bytes",
+    b"machine_cpu_cores",
+    b"machine_memory_bytes",
+)
+
+
+class CadvisorSnapshot:
+    def __init__(
+        self,
+        scraped_at: float,
+        total_cpu_cores: float,
+        total_memory: float,
+        services_cpu_usage: dict[str, float],
+        services_memory_usage: dict[str, float],
+        nodes_cpu_usage: dict[str, float],
+    ):
+        self.scraped_at = scraped_at
+        self.total_cpu_cores = total_cpu_cores
+        self.total_memory = total_memory
+        self.services_cpu_usage = services_cpu_usage
+        self.services_memory_usage = services_memory_usage
+        self.nodes_cpu_usage = nodes_cpu_usage
+
+
+class CadvisorHandler(MetricsHandler):
+    """
+    Scrapes cAdvisor on every node directly, in place of Prometheus. The cAdvisor tasks are
+    found through the swarm's tasks.<service> DNS name, and CPU rates are computed from the
+    previous scrape of every container.
+    """
+
+    # Calls within a tick share one scrape.
+    snapshot_max_age = 5.0
+
+    def __init__(self, address: str, port: int, timeout: float, pool_size: int):
+        self.address = address
+        self.port = port
+        self.session = create_session(backend="cadvisor", timeout=timeout, pool_size=pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="cadvisor")
+        self.previous_cpu_usage = None
+        self.snapshot = None
+        self.scrape_future = None
+        self.lock = threading.Lock()
+
+    def ping(self) -> bool:
+        retry_count = 0
+        while retry_count < 9:
+            if self.get_snapshot(max_age=0) is not None:
+                return True
+
+            time.sleep(10)
+            retry_count += 1
+        return False
+
+    def get_endpoints(self) -> list[str]:
+        try:
+            addresses = socket.getaddrinfo(self.address, self.port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            logging.error("Couldn't resolve cAdvisor tasks: %s.", self.address)
+            return []
+
+        endpoints = set()
+        for _, _, _, _, socket_address in addresses:
+            host = socket_address[0]
+            if ":" in host:
+                host = f"[{host}]"
+            endpoints.add(f"http://{host}:{self.port}/metrics")
+        return sorted(endpoints)
+
+    def scrape(self, endpoint: str) -> list[tuple[str, dict, float, float]] | None:
+        """
+        Returns the (name, labels, value, timestamp) samples of the scraped metrics, reading the
+        exposition format line by line and skipping every other metric.
+        """
+        try:
+            response = self.session.get(endpoint, stream=True)
+            scraped_at = time.time()
+            if response.status_code != 200:
+                logging.error(
+                    "Error scraping cAdvisor: %s, status code: %s.", endpoint, response.status_code
+                )
+                return None
+
+            samples = []
+            for line in response.iter_lines():
+                if not line.startswith(scraped_metrics):
+                    continue
+
+                match = sample_pattern.match(line.decode("utf-8"))
+                if match is None:
+                    continue
+                name, labels, value, timestamp = match.groups()
+                samples.append(
+                    (
+                        name,
+                        dict(label_pattern.findall(labels or "")),
+                        float(value),
+                        int(timestamp) / 1000 if timestamp else scraped_at,
+                    )
+                )
+            return samples
+        except Exception:
+            logging.exception("Error scraping cAdvisor: %s.", endpoint)
+            return None
+
+    def get_snapshot(self, max_age: float | None = None) -> CadvisorSnapshot | None:
+        """
+        Returns the last snapshot while it's fresh, otherwise scrapes every node. Callers that
+        come in during a scrape wait for it instead of starting their own.
+        """
+        max_age = self.snapshot_max_age if max_age is None else max_age
+        with self.lock:
+            if self.snapshot is not None and time.time() - self.snapshot.scraped_at < max_age:
+                return self.snapshot
+            scraping = self.scrape_future is None
+            if scraping:
+                self.scrape_future = Future()
+            scrape_future = self.scrape_future
+
+        if not scraping:
+            return scrape_future.result()
+
+        try:
+            snapshot = self.__scrape_snapshot()
+        except Exception as error:
+            scrape_future.set_exception(error)
+            raise
+        else:
+            scrape_future.set_result(snapshot)
+            return snapshot
+        finally:
+            with self.lock:
+                self.scrape_future = None
+
+    def __scrape_snapshot(self) -> CadvisorSnapshot | None:
+        endpoints = self.get_endpoints()
+        scrapes = list(self.executor.map(self.scrape, endpoints))
+        if not any(samples is not None for samples in scrapes):
+            return None
+
+        with self.lock:
+            previous_cpu_usage = self.previous_cpu_usage
+
+        total_cpu_cores = 0.0
+        total_memory = 0.0
+        services_cpu_usage = {}
+        services_memory_usage = {}
+        nodes_cpu_usage = {}
+        cpu_usage = {}
+        for endpoint, samples in zip(endpoints, scrapes):
+            for name, labels, value, timestamp in samples or []:
+                if name == "machine_cpu_cores":
+                    total_cpu_cores += value
+                    continue
+                if name == "machine_memory_bytes":
+                    total_memory += (value / 1024) / 1024
+                    continue
+                if not labels.get("container_label_com_docker_swarm_task_name"):
+                    continue
+
+                service_name = labels.get("container_label_com_docker_swarm_service_name", "")
+                if name == "container_memory_working_set_bytes":
+                    services_memory_usage[service_name] = (
+                        services_memory_usage.get(service_name, 0.0) + (value / 1024) / 1024
+                    )
+                    continue
+
+                container = (
+                    endpoint,
+                    labels.get("id", labels.get("name", "")),
+                    labels.get("cpu", ""),
+                )
+                cpu_usage[container] = (timestamp, value)
+                rate = self.__get_rate(
+                    previous=(previous_cpu_usage or {}).get(container),
+                    current=(timestamp, value),
+                )
+                if rate is None:
+                    continue
+                services_cpu_usage[service_name] = services_cpu_usage.get(service_name, 0.0) + rate
+                node_id = labels.get("container_label_com_docker_swarm_node_id", "")
+                nodes_cpu_usage[node_id] = nodes_cpu_usage.get(node_id, 0.0) + rate
+
+        # Containers on nodes that failed to scrape keep their previous sample, so their next
+        # rate spans both scrapes instead of being missed.
+        failed_endpoints = {
+            endpoint for endpoint, samples in zip(endpoints, scrapes) if samples is None
+        }
+        for container, sample in (previous_cpu_usage or {}).items():
+            if container[0] in failed_endpoints:
+                cpu_usage[container] = sample
+
+        snapshot = CadvisorSnapshot(
+            scraped_at=time.time(),
+            total_cpu_cores=total_cpu_cores,
+            total_memory=total_memory,
+            services_cpu_usage=services_cpu_usage,
+            services_memory_usage=services_memory_usage,
+            nodes_cpu_usage=nodes_cpu_usage,
+        )
+        # Only the first scrape has no rates, later scrapes only miss new containers.
+        first_scrape = previous_cpu_usage is None
+        with self.lock:
+            self.previous_cpu_usage = cpu_usage
+            if first_scrape:
+                return None
+            self.snapshot = snapshot
+
+        logging.debug(
+            "Scraped %s cAdvisor endpoints, services: %s.",
+            len(endpoints),
+            len(services_memory_usage),
+        )
+        return snapshot
+
+    @staticmethod
+    def __get_rate(
+        previous: tuple[float, float] | None, current: tuple[float, float]
+    ) -> float | None:
+        if previous is None or current[0] <= previous[0]:
+            return None
+        # A counter that went down was reset, it counts from zero again.
+        increase = current[1] - previous[1] if current[1] >= previous[1] else current[1]
+        return increase / (current[0] - previous[0])
+
+    def get_total_resources(
+        self, reserved_cores: float, reserved_memory: float
+    ) -> Union[float, float] | Union[None, None]:
+        snapshot = self.get_snapshot()
+        if snapshot is None or snapshot.total_cpu_cores == 0:
+            return None, None
+        return (
+            snapshot.total_cpu_cores - reserved_cores,
+            snapshot.total_memory - reserved_memory,
+        )
+
+    def get_services_usage(
+        self, service_windows: dict[str, tuple[str, str]] | None = None
+    ) -> Union[list, float, float] | Union[None, float, float]:
+        # The rates span one scrape interval, there's no longer window to take them over.
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return None, 0, 0
+
+        service_names = set(snapshot.services_cpu_usage) | set(snapshot.services_memory_usage)
+        services = [
+            {
+                "name": service_name,
+                "cpu_usage": snapshot.services_cpu_usage.get(service_name, 0.0),
+                "fast_cpu_usage": snapshot.services_cpu_usage.get(service_name, 0.0),
+                "memory_usage": snapshot.services_memory_usage.get(service_name, 0.0),
+            }
+            for service_name in sorted(service_names)
+        ]
+        return (
+            services,
+            sum(snapshot.services_cpu_usage.values()),
+            sum(snapshot.services_memory_usage.values()),
+        )
+
+    def get_services_usage_range(self, start: float, end: float, step: float):
+        logging.debug("cAdvisor keeps no usage history.")
+        return None, None, None
+
+    def get_custom_metrics(self, queries: list[str], budget: float) -> dict[str, float]:
+        logging.error(
+            "cAdvisor can't evaluate PromQL, custom metrics need the Prometheus backend."
+        )
+        return {}
+
+    def get_nodes_usage(self) -> dict[str, float] | None:
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return None
+        return dict(snapshot.nodes_cpu_usage)
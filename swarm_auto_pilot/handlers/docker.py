@@ -1,13 +1,37 @@
+import json
 import logging
+import random
+import threading
+import time
 
-import requests
-import requests_unixsocket
+from durations import parse_duration
+from sessions import BackendSession, create_session
+from telemetry import cache_requests
 
 docker_base_url = "http+unix://%2Fvar%2Frun%2Fdocker.sock"
 
+metric_label_prefix = "autopilot.metric."
+
+
+class CustomMetric:
+    """
+    A PromQL query a service scales on, kept at target. An average metric, like queue depth
+    or requests per second, is shared by the replicas and targeted per replica, otherwise the
+    value itself is targeted, like p99 latency.
+    """
+
+    def __init__(self, name: str, query: str, target: float, average: bool):
+        self.name = name
+        self.query = query
+        self.target = target
+        self.average = average
+
 
 class DockerService:
-    def __init__(self, docker_object_json):
+    def __init__(self, docker_object_json, session: BackendSession, rate_window_min: float = 60.0):
+        self.session = session
+        # A rate needs two samples in its window, twice the Prometheus scrape interval.
+        self.rate_window_min = rate_window_min
         self.__create_object(docker_object_json=docker_object_json)
         self.__create_labels()
         self.__create_limits()
@@ -35,8 +59,8 @@ class DockerService:
             else {}
         )
 
-        self.labels = docker_object_json["Spec"]["TaskTemplate"]["ContainerSpec"]["Labels"]
-        self.resources = docker_object_json["Spec"]["TaskTemplate"]["Resources"]
+        self.labels = self.task_template.get("ContainerSpec", {}).get("Labels", {})
+        self.resources = self.task_template.get("Resources", {})
         self.mode_object = docker_object_json["Spec"]["Mode"]
 
     def __create_labels(self):
@@ -51,20 +75,99 @@ class DockerService:
         scale_max = self.labels.get("autopilot.scale_max", "10000000")
         self.autopilot_scale_max = int(scale_max)
 
+        max_step_up = self.labels.get("autopilot.max_step_up", None)
+        self.autopilot_max_step_up = int(max_step_up) if max_step_up is not None else None
+
+        max_step_down = self.labels.get("autopilot.max_step_down", None)
+        self.autopilot_max_step_down = int(max_step_down) if max_step_down is not None else None
+
+        cpu_target = self.labels.get("autopilot.cpu_target", None)
+        self.autopilot_cpu_target = float(cpu_target) if cpu_target is not None else None
+
+        memory_target = self.labels.get("autopilot.memory_target", None)
+        self.autopilot_memory_target = float(memory_target) if memory_target is not None else None
+
+        scale_up_window = self.labels.get("autopilot.scale_up_window", None)
+        self.autopilot_scale_up_window = (
+            float(scale_up_window) if scale_up_window is not None else None
+        )
+
+        scale_down_window = self.labels.get("autopilot.scale_down_window", None)
+        self.autopilot_scale_down_window = (
+            float(scale_down_window) if scale_down_window is not None else None
+        )
+
+        cooldown = self.labels.get("autopilot.cooldown", None)
+        self.autopilot_cooldown = float(cooldown) if cooldown is not None else None
+
+        self.autopilot_fast_window = self.__get_rate_window("autopilot.fast_window")
+        self.autopilot_slow_window = self.__get_rate_window("autopilot.slow_window")
+
+        self.autopilot_metrics = self.__get_metrics()
+
+    def __get_rate_window(self, label: str) -> str | None:
+        window = self.labels.get(label, None)
+        if window is None:
+            return None
+
+        seconds = parse_duration(window)
+        if seconds is None or seconds < self.rate_window_min:
+            logging.error(
+                "Service: %s has %s: %s, which must be a Prometheus duration of at least %ss, using the default.",
+                self.name,
+                label,
+                window,
+                self.rate_window_min,
+            )
+            return None
+        return window
+
+    def __get_metrics(self) -> list[CustomMetric]:
+        """
+        Reads autopilot.metric.query, .target and .type (average or value), or the same labels
+        named like autopilot.metric.<name>.query to scale on more than one metric.
+        """
+        metrics = []
+        for label, query in self.labels.items():
+            if not label.startswith(metric_label_prefix) or not label.endswith(".query"):
+                continue
+
+            prefix = label.removesuffix("query")
+            name = prefix.removeprefix(metric_label_prefix).rstrip(".") or "metric"
+            target = self.labels.get(f"{prefix}target", None)
+            metric_type = self.labels.get(f"{prefix}type", "average")
+            try:
+                target = float(target)
+            except (TypeError, ValueError):
+                target = None
+            if target is None or target <= 0 or metric_type not in ["average", "value"]:
+                logging.error(
+                    "Service: %s has metric: %s without a positive %starget or with a type other than average or value, skipping it.",
+                    self.name,
+                    name,
+                    prefix,
+                )
+                continue
+
+            metrics.append(
+                CustomMetric(
+                    name=name, query=query, target=target, average=metric_type == "average"
+                )
+            )
+        return metrics
+
     def __create_limits(self):
-        limits = self.resources.get("Limits", None)
-        if limits is None:
-            self.cpu_limits = None
-            self.memory_limits = None
-            return
+        self.cpu_limits, self.memory_limits = self.__get_resources("Limits")
+        self.cpu_reservations, self.memory_reservations = self.__get_resources("Reservations")
 
-        nano_cpus = limits.get("NanoCPUs", None)
-        memory_bytes = limits.get("MemoryBytes", None)
+    def __get_resources(self, resource_type: str) -> tuple[float | None, float | None]:
+        resources = self.resources.get(resource_type, None) or {}
+        nano_cpus = resources.get("NanoCPUs", None)
+        memory_bytes = resources.get("MemoryBytes", None)
 
-        if nano_cpus is not None:
-            self.cpu_limits = nano_cpus / 1000000000
-        if memory_bytes is not None:
-            self.memory_limits = (memory_bytes / 1024) / 1024
+        cpus = nano_cpus / 1000000000 if nano_cpus else None
+        memory = (memory_bytes / 1024) / 1024 if memory_bytes else None
+        return cpus, memory
 
     def __create_mode(self):
         self.mode = self.mode_object.get("Replicated", "Global")
@@ -75,8 +178,17 @@ class DockerService:
         self.replicas = self.mode.get("Replicas", None)
         self.mode = "Replicated"
 
+    def get_task_size(self) -> tuple[float, float]:
+        """
+        Returns the CPU and memory (MiB) a task needs on a node, the reservations where set,
+        otherwise the limits.
+        """
+        cpu = self.cpu_reservations or self.cpu_limits or 0.0
+        memory = self.memory_reservations or self.memory_limits or 0.0
+        return cpu, memory
+
     def get_version(self):
-        response = requests.get(f"{docker_base_url}/services/{self.id}")
+        response = self.session.get(f"{docker_base_url}/services/{self.id}")
 
         if response.status_code != 200:
             logging.error(
@@ -86,7 +198,7 @@ class DockerService:
         response_json = response.json()
         self.version = response_json["Version"]["Index"]
 
-    def scale(self, new_replicas: int):
+    def scale(self, new_replicas: int) -> bool:
         logging.debug("Trying to scale up service: %s", self.name)
         payload = {
             "Name": self.name,
@@ -96,8 +208,8 @@ class DockerService:
             "RollbackConfig": self.rollback_config,
             "EndpointSpec": self.endpoint_spec,
         }
-        response = requests.post(
-            f"{docker_base_url}/services/{id}/update?version={self.version}", json=payload
+        response = self.session.post(
+            f"{docker_base_url}/services/{self.id}/update?version={self.version}", json=payload
         )
 
         if response.status_code != 200:
@@ -107,47 +219,66 @@ class DockerService:
                 new_replicas,
                 response.text,
             )
-            return
+            return False
         logging.info("Scale of service: %s, to replicas: %s succeeded.", self.name, new_replicas)
+        self.replicas = new_replicas
         self.get_version()
+        return True
 
 
 class DockerNode:
-    def __init__(self, docker_object_json: dict):
+    def __init__(self, docker_object_json: dict, session: BackendSession):
+        self.session = session
         self.__create_object(docker_object_json=docker_object_json)
 
     def __create_object(self, docker_object_json: dict):
         self.id = docker_object_json["ID"]
         self.version = docker_object_json["Version"]["Index"]
         self.name = docker_object_json["Description"]["Hostname"]
+        self.spec = docker_object_json["Spec"]
         self.role = docker_object_json["Spec"]["Role"]
+        self.availability = docker_object_json["Spec"].get("Availability", "active")
+        self.state = docker_object_json.get("Status", {}).get("State", "unknown")
+
+        resources = docker_object_json["Description"].get("Resources", {})
+        self.cpu_cores = resources.get("NanoCPUs", 0) / 1000000000
+        self.memory = (resources.get("MemoryBytes", 0) / 1024) / 1024
 
     def get_version(self):
-        response = requests.get(f"{docker_base_url}/nodes/{self.id}")
+        response = self.session.get(f"{docker_base_url}/nodes/{self.id}")
         if response.status_code != 200:
             logging.error("Error getting version of node: %s.", self.name)
             return
         response_json = response.json()
         self.version = response_json["Version"]["Index"]
+        self.spec = response_json["Spec"]
 
-    def drain(self):
-        payload = {
-            "Name": self.name,
-            "Labels": {"draining": "true"},
-            "Role": self.role,
-            "Availability": "drain",
-        }
-        response = requests.post(
+    def __update_availability(self, availability: str) -> bool:
+        # The whole spec is sent back, so the node keeps its labels and role.
+        payload = dict(self.spec, Availability=availability)
+        response = self.session.post(
             f"{docker_base_url}/nodes/{self.id}/update?version={self.version}", json=payload
         )
         if response.status_code != 200:
-            logging.error("Error draining node: %s, version: %s.", self.name, self.version)
+            logging.error(
+                "Error setting availability of node: %s to %s, version: %s.",
+                self.name,
+                availability,
+                self.version,
+            )
             return False
+        self.availability = availability
         self.get_version()
         return True
 
+    def drain(self):
+        return self.__update_availability("drain")
+
+    def activate(self):
+        return self.__update_availability("active")
+
     def confirm_drain(self):
-        response = requests.get(
+        response = self.session.get(
             f"{docker_base_url}/tasks?filters=%7B%22node%22%3A%5B%22{self.id}%22%5D%7D"
         )
 
@@ -165,7 +296,7 @@ class DockerNode:
         return drain_completed
 
     def remove(self):
-        response = requests.delete(f"{docker_base_url}/nodes/{self.id}?force=true")
+        response = self.session.delete(f"{docker_base_url}/nodes/{self.id}?force=true")
         if response.status_code != 200:
             logging.error(
                 "Error deleting node from swarm: %s, status code: %s",
@@ -173,48 +304,291 @@ class DockerNode:
                 response.status_code,
             )
             return False
-        self.get_version()
+        # The node is gone, there's no version left to fetch.
         return True
 
 
 class DockerHandler:
-    def __init__(self):
-        requests_unixsocket.monkeypatch()
+    def __init__(self, timeout: float, pool_size: int):
+        self.session = create_session(backend="docker", timeout=timeout, pool_size=pool_size)
 
     def ping(self) -> bool:
-        response = requests.get(f"{docker_base_url}/_ping")
+        response = self.session.get(f"{docker_base_url}/_ping")
         if response.status_code == 200:
             return True
         return False
 
-    def get_service(self, service_name: str) -> DockerService | None:
-        response = requests.get(
-            f"{docker_base_url}/services?filters=%7B%22name%22%3A%5B%22{service_name}%22%5D%7D"
-        )
+    def get_services(self) -> dict[str, DockerService] | None:
+        response = self.session.get(f"{docker_base_url}/services")
         if response.status_code != 200:
+            logging.error("Error getting services, error: %s.", response.text)
             return None
 
-        response_json = response.json()
-        if len(response_json) == 0:
-            return None
+        docker_services = {}
+        for docker_object_json in response.json():
+            docker_service = DockerService(
+                docker_object_json=docker_object_json, session=self.session
+            )
+            docker_services[docker_service.name] = docker_service
+        return docker_services
+
+
+class DockerStateCache:
+    """
+    Services and nodes follow the Docker events. Task state changes don't come as service or
+    node events, so the tasks the swarm wants running are refreshed every tick instead.
+    """
+
+    backoff_base = 1.0
+    backoff_max = 60.0
+
+    def __init__(
+        self, session: BackendSession, resync_interval: int = 300, rate_window_min: float = 60.0
+    ):
+        self.session = session
+        self.resync_interval = resync_interval
+        self.rate_window_min = rate_window_min
+        self.services = {}
+        self.nodes = {}
+        self.tasks = {}
+        self.last_resync = None
+        self.tasks_filters = json.dumps({"desired-state": ["running"]})
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self) -> bool:
+        if self.thread is not None:
+            return True
+
+        resync_response = self.resync()
+        self.thread = threading.Thread(target=self.__follow_events, daemon=True)
+        self.thread.start()
+        return resync_response
+
+    def resync(self) -> bool:
+        responses = {}
+        for resource in ["services", "nodes", "tasks"]:
+            params = {"filters": self.tasks_filters} if resource == "tasks" else None
+            response = self.session.get(f"{docker_base_url}/{resource}", params=params)
+            if response.status_code != 200:
+                logging.error("Error resyncing %s, error: %s.", resource, response.text)
+                return False
+            responses[resource] = response.json()
+
+        services = {}
+        for docker_object_json in responses["services"]:
+            docker_service = DockerService(
+                docker_object_json=docker_object_json,
+                session=self.session,
+                rate_window_min=self.rate_window_min,
+            )
+            services[docker_service.id] = docker_service
+        nodes = {}
+        for docker_object_json in responses["nodes"]:
+            docker_node = DockerNode(docker_object_json=docker_object_json, session=self.session)
+            nodes[docker_node.id] = docker_node
+        tasks = {task["ID"]: task for task in responses["tasks"]}
+
+        with self.lock:
+            self.services = services
+            self.nodes = nodes
+            self.tasks = tasks
+            self.last_resync = time.time()
+        logging.debug(
+            "Resynced Docker state, services: %s, nodes: %s, tasks: %s.",
+            len(services),
+            len(nodes),
+            len(tasks),
+        )
+        return True
 
-        docker_service = DockerService(docker_object_json=response_json[0])
-        return docker_service
+    def __follow_events(self):
+        failures = 0
+        while True:
+            since = int(self.last_resync) if self.last_resync is not None else int(time.time())
+            until = since + self.resync_interval
+            filters = json.dumps({"type": ["service", "node"]})
+            try:
+                response = self.session.get(
+                    f"{docker_base_url}/events",
+                    params={"since": since, "until": until, "filters": filters},
+                    stream=True,
+                    timeout=(self.session.timeout, None),
+                )
+                if response.status_code != 200:
+                    logging.error("Error following Docker events, error: %s.", response.text)
+                else:
+                    for line in response.iter_lines():
+                        if line:
+                            self.__handle_event(json.loads(line))
+            except Exception:
+                logging.exception("Docker events stream was interrupted.")
+
+            # The stream only ends on its own at until, ending sooner means it failed.
+            if self.resync() is True and time.time() >= until:
+                failures = 0
+                continue
+
+            failures += 1
+            delay = self.__get_backoff_delay(failures)
+            logging.warning("Following Docker events again in %.1fs.", delay)
+            time.sleep(delay)
+
+    def __get_backoff_delay(self, failures: int) -> float:
+        """
+        Exponential backoff with equal jitter, capped at the backoff max.
+        """
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** (failures - 1))
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def __handle_event(self, event: dict):
+        event_type = event["Type"]
+        event_action = event["Action"]
+        object_id = event["Actor"]["ID"]
+        logging.debug("Docker event: %s %s, id: %s.", event_type, event_action, object_id)
+
+        if event_type == "service":
+            if event_action == "remove":
+                with self.lock:
+                    self.services.pop(object_id, None)
+                    self.tasks = {
+                        task_id: task
+                        for task_id, task in self.tasks.items()
+                        if task["ServiceID"] != object_id
+                    }
+                return
+            self.__refresh_service(service_id=object_id)
+        elif event_type == "node":
+            if event_action == "remove":
+                with self.lock:
+                    self.nodes.pop(object_id, None)
+                return
+            self.__refresh_node(node_id=object_id)
+
+    def __refresh_service(self, service_id: str):
+        response = self.session.get(f"{docker_base_url}/services/{service_id}")
+        if response.status_code != 200:
+            logging.error("Error refreshing service: %s, error: %s.", service_id, response.text)
+            return
+        docker_service = DockerService(
+            docker_object_json=response.json(),
+            session=self.session,
+            rate_window_min=self.rate_window_min,
+        )
 
-    def get_node_info(self, node_name: str) -> DockerNode | None:
-        response = requests.get(
-            f"{docker_base_url}/nodes?filters=%7B%22name%22%3A%5B%22{node_name}%22%5D%7D"
+        filters = json.dumps({"service": [service_id], "desired-state": ["running"]})
+        response = self.session.get(f"{docker_base_url}/tasks", params={"filters": filters})
+        if response.status_code != 200:
+            logging.error("Error refreshing tasks of service: %s.", docker_service.name)
+            return
+        service_tasks = {task["ID"]: task for task in response.json()}
+
+        with self.lock:
+            self.services[service_id] = docker_service
+            self.tasks = {
+                task_id: task
+                for task_id, task in self.tasks.items()
+                if task["ServiceID"] != service_id
+            }
+            self.tasks.update(service_tasks)
+
+    def refresh_tasks(self) -> bool:
+        """
+        Replaces the tasks with the ones the swarm wants running, in one request.
+        """
+        response = self.session.get(
+            f"{docker_base_url}/tasks", params={"filters": self.tasks_filters}
         )
+        if response.status_code != 200:
+            logging.error("Error refreshing tasks, error: %s.", response.text)
+            return False
+        tasks = {task["ID"]: task for task in response.json()}
+
+        with self.lock:
+            self.tasks = tasks
+        return True
 
+    def __refresh_node(self, node_id: str):
+        response = self.session.get(f"{docker_base_url}/nodes/{node_id}")
         if response.status_code != 200:
-            logging.error("Error getting node id of: %s, error: %s.", node_name, response.text)
-            return None
+            logging.error("Error refreshing node: %s, error: %s.", node_id, response.text)
+            return
+        docker_node = DockerNode(docker_object_json=response.json(), session=self.session)
 
-        response_json = response.json()
+        with self.lock:
+            self.nodes[node_id] = docker_node
 
-        if len(response_json) == 0:
-            logging.error("Couldn't find docker node: %s.", node_name)
+    def get_services(self) -> dict[str, DockerService] | None:
+        if self.last_resync is None:
+            cache_requests.labels(cache="docker_services", result="miss").inc()
             return None
 
-        node = DockerNode(response_json[0])
-        return node
+        # The events thread resyncs at least every resync interval, unless it's failing.
+        resync_age = time.time() - self.last_resync
+        if resync_age > 2 * self.resync_interval:
+            cache_requests.labels(cache="docker_services", result="miss").inc()
+            logging.warning("Docker state was resynced %.0fs ago, resyncing.", resync_age)
+            if self.resync() is False:
+                return None
+        else:
+            cache_requests.labels(cache="docker_services", result="hit").inc()
+        with self.lock:
+            return {
+                docker_service.name: docker_service for docker_service in self.services.values()
+            }
+
+    def get_nodes(self) -> list[DockerNode]:
+        with self.lock:
+            return list(self.nodes.values())
+
+    def get_nodes_by_name(self) -> dict[str, DockerNode]:
+        with self.lock:
+            return {docker_node.name: docker_node for docker_node in self.nodes.values()}
+
+    def get_node_loads(self) -> dict[str, tuple[float, float]]:
+        """
+        Returns the CPU and memory (MiB) the running tasks on every node need, by node id.
+        """
+        node_loads = {}
+        with self.lock:
+            for task in self.tasks.values():
+                docker_service = self.services.get(task["ServiceID"], None)
+                node_id = task.get("NodeID", None)
+                if docker_service is None or not node_id or task["Status"]["State"] != "running":
+                    continue
+
+                cpu, memory = docker_service.get_task_size()
+                node_cpu, node_memory = node_loads.get(node_id, (0.0, 0.0))
+                node_loads[node_id] = (node_cpu + cpu, node_memory + memory)
+        return node_loads
+
+    def get_node_task_counts(self) -> dict[str, int]:
+        with self.lock:
+            task_counts = {}
+            for task in self.tasks.values():
+                node_id = task.get("NodeID", None)
+                if node_id and task["Status"]["State"] == "running":
+                    task_counts[node_id] = task_counts.get(node_id, 0) + 1
+            return task_counts
+
+    def get_unschedulable_tasks(self) -> list[dict]:
+        """
+        Returns the tasks the swarm scheduler couldn't place because no node has the resources
+        they reserve.
+        """
+        with self.lock:
+            return [
+                task
+                for task in self.tasks.values()
+                if task["Status"]["State"] == "pending"
+                and "insufficient resources" in task["Status"].get("Err", "")
+            ]
+
+    def get_running_task_counts(self) -> dict[str, int]:
+        with self.lock:
+            task_counts = {}
+            for task in self.tasks.values():
+                if task["Status"]["State"] == "running":
+                    service_id = task["ServiceID"]
+                    task_counts[service_id] = task_counts.get(service_id, 0) + 1
+            return task_counts
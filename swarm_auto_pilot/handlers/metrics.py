@@ -0,0 +1,52 @@
+from typing import Union
+
+import numpy as np
+
+
+class MetricsHandler:
+    """
+    Source of the resource usage the pilot scales on. CPU is in cores and memory in MiB.
+    """
+
+    def ping(self) -> bool:
+        raise NotImplementedError("A metrics backend must implement this method.")
+
+    def get_total_resources(
+        self, reserved_cores: float, reserved_memory: float
+    ) -> Union[float, float] | Union[None, None]:
+        """
+        Returns the CPU cores and memory of the swarm, less the reserved resources.
+        """
+        raise NotImplementedError("A metrics backend must implement this method.")
+
+    def get_services_usage(
+        self, service_windows: dict[str, tuple[str, str]] | None = None
+    ) -> Union[list, float, float] | Union[None, float, float]:
+        """
+        Returns a list of {"name", "cpu_usage", "fast_cpu_usage", "memory_usage"} per service,
+        and the total CPU and memory usage of the services. cpu_usage is averaged over the slow
+        window, fast_cpu_usage over the fast window or None when it has no rate, both can be
+        overridden per service with service_windows, (fast, slow) by service name.
+        """
+        raise NotImplementedError("A metrics backend must implement this method.")
+
+    def get_services_usage_range(
+        self, start: float, end: float, step: float
+    ) -> Union[list, np.ndarray, np.ndarray] | Union[None, None, None]:
+        """
+        Returns the service names and two (services, samples) arrays of CPU and memory usage on
+        the start/step grid, or None when the backend keeps no history.
+        """
+        raise NotImplementedError("A metrics backend must implement this method.")
+
+    def get_custom_metrics(self, queries: list[str], budget: float) -> dict[str, float]:
+        """
+        Returns the value of every query answered within the budget (seconds), by query.
+        """
+        raise NotImplementedError("A metrics backend must implement this method.")
+
+    def get_nodes_usage(self) -> dict[str, float] | None:
+        """
+        Returns the CPU cores the tasks use on every node, by Docker node id.
+        """
+        raise NotImplementedError("A metrics backend must implement this method.")
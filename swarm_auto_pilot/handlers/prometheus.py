@@ -1,17 +1,58 @@
+import logging
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Union
 
-import requests
+import numpy as np
+from durations import parse_duration
+from handlers.metrics import MetricsHandler
+from sessions import create_session
 
+services_usage_query = (
+    "label_replace(sum(rate(container_cpu_usage_seconds_total{container_label_com_docker_swarm_task_name=~'.+'}[5m]))"
+    'BY(container_label_com_docker_swarm_service_name), "resource", "cpu", "", "")'
+    " or label_replace(sum(container_memory_working_set_bytes{container_label_com_docker_swarm_task_name=~'.+'})"
+    'BY(container_label_com_docker_swarm_service_name), "resource", "memory", "", "")'
+)
 
-class PrometheusHandler:
-    def __init__(self):
+
+def get_services_usage_query(windows: list[str]) -> str:
+    """
+    Query for the CPU usage rate of every service over each of the windows, labelled by window,
+    and the memory usage of every service.
+    """
+    cpu_queries = [
+        "label_replace(label_replace(sum(rate(container_cpu_usage_seconds_total{container_label_com_docker_swarm_task_name=~'.+'}"
+        f"[{window}]))BY(container_label_com_docker_swarm_service_name)"
+        f', "resource", "cpu", "", ""), "window", "{window}", "", "")'
+        for window in windows
+    ]
+    memory_query = (
+        "label_replace(sum(container_memory_working_set_bytes{container_label_com_docker_swarm_task_name=~'.+'})"
+        'BY(container_label_com_docker_swarm_service_name), "resource", "memory", "", "")'
+    )
+    return " or ".join(cpu_queries + [memory_query])
+
+
+nodes_usage_query = (
+    "sum(rate(container_cpu_usage_seconds_total{container_label_com_docker_swarm_task_name=~'.+'}[5m]))"
+    " BY(container_label_com_docker_swarm_node_id)"
+)
+
+
+class PrometheusHandler(MetricsHandler):
+    def __init__(self, timeout: float, pool_size: int, fast_window: str, slow_window: str):
         self.base_url = "http://prometheus:9090"
+        self.fast_window = fast_window
+        self.slow_window = slow_window
+        self.session = create_session(backend="prometheus", timeout=timeout, pool_size=pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="prometheus")
 
     def ping(self) -> bool:
         retry_count = 0
         while retry_count < 9:
-            response = requests.get(f"{self.base_url}/api/v1/status/config")
+            response = self.session.get(f"{self.base_url}/api/v1/status/config")
             if response.status_code == 200:
                 json_response = response.json()
                 status = json_response["status"]
@@ -22,11 +63,8 @@ class PrometheusHandler:
             retry_count += 1
         return False
 
-    def get_total_cpu_cores(self, reserved_cores: float) -> int | None:
-        """
-        Query: sum(machine_cpu_cores)
-        """
-        response = requests.get(f"{self.base_url}/api/v1/query?query=sum%28machine_cpu_cores%29")
+    def query(self, query: str) -> list | None:
+        response = self.session.get(f"{self.base_url}/api/v1/query", params={"query": query})
         if response.status_code != 200:
             return None
 
@@ -35,40 +73,201 @@ class PrometheusHandler:
         if status != "success":
             return None
 
-        metrics = json_response["data"]["result"]
-        if len(metrics) == 0:
+        return json_response["data"]["result"]
+
+    def query_range(self, query: str, start: float, end: float, step: float) -> list | None:
+        response = self.session.get(
+            f"{self.base_url}/api/v1/query_range",
+            params={"query": query, "start": start, "end": end, "step": step},
+        )
+        if response.status_code != 200:
             return None
 
-        metric = metrics[0]["value"][1]
-        total_cpu_cores = float(metric)
-        total_cpu_cores = total_cpu_cores - reserved_cores
-        return total_cpu_cores
+        json_response = response.json()
+        status = json_response["status"]
+        if status != "success":
+            return None
+
+        return json_response["data"]["result"]
 
-    def get_services_cpu_usage(self) -> Union[list, float] | Union[None, float]:
+    def get_total_resources(
+        self, reserved_cores: float, reserved_memory: float
+    ) -> Union[float, float] | Union[None, None]:
         """
-        Query: sum(rate(container_cpu_usage_seconds_total{container_label_com_docker_swarm_task_name=~'.+'}[5m]))BY(container_label_com_docker_swarm_service_name)
+        Query: label_replace(sum(machine_cpu_cores), "resource", "cpu", "", "") or label_replace(sum(machine_memory_bytes), "resource", "memory", "", "")
         """
-        response = requests.get(
-            f"{self.base_url}/api/v1/query?query=sum%28rate%28container_cpu_usage_seconds_total%7Bcontainer_label_com_docker_swarm_task_name%3D~%27.%2B%27%7D%5B5m%5D%29%29BY%28container_label_com_docker_swarm_service_name%29"
+        metrics = self.query(
+            'label_replace(sum(machine_cpu_cores), "resource", "cpu", "", "")'
+            ' or label_replace(sum(machine_memory_bytes), "resource", "memory", "", "")'
         )
-        if response.status_code != 200:
-            return None, 0
+        if metrics is None:
+            return None, None
+
+        total_cpu_cores = None
+        total_memory = None
+        for metric in metrics:
+            value = float(metric["value"][1])
+            if metric["metric"]["resource"] == "cpu":
+                total_cpu_cores = value - reserved_cores
+            elif metric["metric"]["resource"] == "memory":
+                total_memory = (value / 1024) / 1024 - reserved_memory
+
+        if total_cpu_cores is None:
+            return None, None
+        return total_cpu_cores, total_memory
+
+    def get_services_usage(
+        self, service_windows: dict[str, tuple[str, str]] | None = None
+    ) -> Union[list, float, float] | Union[None, float, float]:
+        """
+        Query: see get_services_usage_query, with the fast and slow windows, and the windows of
+        service_windows, a (fast, slow) window override by service name.
+
+        cpu_usage is the rate over the slow window of the service, fast_cpu_usage the rate over
+        the fast window, None when the fast window has no rate, e.g. when it's shorter than two
+        scrapes, so the slow rate is used in its place. Memory usage is returned in MiB, the same
+        unit as DockerService.memory_limits.
+        """
+        service_windows = service_windows or {}
+        windows = {self.fast_window, self.slow_window}
+        for fast_window, slow_window in service_windows.values():
+            windows.update([fast_window, slow_window])
+
+        metrics = self.query(
+            get_services_usage_query(sorted(windows, key=lambda window: parse_duration(window)))
+        )
+        if metrics is None:
+            return None, 0, 0
 
         total_cpu_usage = 0.0
-        service_metrics = []
+        total_memory_usage = 0.0
+        service_metrics = {}
 
-        json_response = response.json()
-        status = json_response["status"]
+        for metric in metrics:
+            service_name = metric["metric"]["container_label_com_docker_swarm_service_name"]
+            service_metric = service_metrics.setdefault(
+                service_name,
+                {
+                    "name": service_name,
+                    "cpu_usage": 0.0,
+                    "fast_cpu_usage": None,
+                    "memory_usage": 0.0,
+                },
+            )
+            value = float(metric["value"][1])
+            if metric["metric"]["resource"] == "cpu":
+                fast_window, slow_window = service_windows.get(
+                    service_name, (self.fast_window, self.slow_window)
+                )
+                if metric["metric"]["window"] == slow_window:
+                    service_metric["cpu_usage"] = value
+                    total_cpu_usage += value
+                if metric["metric"]["window"] == fast_window:
+                    service_metric["fast_cpu_usage"] = value
+            elif metric["metric"]["resource"] == "memory":
+                memory_usage = (value / 1024) / 1024
+                service_metric["memory_usage"] = memory_usage
+                total_memory_usage += memory_usage
 
-        if status != "success":
-            return None, 0
+        return list(service_metrics.values()), total_cpu_usage, total_memory_usage
+
+    def get_custom_metrics(self, queries: list[str], budget: float) -> dict[str, float]:
+        """
+        Evaluates every distinct query once, concurrently. Queries still running when the budget
+        (seconds) runs out are left out, so a slow query can't hold up the tick. The samples of
+        a vector are summed, NaN samples are skipped.
+        """
+        futures = {self.executor.submit(self.query, query): query for query in set(queries)}
+        if not futures:
+            return {}
+
+        done, not_done = wait(futures, timeout=budget)
+        for future in not_done:
+            future.cancel()
+            logging.error(
+                "Custom metric query didn't answer within %ss: %s.", budget, futures[future]
+            )
+
+        values = {}
+        for future in done:
+            query = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                logging.exception("Error evaluating custom metric query: %s.", query)
+                continue
+
+            value = self.__get_value(result)
+            if value is None:
+                logging.error("Custom metric query returned no value: %s.", query)
+                continue
+            values[query] = value
+        return values
+
+    @staticmethod
+    def __get_value(result: list | None) -> float | None:
+        if not result:
+            return None
+        # A scalar result is a single [time, value] pair, a vector is a list of samples.
+        if not isinstance(result[0], dict):
+            samples = [float(result[1])]
+        else:
+            samples = [float(sample["value"][1]) for sample in result]
+        samples = [sample for sample in samples if not math.isnan(sample)]
+        return sum(samples) if samples else None
+
+    def get_nodes_usage(self) -> dict[str, float] | None:
+        """
+        Query: sum(rate(container_cpu_usage_seconds_total{container_label_com_docker_swarm_task_name=~'.+'}[5m])) BY(container_label_com_docker_swarm_node_id)
+
+        Returns the CPU cores the tasks use on every node, by Docker node id.
+        """
+        metrics = self.query(nodes_usage_query)
+        if metrics is None:
+            return None
+
+        return {
+            metric["metric"]["container_label_com_docker_swarm_node_id"]: float(metric["value"][1])
+            for metric in metrics
+        }
+
+    def get_services_usage_range(
+        self, start: float, end: float, step: float
+    ) -> Union[list, np.ndarray, np.ndarray] | Union[None, None, None]:
+        """
+        Same query as get_services_usage, evaluated over a range. Returns the service names and
+        two (services, samples) arrays of CPU and memory (MiB) usage on the start/step grid,
+        with NaN where Prometheus had no sample.
+        """
+        metrics = self.query_range(services_usage_query, start=start, end=end, step=step)
+        if metrics is None:
+            return None, None, None
+
+        sample_count = int((end - start) // step) + 1
+        service_names = sorted(
+            {
+                metric["metric"]["container_label_com_docker_swarm_service_name"]
+                for metric in metrics
+            }
+        )
+        service_indexes = {service_name: index for index, service_name in enumerate(service_names)}
+        cpu_usage = np.full((len(service_names), sample_count), np.nan)
+        memory_usage = np.full((len(service_names), sample_count), np.nan)
 
-        metrics = json_response["data"]["result"]
         for metric in metrics:
             service_name = metric["metric"]["container_label_com_docker_swarm_service_name"]
-            cpu_value = float(metric["value"][1])
-            total_cpu_usage += cpu_value
+            if not metric["values"]:
+                continue
+            values = np.array(metric["values"], dtype=float)
+            sample_indexes = np.rint((values[:, 0] - start) / step).astype(int)
+            in_range = (sample_indexes >= 0) & (sample_indexes < sample_count)
 
-            service_metrics.append({"name": service_name, "cpu_usage": cpu_value})
+            if metric["metric"]["resource"] == "cpu":
+                usage = cpu_usage
+                samples = values[:, 1]
+            else:
+                usage = memory_usage
+                samples = (values[:, 1] / 1024) / 1024
+            usage[service_indexes[service_name], sample_indexes[in_range]] = samples[in_range]
 
-        return service_metrics, total_cpu_usage
+        return service_names, cpu_usage, memory_usage
@@ -1,12 +1,15 @@
 import argparse
+import sys
 
+from clock import Clock
+from durations import parse_duration
 from pilot import Pilot
-from providers import ProviderFactory
+from providers import ProviderBase, ProviderFactory
 
 main_parser = argparse.ArgumentParser("swarm-auto-pilot")
 
 
-def main():
+def add_main_arguments():
     main_parser.add_argument(
         "--node_scale_enabled",
         help="Determines if node autoscaler is enabled.",
@@ -48,6 +51,13 @@ def main():
         dest="cpu_down_threshold",
         type=float,
     )
+    main_parser.add_argument(
+        "--cpu_target_utilisation",
+        help="Sets the CPU utilisation a scaled service is sized towards.\nDefaults to the middle of the CPU scale down and scale up thresholds.",
+        dest="cpu_target_utilisation",
+        type=float,
+        default=None,
+    )
 
     main_parser.add_argument(
         "--memory_scale_up_threshold",
@@ -61,6 +71,151 @@ def main():
         dest="memory_down_threshold",
         type=float,
     )
+    main_parser.add_argument(
+        "--memory_target_utilisation",
+        help="Sets the memory utilisation a scaled service is sized towards.\nDefaults to the middle of the memory scale down and scale up thresholds.",
+        dest="memory_target_utilisation",
+        type=float,
+        default=None,
+    )
+
+    main_parser.add_argument(
+        "--scale_up_stabilisation_window",
+        help="Sets the window (in seconds) a scale up must keep being recommended for before it is applied.",
+        dest="scale_up_stabilisation_window",
+        type=float,
+        default=0.0,
+    )
+    main_parser.add_argument(
+        "--scale_down_stabilisation_window",
+        help="Sets the window (in seconds) usage must stay low for before a service is scaled down.",
+        dest="scale_down_stabilisation_window",
+        type=float,
+        default=300.0,
+    )
+    main_parser.add_argument(
+        "--scale_cooldown",
+        help="Sets the time (in seconds) after a scale of a service, before that service can be scaled again.",
+        dest="scale_cooldown",
+        type=float,
+        default=0.0,
+    )
+
+    main_parser.add_argument(
+        "--forecast_enabled",
+        help="Determines if services are scaled on their forecasted usage, when it is higher than the current usage.",
+        dest="forecast_enabled",
+        type=bool,
+        default=False,
+    )
+    main_parser.add_argument(
+        "--forecast_lead_time",
+        help="Sets how far ahead (in seconds) usage is forecasted.",
+        dest="forecast_lead_time",
+        type=float,
+        default=300.0,
+    )
+    main_parser.add_argument(
+        "--forecast_history",
+        help="Sets how much usage history (in seconds) the forecast is fitted on.",
+        dest="forecast_history",
+        type=float,
+        default=3600.0,
+    )
+    main_parser.add_argument(
+        "--forecast_step",
+        help="Sets the resolution (in seconds) of the usage history.",
+        dest="forecast_step",
+        type=float,
+        default=60.0,
+    )
+    main_parser.add_argument(
+        "--forecast_season",
+        help="Sets the length (in seconds) of the seasonal usage pattern, e.g. 86400 for daily. The history must cover two seasons, 0 disables it.",
+        dest="forecast_season",
+        type=float,
+        default=0.0,
+    )
+
+    main_parser.add_argument(
+        "--metrics_buffer_capacity",
+        help="Sets how many usage samples are kept per service and node.",
+        dest="metrics_buffer_capacity",
+        type=int,
+        default=720,
+    )
+    main_parser.add_argument(
+        "--metrics_buffer_max_series",
+        help="Sets how many services and nodes usage samples are kept for.",
+        dest="metrics_buffer_max_series",
+        type=int,
+        default=512,
+    )
+    main_parser.add_argument(
+        "--metrics_buffer_path",
+        help="Sets a file (e.g. on a volume) the usage samples are memory-mapped to, so they survive restarts.",
+        dest="metrics_buffer_path",
+        type=str,
+        default=None,
+    )
+
+    main_parser.add_argument(
+        "--loop_interval_min",
+        help="Sets the shortest time (in seconds) between two checks, used while services or nodes are near a threshold or scaling.",
+        dest="loop_interval_min",
+        type=float,
+        default=15.0,
+    )
+    main_parser.add_argument(
+        "--loop_interval_max",
+        help="Sets the longest time (in seconds) between two checks, reached while everything is stable.",
+        dest="loop_interval_max",
+        type=float,
+        default=120.0,
+    )
+    main_parser.add_argument(
+        "--loop_backoff_max",
+        help="Sets the longest time (in seconds) to wait before retrying after backend errors.",
+        dest="loop_backoff_max",
+        type=float,
+        default=300.0,
+    )
+    main_parser.add_argument(
+        "--threshold_margin",
+        help="Sets how close usage must be to crossing a threshold for the check interval to shorten, as a share (0.1 is 10%%) of the gap between the thresholds.",
+        dest="threshold_margin",
+        type=float,
+        default=0.1,
+    )
+
+    main_parser.add_argument(
+        "--metrics_port",
+        help="Sets the port the pilot serves its own Prometheus metrics on, 0 disables it.",
+        dest="metrics_port",
+        type=int,
+        default=9101,
+    )
+    main_parser.add_argument(
+        "--trace_budget",
+        help="Sets the duration (in seconds) a tick may take, before its trace is logged and dumped.",
+        dest="trace_budget",
+        type=float,
+        default=10.0,
+    )
+    main_parser.add_argument(
+        "--trace_history",
+        help="Sets how many tick traces are kept in memory.",
+        dest="trace_history",
+        type=int,
+        default=100,
+    )
+    main_parser.add_argument(
+        "--trace_path",
+        help="Sets a directory that traces of slow ticks are written to, as JSON and as collapsed stacks for flamegraphs.",
+        dest="trace_path",
+        type=str,
+        default=None,
+    )
 
     main_parser.add_argument(
         "--reserved_cpu_cores",
@@ -69,8 +224,115 @@ def main():
         type=float,
         default=0.0,
     )
-    main_args, remaining_args = main_parser.parse_known_args()
+    main_parser.add_argument(
+        "--reserved_memory",
+        help="Sets reserved memory in MiB (Usually total swarm manager memory), it is used in the calculations of determining if a node should be added.",
+        dest="reserved_memory",
+        type=float,
+        default=0.0,
+    )
+    main_parser.add_argument(
+        "--docker_resync_interval",
+        help="Sets how often (in seconds) the full Docker state is reloaded, in addition to following the Docker events stream.",
+        dest="docker_resync_interval",
+        type=int,
+        default=300,
+    )
+    main_parser.add_argument(
+        "--scale_concurrency",
+        help="Sets how many service scale updates are applied at the same time.",
+        dest="scale_concurrency",
+        type=int,
+        default=8,
+    )
+    main_parser.add_argument(
+        "--node_scale_concurrency",
+        help="Sets how many nodes are created at the same time.",
+        dest="node_scale_concurrency",
+        type=int,
+        default=5,
+    )
+    main_parser.add_argument(
+        "--node_scale_disruption_budget",
+        help="Sets how many nodes can be draining and removed at the same time.",
+        dest="node_scale_disruption_budget",
+        type=int,
+        default=2,
+    )
+    main_parser.add_argument(
+        "--fast_rate_window",
+        help="Sets the Prometheus rate window of the CPU usage that triggers scale up, e.g. 1m.",
+        dest="fast_rate_window",
+        type=str,
+        default="1m",
+    )
+    main_parser.add_argument(
+        "--slow_rate_window",
+        help="Sets the Prometheus rate window of the CPU usage that triggers scale down, e.g. 5m.",
+        dest="slow_rate_window",
+        type=str,
+        default="5m",
+    )
+    main_parser.add_argument(
+        "--scrape_interval",
+        help="Sets the Prometheus scrape interval of cAdvisor, rate windows must be at least twice as long, e.g. 30s.",
+        dest="scrape_interval",
+        type=str,
+        default="30s",
+    )
+    main_parser.add_argument(
+        "--custom_metrics_budget",
+        help="Sets how long (in seconds) the custom metric queries of a tick can take, slower queries are skipped that tick.",
+        dest="custom_metrics_budget",
+        type=float,
+        default=2.0,
+    )
+    main_parser.add_argument(
+        "--custom_metric_tolerance",
+        help="Sets how far (in percent, 0.1 is 10%%) a custom metric can be from its target before the service is scaled.",
+        dest="custom_metric_tolerance",
+        type=float,
+        default=0.1,
+    )
+    main_parser.add_argument(
+        "--metrics_backend",
+        help="Sets where usage is read from, prometheus or cadvisor (scraping cAdvisor on every node directly).",
+        dest="metrics_backend",
+        type=str,
+        choices=["prometheus", "cadvisor"],
+        default="prometheus",
+    )
+    main_parser.add_argument(
+        "--cadvisor_address",
+        help="Sets the DNS name resolving to every cAdvisor task, when cAdvisor is the metrics backend.",
+        dest="cadvisor_address",
+        type=str,
+        default="tasks.cadvisor",
+    )
+    main_parser.add_argument(
+        "--cadvisor_port",
+        help="Sets the port cAdvisor serves its metrics on.",
+        dest="cadvisor_port",
+        type=int,
+        default=8080,
+    )
+    main_parser.add_argument(
+        "--http_timeout",
+        help="Sets the timeout (in seconds) of every request to Docker, Prometheus and the node scale provider.",
+        dest="http_timeout",
+        type=float,
+        default=10.0,
+    )
+    main_parser.add_argument(
+        "--http_pool_size",
+        help="Sets how many keep-alive connections are pooled per backend.",
+        dest="http_pool_size",
+        type=int,
+        default=10,
+    )
 
+
+def validate_main_args(main_args: argparse.Namespace):
     if (main_args.cpu_down_threshold is not None) != (main_args.cpu_up_threshold is not None):
         raise ValueError("Both CPU scale down and scale up thresholds must be provided together.")
 
@@ -91,31 +353,96 @@ def main():
     ):
         raise ValueError("Scale up stat (either CPU or memory) must be provided.")
 
+    scrape_interval = parse_duration(main_args.scrape_interval)
+    if scrape_interval is None:
+        raise ValueError(
+            f"Scrape interval {main_args.scrape_interval} must be a Prometheus duration, e.g. 30s."
+        )
+
+    for rate_window in [main_args.fast_rate_window, main_args.slow_rate_window]:
+        if parse_duration(rate_window) is None:
+            raise ValueError(f"Rate window {rate_window} must be a Prometheus duration, e.g. 5m.")
+        if parse_duration(rate_window) < 2 * scrape_interval:
+            raise ValueError(
+                f"Rate window {rate_window} must be at least twice the scrape interval "
+                f"{main_args.scrape_interval}, or it has no rate."
+            )
+
     if main_args.node_scale_enabled and not main_args.node_scale_provider:
         raise ValueError("When one node scale is active, at least one provider must be selected.")
 
-    if main_args.node_scale_enabled:
-        provider_client = ProviderFactory.get_provider(
-            main_args.node_scale_provider, remaining_args
-        )
-    else:
-        provider_client = None
-
-    node_scale_min_scale = main_args.node_scale_min_scale
-    node_scale_max_scale = main_args.node_scale_max_scale
 
-    pilot = Pilot(
+def create_pilot(
+    main_args: argparse.Namespace,
+    provider_client: ProviderBase | None,
+    clock: Clock | None = None,
+) -> Pilot:
+    return Pilot(
         node_scaling_enabled=main_args.node_scale_enabled,
         node_scale_provider=provider_client,
         cpu_scale_down_threshold=main_args.cpu_down_threshold,
         cpu_scale_up_threshold=main_args.cpu_up_threshold,
+        cpu_target_utilisation=main_args.cpu_target_utilisation,
         memory_scale_down_threshold=main_args.memory_down_threshold,
         memory_scale_up_threshold=main_args.memory_up_threshold,
+        memory_target_utilisation=main_args.memory_target_utilisation,
         reserved_cpu_cores=main_args.reserved_cpu_cores,
-        node_scale_min_scale=node_scale_min_scale,
-        node_scale_max_scale=node_scale_max_scale,
+        reserved_memory=main_args.reserved_memory,
+        docker_resync_interval=main_args.docker_resync_interval,
+        scale_concurrency=main_args.scale_concurrency,
+        node_scale_concurrency=main_args.node_scale_concurrency,
+        node_scale_disruption_budget=main_args.node_scale_disruption_budget,
+        fast_rate_window=main_args.fast_rate_window,
+        slow_rate_window=main_args.slow_rate_window,
+        scrape_interval=main_args.scrape_interval,
+        custom_metrics_budget=main_args.custom_metrics_budget,
+        custom_metric_tolerance=main_args.custom_metric_tolerance,
+        metrics_backend=main_args.metrics_backend,
+        cadvisor_address=main_args.cadvisor_address,
+        cadvisor_port=main_args.cadvisor_port,
+        http_timeout=main_args.http_timeout,
+        http_pool_size=main_args.http_pool_size,
+        scale_up_stabilisation_window=main_args.scale_up_stabilisation_window,
+        scale_down_stabilisation_window=main_args.scale_down_stabilisation_window,
+        scale_cooldown=main_args.scale_cooldown,
+        forecast_enabled=main_args.forecast_enabled,
+        forecast_lead_time=main_args.forecast_lead_time,
+        forecast_history=main_args.forecast_history,
+        forecast_step=main_args.forecast_step,
+        forecast_season=main_args.forecast_season,
+        metrics_buffer_capacity=main_args.metrics_buffer_capacity,
+        metrics_buffer_max_series=main_args.metrics_buffer_max_series,
+        metrics_buffer_path=main_args.metrics_buffer_path,
+        loop_interval_min=main_args.loop_interval_min,
+        loop_interval_max=main_args.loop_interval_max,
+        loop_backoff_max=main_args.loop_backoff_max,
+        threshold_margin=main_args.threshold_margin,
+        metrics_port=main_args.metrics_port,
+        trace_budget=main_args.trace_budget,
+        trace_history=main_args.trace_history,
+        trace_path=main_args.trace_path,
+        node_scale_min_scale=main_args.node_scale_min_scale,
+        node_scale_max_scale=main_args.node_scale_max_scale,
+        clock=clock,
     )
 
+
+def main():
+    add_main_arguments()
+    main_args, _ = main_parser.parse_known_args()
+    validate_main_args(main_args)
+
+    if main_args.node_scale_enabled:
+        provider_client = ProviderFactory.get_provider(
+            main_args.node_scale_provider,
+            sys.argv[1:],
+            timeout=main_args.http_timeout,
+            pool_size=main_args.http_pool_size,
+        )
+    else:
+        provider_client = None
+
+    pilot = create_pilot(main_args=main_args, provider_client=provider_client)
     pilot.start_pilot()
 
 
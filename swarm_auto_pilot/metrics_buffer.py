@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+SERVICE_SERIES = 0
+NODE_SERIES = 1
+
+SAMPLE_TIMESTAMP = 0
+SAMPLE_CPU = 1
+SAMPLE_MEMORY = 2
+SAMPLE_REPLICAS = 3
+
+
+class MetricsRingBuffer:
+    """
+    Fixed size history of (timestamp, cpu, memory, replicas) samples per service and node.
+    Every series is a ring of capacity samples, and the whole buffer is one NumPy record array,
+    which can be backed by a memory-mapped .npy file so a restarted pilot keeps its history.
+    """
+
+    def __init__(self, capacity: int, max_series: int, path: str | None = None):
+        self.capacity = capacity
+        self.max_series = max_series
+        self.path = path
+        self.lock = threading.Lock()
+        self.dtype = np.dtype(
+            [
+                ("name", "S128"),
+                ("kind", "u1"),
+                ("used", "?"),
+                ("head", "i8"),
+                ("count", "i8"),
+                ("samples", "f8", (capacity, 4)),
+            ]
+        )
+        self.series = self.__open()
+        self.indexes = {
+            (bytes(series["name"]).decode("utf-8"), int(series["kind"])): index
+            for index, series in enumerate(self.series)
+            if series["used"]
+        }
+
+    def __open(self) -> np.ndarray:
+        if self.path is None:
+            return np.zeros(self.max_series, dtype=self.dtype)
+
+        if os.path.exists(self.path):
+            try:
+                series = np.lib.format.open_memmap(self.path, mode="r+")
+                if series.dtype == self.dtype and series.shape == (self.max_series,):
+                    logging.info("Loaded metrics history from: %s.", self.path)
+                    return series
+                logging.info("Metrics history: %s has another layout, recreating.", self.path)
+            except Exception:
+                logging.exception("Couldn't load metrics history: %s, recreating.", self.path)
+
+        return np.lib.format.open_memmap(
+            self.path, mode="w+", dtype=self.dtype, shape=(self.max_series,)
+        )
+
+    def __get_index(self, name: str, kind: int) -> int:
+        index = self.indexes.get((name, kind), None)
+        if index is not None:
+            return index
+
+        free_indexes = np.flatnonzero(~self.series["used"])
+        if len(free_indexes) == 0:
+            # Reuse the series that has gone the longest without a sample.
+            last_timestamps = self.series["samples"][
+                np.arange(self.max_series), (self.series["head"] - 1) % self.capacity, 0
+            ]
+            index = int(np.argmin(last_timestamps))
+            old_series = self.series[index]
+            del self.indexes[(bytes(old_series["name"]).decode("utf-8"), int(old_series["kind"]))]
+        else:
+            index = int(free_indexes[0])
+
+        self.series[index] = np.zeros((), dtype=self.dtype)
+        self.series["name"][index] = name.encode("utf-8")
+        self.series["kind"][index] = kind
+        self.series["used"][index] = True
+        self.indexes[(name, kind)] = index
+        return index
+
+    def append(
+        self,
+        name: str,
+        kind: int,
+        timestamp: float,
+        cpu: float,
+        memory: float,
+        replicas: float = np.nan,
+    ):
+        with self.lock:
+            index = self.__get_index(name=name, kind=kind)
+            head = self.series["head"][index]
+            self.series["samples"][index, head] = (timestamp, cpu, memory, replicas)
+            self.series["head"][index] = (head + 1) % self.capacity
+            self.series["count"][index] = min(self.series["count"][index] + 1, self.capacity)
+
+    def get_history(self, name: str, kind: int) -> np.ndarray:
+        """
+        Returns the samples of a series, oldest first, as a (samples, 4) array.
+        """
+        with self.lock:
+            index = self.indexes.get((name, kind), None)
+            if index is None:
+                return np.empty((0, 4))
+
+            head = self.series["head"][index]
+            count = self.series["count"][index]
+            order = (np.arange(head - count, head)) % self.capacity
+            return self.series["samples"][index, order].copy()
+
+    def get_usage_grid(
+        self, kind: int, start: float, end: float, step: float
+    ) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """
+        Returns the series names and (series, samples) arrays of CPU and memory usage on the
+        start/step grid, with NaN where no sample was recorded, matching
+        MetricsHandler.get_services_usage_range.
+        """
+        sample_count = int((end - start) // step) + 1
+        with self.lock:
+            names = sorted(name for name, series_kind in self.indexes if series_kind == kind)
+            cpu_usage = np.full((len(names), sample_count), np.nan)
+            memory_usage = np.full((len(names), sample_count), np.nan)
+
+            for row, name in enumerate(names):
+                samples = self.series["samples"][self.indexes[(name, kind)]]
+                sample_indexes = np.rint((samples[:, SAMPLE_TIMESTAMP] - start) / step)
+                in_range = (
+                    (samples[:, SAMPLE_TIMESTAMP] > 0)
+                    & (sample_indexes >= 0)
+                    & (sample_indexes < sample_count)
+                )
+                sample_indexes = sample_indexes[in_range].astype(int)
+                cpu_usage[row, sample_indexes] = samples[in_range, SAMPLE_CPU]
+                memory_usage[row, sample_indexes] = samples[in_range, SAMPLE_MEMORY]
+
+        return names, cpu_usage, memory_usage
+
+    def get_oldest_timestamp(self, kind: int) -> float | None:
+        with self.lock:
+            timestamps = [
+                self.__get_oldest_timestamp(index)
+                for (_, series_kind), index in self.indexes.items()
+                if series_kind == kind
+            ]
+        timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+        return min(timestamps) if timestamps else None
+
+    def __get_oldest_timestamp(self, index: int) -> float | None:
+        count = self.series["count"][index]
+        if count == 0:
+            return None
+        oldest = (self.series["head"][index] - count) % self.capacity
+        return float(self.series["samples"][index, oldest, SAMPLE_TIMESTAMP])
+
+    def flush(self):
+        if isinstance(self.series, np.memmap):
+            self.series.flush()
@@ -0,0 +1,118 @@
+import math
+
+import numpy as np
+
+
+class NodePlan:
+    def __init__(self, nodes_needed: int, removable_nodes: list[str], unplaceable_tasks: int):
+        self.nodes_needed = nodes_needed
+        self.removable_nodes = removable_nodes
+        self.unplaceable_tasks = unplaceable_tasks
+
+
+def pack_tasks(
+    task_sizes: np.ndarray, task_counts: np.ndarray, free_cpu: np.ndarray, free_memory: np.ndarray
+) -> np.ndarray:
+    """
+    First fit decreasing of task groups onto nodes, in the order of the nodes. Every group is
+    count tasks of one (cpu, memory) size, placed on as few of the first nodes as possible.
+    Updates free_cpu and free_memory in place, and returns the tasks left over per group.
+    """
+    unplaced = task_counts.astype(int)
+    if len(task_counts) == 0 or len(free_cpu) == 0:
+        return unplaced
+
+    # The largest tasks go first, sized by their largest share of an average node.
+    cpu_scale = max(float(np.mean(free_cpu)), 1e-9)
+    memory_scale = max(float(np.mean(free_memory)), 1e-9)
+    dominant_shares = np.maximum(task_sizes[:, 0] / cpu_scale, task_sizes[:, 1] / memory_scale)
+
+    for group in np.argsort(-dominant_shares, kind="stable"):
+        cpu, memory = task_sizes[group]
+        with np.errstate(divide="ignore"):
+            fits = np.minimum(
+                np.floor((free_cpu + 1e-9) / cpu) if cpu > 0 else np.inf,
+                np.floor((free_memory + 1e-9) / memory) if memory > 0 else np.inf,
+            )
+        fits = np.clip(fits, 0, task_counts[group])
+        placed_before = np.concatenate([[0], np.cumsum(fits)[:-1]])
+        placed = np.clip(np.minimum(fits, task_counts[group] - placed_before), 0, None)
+
+        free_cpu -= placed * cpu
+        free_memory -= placed * memory
+        unplaced[group] = task_counts[group] - int(placed.sum())
+    return unplaced
+
+
+def plan_nodes(
+    task_sizes: np.ndarray,
+    task_counts: np.ndarray,
+    node_names: list[str],
+    node_cpu: np.ndarray,
+    node_memory: np.ndarray,
+    removable: np.ndarray,
+    pending_nodes: int,
+    new_node_cpu: float,
+    new_node_memory: float,
+    max_new_nodes: int,
+) -> NodePlan:
+    """
+    Packs the desired tasks onto the nodes, ordered so removable nodes are filled last, then onto
+    the pending nodes and as many new nodes as needed. Removable nodes left empty can be removed
+    with every task still fitting on the rest.
+    """
+    # Services mostly share a few task sizes, packing per size keeps a tick fast.
+    task_sizes, size_indexes = np.unique(task_sizes.reshape(-1, 2), axis=0, return_inverse=True)
+    task_counts = np.bincount(
+        size_indexes.reshape(-1), weights=task_counts, minlength=len(task_sizes)
+    ).astype(int)
+
+    free_cpu = np.concatenate([node_cpu, np.full(pending_nodes, new_node_cpu)]).astype(float)
+    free_memory = np.concatenate([node_memory, np.full(pending_nodes, new_node_memory)]).astype(
+        float
+    )
+    unplaced = pack_tasks(task_sizes, task_counts, free_cpu, free_memory)
+
+    empty_nodes = (free_cpu[: len(node_names)] >= node_cpu - 1e-9) & (
+        free_memory[: len(node_names)] >= node_memory - 1e-9
+    )
+    removable_nodes = [
+        node_name
+        for node_name, is_removable, is_empty in zip(node_names, removable, empty_nodes)
+        if is_removable and is_empty
+    ]
+
+    fits_new_node = (task_sizes[:, 0] <= new_node_cpu + 1e-9) & (
+        task_sizes[:, 1] <= new_node_memory + 1e-9
+    )
+    unplaceable_tasks = int(unplaced[~fits_new_node].sum())
+    unplaced[~fits_new_node] = 0
+    if unplaced.sum() == 0 or max_new_nodes <= 0:
+        return NodePlan(
+            nodes_needed=0, removable_nodes=removable_nodes, unplaceable_tasks=unplaceable_tasks
+        )
+
+    # Enough new nodes to hold the leftover tasks one node per task, or by their total size.
+    new_nodes = min(
+        max_new_nodes,
+        int(unplaced.sum()),
+        math.ceil(
+            2
+            * max(
+                float(unplaced @ task_sizes[:, 0]) / max(new_node_cpu, 1e-9),
+                float(unplaced @ task_sizes[:, 1]) / max(new_node_memory, 1e-9),
+            )
+        )
+        + 1,
+    )
+    new_free_cpu = np.full(new_nodes, float(new_node_cpu))
+    new_free_memory = np.full(new_nodes, float(new_node_memory))
+    pack_tasks(task_sizes, unplaced, new_free_cpu, new_free_memory)
+    nodes_needed = int(
+        np.sum((new_free_cpu < new_node_cpu - 1e-9) | (new_free_memory < new_node_memory - 1e-9))
+    )
+    return NodePlan(
+        nodes_needed=nodes_needed,
+        removable_nodes=removable_nodes,
+        unplaceable_tasks=unplaceable_tasks,
+    )
@@ -1,11 +1,32 @@
 import logging
-import time
 import traceback
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
 
-from handlers.docker import DockerHandler, DockerService
+import numpy as np
+import requests
+from actuator import NodeActuator, ScaleActuator
+from clock import Clock
+from decisions import ServiceColumns, decide_replicas, get_busy_services
+from durations import parse_duration
+from forecasting import forecast
+from handlers.cadvisor import CadvisorHandler
+from handlers.docker import DockerHandler, DockerNode, DockerService, DockerStateCache
+from handlers.metrics import MetricsHandler
 from handlers.prometheus import PrometheusHandler
+from metrics_buffer import NODE_SERIES, SERVICE_SERIES, MetricsRingBuffer
+from node_planner import NodePlan, plan_nodes
 from providers import Node, ProviderBase
+from scaling import get_nodes_needed, get_nodes_surplus
+from scheduler import AdaptiveScheduler
+from stabilisation import ScaleHistory
+from telemetry import (
+    node_operation_duration,
+    pending_nodes,
+    start_metrics_server,
+    tick_duration,
+    warm_pool_nodes,
+)
+from tracing import Tracer
 
 
 class Pilot:
@@ -17,25 +38,129 @@ class Pilot:
         node_scale_max_scale: int,
         cpu_scale_down_threshold: float | None,
         cpu_scale_up_threshold: float | None,
+        cpu_target_utilisation: float | None,
         memory_scale_down_threshold: float | None,
         memory_scale_up_threshold: float | None,
+        memory_target_utilisation: float | None,
         reserved_cpu_cores: float,
+        reserved_memory: float,
+        docker_resync_interval: int,
+        scale_concurrency: int,
+        node_scale_concurrency: int,
+        node_scale_disruption_budget: int,
+        http_timeout: float,
+        http_pool_size: int,
+        fast_rate_window: str,
+        slow_rate_window: str,
+        scrape_interval: str,
+        custom_metrics_budget: float,
+        custom_metric_tolerance: float,
+        metrics_backend: str,
+        cadvisor_address: str,
+        cadvisor_port: int,
+        scale_up_stabilisation_window: float,
+        scale_down_stabilisation_window: float,
+        scale_cooldown: float,
+        forecast_enabled: bool,
+        forecast_lead_time: float,
+        forecast_history: float,
+        forecast_step: float,
+        forecast_season: float,
+        metrics_buffer_capacity: int,
+        metrics_buffer_max_series: int,
+        metrics_buffer_path: str | None,
+        loop_interval_min: float,
+        loop_interval_max: float,
+        loop_backoff_max: float,
+        threshold_margin: float,
+        metrics_port: int,
+        trace_budget: float,
+        trace_history: int,
+        trace_path: str | None,
+        clock: Clock | None = None,
     ):
         logging.basicConfig(
             level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
         )
+        self.clock = clock or Clock()
         self.node_scaling_enabled = node_scaling_enabled
         self.node_scale_provider = node_scale_provider
         self.node_scale_max_scale = node_scale_max_scale
         self.node_scale_min_scale = node_scale_min_scale
+        self.node_scale_disruption_budget = node_scale_disruption_budget
         self.cpu_scale_down_threshold = cpu_scale_down_threshold
         self.cpu_scale_up_threshold = cpu_scale_up_threshold
+        if cpu_target_utilisation is None and cpu_scale_up_threshold is not None:
+            cpu_target_utilisation = (cpu_scale_down_threshold + cpu_scale_up_threshold) / 2
+        self.cpu_target_utilisation = cpu_target_utilisation
         self.memory_scale_down_threshold = memory_scale_down_threshold
         self.memory_scale_up_threshold = memory_scale_up_threshold
+        if memory_target_utilisation is None and memory_scale_up_threshold is not None:
+            memory_target_utilisation = (
+                memory_scale_down_threshold + memory_scale_up_threshold
+            ) / 2
+        self.memory_target_utilisation = memory_target_utilisation
         self.reserved_cpu_cores = reserved_cpu_cores
+        self.reserved_memory = reserved_memory
+        self.scale_up_stabilisation_window = scale_up_stabilisation_window
+        self.scale_down_stabilisation_window = scale_down_stabilisation_window
+        self.scale_cooldown = scale_cooldown
+        self.scale_history = ScaleHistory()
+        self.forecast_enabled = forecast_enabled
+        self.forecast_lead_time = forecast_lead_time
+        self.forecast_history = forecast_history
+        self.forecast_step = forecast_step
+        self.forecast_season = forecast_season
+        self.threshold_margin = threshold_margin
+        self.metrics_port = metrics_port
+        self.metrics_server_started = False
+        self.drain_started_at = {}
+        self.orphaned_since = {}
+        self.tracer = Tracer(budget=trace_budget, history=trace_history, path=trace_path)
+        self.scheduler = AdaptiveScheduler(
+            interval_min=loop_interval_min,
+            interval_max=loop_interval_max,
+            backoff_max=loop_backoff_max,
+        )
+        self.metrics_buffer = MetricsRingBuffer(
+            capacity=metrics_buffer_capacity,
+            max_series=metrics_buffer_max_series,
+            path=metrics_buffer_path,
+        )
 
-        self.docker_handler = DockerHandler()
-        self.prometheus_handler = PrometheusHandler()
+        self.docker_handler = DockerHandler(timeout=http_timeout, pool_size=http_pool_size)
+        self.docker_state = DockerStateCache(
+            session=self.docker_handler.session,
+            resync_interval=docker_resync_interval,
+            rate_window_min=2 * parse_duration(scrape_interval),
+        )
+        self.metrics_backend = metrics_backend
+        self.fast_rate_window = fast_rate_window
+        self.slow_rate_window = slow_rate_window
+        self.scrape_interval = scrape_interval
+        self.custom_metrics_budget = custom_metrics_budget
+        self.custom_metric_tolerance = custom_metric_tolerance
+        if metrics_backend == "cadvisor":
+            self.metrics_handler: MetricsHandler = CadvisorHandler(
+                address=cadvisor_address,
+                port=cadvisor_port,
+                timeout=http_timeout,
+                pool_size=http_pool_size,
+            )
+        else:
+            self.metrics_handler: MetricsHandler = PrometheusHandler(
+                timeout=http_timeout,
+                pool_size=http_pool_size,
+                fast_window=fast_rate_window,
+                slow_window=slow_rate_window,
+            )
+        self.scale_actuator = ScaleActuator(concurrency=scale_concurrency)
+        self.node_actuator = (
+            NodeActuator(provider=node_scale_provider, concurrency=node_scale_concurrency)
+            if node_scale_provider is not None
+            else None
+        )
+        self.node_resources = None
 
     def start_pilot(self):
         logging.info("Starting SwarmAutoPilot")
@@ -44,19 +169,46 @@ class Pilot:
         logging.debug("Node scale provider: %s", self.node_scale_provider)
         logging.debug("Node min scale: %s", self.node_scale_min_scale)
         logging.debug("Node max scale: %s", self.node_scale_max_scale)
+        logging.debug("Node disruption budget: %s", self.node_scale_disruption_budget)
         logging.debug("CPU scale down threshold: %s", self.cpu_scale_down_threshold)
         logging.debug("CPU scale up threshold: %s", self.cpu_scale_up_threshold)
+        logging.debug("CPU target utilisation: %s", self.cpu_target_utilisation)
         logging.debug("Memory scale down threshold: %s", self.memory_scale_down_threshold)
         logging.debug("Memory scale up threshold: %s", self.memory_scale_up_threshold)
+        logging.debug("Memory target utilisation: %s", self.memory_target_utilisation)
+        logging.debug("Scale up stabilisation window: %s", self.scale_up_stabilisation_window)
+        logging.debug("Scale down stabilisation window: %s", self.scale_down_stabilisation_window)
+        logging.debug("Scale cooldown: %s", self.scale_cooldown)
+        logging.debug("Forecast enabled: %s", self.forecast_enabled)
+        logging.debug("Forecast lead time: %s", self.forecast_lead_time)
+        logging.debug("Metrics backend: %s", self.metrics_backend)
+        logging.debug("Fast rate window: %s", self.fast_rate_window)
+        logging.debug("Slow rate window: %s", self.slow_rate_window)
+        logging.debug("Scrape interval: %s", self.scrape_interval)
+        logging.debug("Custom metrics budget: %s", self.custom_metrics_budget)
+        logging.debug("Custom metric tolerance: %s", self.custom_metric_tolerance)
+        logging.debug("Loop interval min: %s", self.scheduler.interval_min)
+        logging.debug("Loop interval max: %s", self.scheduler.interval_max)
+
+        if self.metrics_port and not self.metrics_server_started:
+            start_metrics_server(port=self.metrics_port)
+            self.metrics_server_started = True
+            logging.info("Serving metrics on port: %s.", self.metrics_port)
 
         docker_connection_response = self.docker_handler.ping()
         if docker_connection_response is False:
             logging.error("Couldn't connect to the Docker socket, exiting.")
             return
 
-        prometheus_connection_response = self.prometheus_handler.ping()
-        if prometheus_connection_response is False:
-            logging.error("Couldn't connect to Prometheus for 10 minutes, exiting.")
+        docker_state_response = self.docker_state.start()
+        if docker_state_response is False:
+            logging.error("Couldn't load the Docker state, it will be retried in the background.")
+
+        metrics_connection_response = self.metrics_handler.ping()
+        if metrics_connection_response is False:
+            logging.error(
+                "Couldn't connect to the %s metrics backend, exiting.", self.metrics_backend
+            )
             return
 
         try:
@@ -69,27 +221,75 @@ class Pilot:
 
     def handle_pilot(self):
         while True:
-            total_cpu_cores = self.prometheus_handler.get_total_cpu_cores(
-                reserved_cores=self.reserved_cpu_cores
+            try:
+                with tick_duration.time(), self.tracer.trace("tick"):
+                    interval = self.run_tick()
+            except requests.exceptions.RequestException:
+                logging.error(traceback.format_exc())
+                interval = self.scheduler.backoff()
+            self.clock.sleep(interval)
+
+    def run_tick(self) -> float:
+        with self.tracer.span("get_total_resources"):
+            total_cpu_cores, total_memory = self.metrics_handler.get_total_resources(
+                reserved_cores=self.reserved_cpu_cores, reserved_memory=self.reserved_memory
             )
-            if total_cpu_cores is None:
-                logging.error("Couldn't fetch CPU cores count, waiting 10 seconds to check again.")
-                time.sleep(10)
-                continue
+        if total_cpu_cores is None:
+            logging.error("Couldn't fetch CPU cores count, backing off.")
+            return self.scheduler.backoff()
 
-            services, total_service_usage = self.prometheus_handler.get_services_cpu_usage()
-            if services is None:
-                logging.error("Couldn't fetch usage, waiting 10 seconds to check again.")
-                time.sleep(10)
-                continue
+        with self.tracer.span("get_services"):
+            docker_services = self.docker_state.get_services()
+        if docker_services is None:
+            logging.error("Couldn't fetch services, backing off.")
+            return self.scheduler.backoff()
+
+        with self.tracer.span("refresh_tasks"):
+            if self.docker_state.refresh_tasks() is False:
+                logging.error("Couldn't refresh tasks, using the cached tasks.")
+
+        with self.tracer.span("get_services_usage"):
+            services, total_cpu_usage, total_memory_usage = (
+                self.metrics_handler.get_services_usage(
+                    service_windows=self.get_service_windows(docker_services=docker_services)
+                )
+            )
+        if services is None:
+            logging.error("Couldn't fetch usage, backing off.")
+            return self.scheduler.backoff()
 
-            free_cpu_resources = total_cpu_cores - total_service_usage
+        custom_queries = [
+            metric.query
+            for docker_service in docker_services.values()
+            if docker_service.autopilot_enabled
+            for metric in docker_service.autopilot_metrics
+        ]
+        custom_metrics = {}
+        if custom_queries:
+            with self.tracer.span("get_custom_metrics", queries=len(custom_queries)):
+                custom_metrics = self.metrics_handler.get_custom_metrics(
+                    queries=custom_queries, budget=self.custom_metrics_budget
+                )
+
+        with self.tracer.span("record_samples"):
+            self.record_samples(services=services, docker_services=docker_services)
+
+        if self.forecast_enabled:
+            with self.tracer.span("apply_forecast"):
+                self.apply_forecast(services=services)
 
+        free_cpu_resources = total_cpu_cores - total_cpu_usage
+        free_memory_resources = (
+            total_memory - total_memory_usage if total_memory is not None else None
+        )
+
+        tick_busy = False
+        autopilot_services = []
+        with self.tracer.span("select_services", services=len(services)):
             for service in services:
                 service_name = service["name"]
-                service_total_cpu_usage = service["cpu_usage"]
 
-                docker_service = self.docker_handler.get_service(service_name=service_name)
+                docker_service = docker_services.get(service_name)
                 if docker_service is None:
                     logging.debug("Couldn't find service: %s, skipping.", service_name)
                     continue
@@ -105,9 +305,13 @@ class Pilot:
                     )
                     continue
 
-                if docker_service.cpu_limits is None and docker_service.memory_limits is None:
+                if (
+                    docker_service.cpu_limits is None
+                    and docker_service.memory_limits is None
+                    and not docker_service.autopilot_metrics
+                ):
                     logging.error(
-                        "Couldn't find configured limits on service: %s, limits must be configured.",
+                        "Couldn't find configured limits or metrics on service: %s, limits or metrics must be configured.",
                         service_name,
                     )
                     continue
@@ -126,163 +330,1034 @@ class Pilot:
                     )
                     continue
 
-                if docker_service.cpu_limits is not None:
-                    docker_service = self.check_docker_cpu_resources(
-                        docker_service=docker_service, service_cpu_usage=service_total_cpu_usage
+                autopilot_services.append((docker_service, service))
+
+        scale_decisions = []
+        if autopilot_services:
+            with self.tracer.span("decide_replicas", services=len(autopilot_services)):
+                recommended_replicas, services_busy = self.decide_service_replicas(
+                    autopilot_services=autopilot_services, custom_metrics=custom_metrics
+                )
+            tick_busy = services_busy
+
+            with self.tracer.span("stabilise_replicas"):
+                for (docker_service, _), replicas in zip(autopilot_services, recommended_replicas):
+                    new_replicas = self.stabilise_replicas(
+                        docker_service=docker_service, recommended_replicas=int(replicas)
+                    )
+                    if new_replicas != docker_service.replicas:
+                        scale_decisions.append((docker_service, new_replicas))
+
+        if scale_decisions:
+            tick_busy = True
+            with self.tracer.span("apply_scale_decisions", decisions=len(scale_decisions)):
+                scale_results = self.scale_actuator.apply(decisions=scale_decisions)
+            for scale_result in scale_results:
+                if scale_result.succeeded:
+                    self.scale_history.record_scale(
+                        scale_result.service_name, now=self.clock.time()
                     )
 
-            if self.node_scaling_enabled:
+        if self.node_scaling_enabled:
+            with self.tracer.span("get_nodes"):
                 nodes = self.node_scale_provider.get_nodes()
 
-                self.check_node_cpu_resources(
+            if nodes:
+                with self.tracer.span("reconcile_nodes"):
+                    nodes = self.reconcile_nodes(nodes=nodes)
+            warm_nodes = [node for node in nodes if node.labels.get("Pool") == "warm"]
+            nodes = [node for node in nodes if node.labels.get("Pool") != "warm"]
+
+            unschedulable_tasks = self.docker_state.get_unschedulable_tasks()
+
+            with self.tracer.span("plan_nodes"):
+                node_plan = self.plan_nodes(
+                    nodes=nodes,
+                    docker_services=docker_services,
+                    unschedulable_tasks=unschedulable_tasks,
+                )
+
+            with self.tracer.span("check_node_resources"):
+                added_nodes = self.check_node_resources(
                     free_cpu_resources=free_cpu_resources,
                     total_cpu_cores=total_cpu_cores,
+                    free_memory_resources=free_memory_resources,
+                    total_memory=total_memory,
                     nodes=nodes,
+                    node_plan=node_plan,
+                    warm_nodes=warm_nodes,
                 )
 
-                if nodes:
-                    self.check_new_joined_nodes(nodes=nodes)
+            if self.node_scale_provider.get_warm_pool_size() or warm_nodes:
+                with self.tracer.span("refill_warm_pool"):
+                    self.refill_warm_pool(
+                        warm_nodes=warm_nodes, active_nodes=len(nodes) + added_nodes
+                    )
+
+            if self.is_node_pool_busy(
+                free_cpu_resources=free_cpu_resources,
+                total_cpu_cores=total_cpu_cores,
+                free_memory_resources=free_memory_resources,
+                total_memory=total_memory,
+                nodes=nodes,
+            ):
+                tick_busy = True
+
+        return self.scheduler.next_interval(busy=tick_busy)
 
-            time.sleep(60)
+    def get_service_windows(
+        self, docker_services: dict[str, DockerService]
+    ) -> dict[str, tuple[str, str]]:
+        """
+        Returns the (fast, slow) rate windows of the services overriding them with the
+        autopilot.fast_window and autopilot.slow_window labels, which DockerService has
+        checked against the scrape interval.
+        """
+        service_windows = {}
+        for service_name, docker_service in docker_services.items():
+            if (
+                docker_service.autopilot_fast_window is None
+                and docker_service.autopilot_slow_window is None
+            ):
+                continue
+
+            service_windows[service_name] = (
+                docker_service.autopilot_fast_window or self.fast_rate_window,
+                docker_service.autopilot_slow_window or self.slow_rate_window,
+            )
+        return service_windows
 
-    def check_docker_cpu_resources(
-        self, docker_service: DockerService, service_cpu_usage: float
-    ) -> DockerService:
-        used_cpu_resources = service_cpu_usage / (
-            docker_service.cpu_limits * docker_service.replicas
+    def is_node_pool_busy(
+        self,
+        free_cpu_resources: float,
+        total_cpu_cores: float,
+        free_memory_resources: float | None,
+        total_memory: float | None,
+        nodes: list[Node],
+    ) -> bool:
+        if any(node.labels.get("Status", None) in ["Creating", "Draining"] for node in nodes):
+            return True
+
+        free_ratios = self.get_node_free_ratios(
+            free_cpu_resources=free_cpu_resources,
+            total_cpu_cores=total_cpu_cores,
+            free_memory_resources=free_memory_resources,
+            total_memory=total_memory,
         )
-        if used_cpu_resources > self.cpu_scale_up_threshold:
-            if docker_service.replicas >= docker_service.autopilot_scale_max:
-                logging.info(
-                    "Couldn't scale service: %s more up, replicas is at max setting, current replicas: %s.",
-                    docker_service.name,
-                    docker_service.replicas,
+        # Free resources falling towards the up threshold, or rising towards the down threshold.
+        for ratio in free_ratios:
+            margin = self.threshold_margin * abs(ratio["up_threshold"] - ratio["down_threshold"])
+            if ratio["up_threshold"] <= ratio["free"] <= ratio["up_threshold"] + margin:
+                return True
+            if ratio["down_threshold"] - margin <= ratio["free"] <= ratio["down_threshold"]:
+                return True
+        return False
+
+    def record_samples(self, services: list[dict], docker_services: dict[str, DockerService]):
+        """
+        Appends a sample of every service, and of every node by hostname. The metrics backends
+        don't report memory per node, so a node's memory is what its running tasks reserve,
+        and its replicas are its running tasks.
+        """
+        now = self.clock.time()
+        for service in services:
+            docker_service = docker_services.get(service["name"], None)
+            replicas = docker_service.replicas if docker_service is not None else None
+            self.metrics_buffer.append(
+                name=service["name"],
+                kind=SERVICE_SERIES,
+                timestamp=now,
+                cpu=service["cpu_usage"],
+                memory=service["memory_usage"],
+                replicas=replicas if replicas is not None else np.nan,
+            )
+
+        nodes_usage = self.metrics_handler.get_nodes_usage()
+        node_loads = self.docker_state.get_node_loads()
+        node_task_counts = self.docker_state.get_node_task_counts()
+        for docker_node in self.docker_state.get_nodes():
+            self.metrics_buffer.append(
+                name=docker_node.name,
+                kind=NODE_SERIES,
+                timestamp=now,
+                cpu=nodes_usage.get(docker_node.id, 0.0) if nodes_usage is not None else np.nan,
+                memory=node_loads.get(docker_node.id, (0.0, 0.0))[1],
+                replicas=node_task_counts.get(docker_node.id, 0),
+            )
+        self.metrics_buffer.flush()
+
+    def get_usage_history(self, start: float, end: float):
+        oldest_timestamp = self.metrics_buffer.get_oldest_timestamp(kind=SERVICE_SERIES)
+        if oldest_timestamp is not None and oldest_timestamp <= start + self.forecast_step:
+            return self.metrics_buffer.get_usage_grid(
+                kind=SERVICE_SERIES, start=start, end=end, step=self.forecast_step
+            )
+
+        logging.debug("Metrics buffer doesn't cover the forecast history, querying the backend.")
+        service_names, cpu_usage, memory_usage = self.metrics_handler.get_services_usage_range(
+            start=start, end=end, step=self.forecast_step
+        )
+        if service_names is None and oldest_timestamp is not None:
+            # Backends without history forecast on what the buffer has recorded so far.
+            return self.metrics_buffer.get_usage_grid(
+                kind=SERVICE_SERIES, start=start, end=end, step=self.forecast_step
+            )
+        return service_names, cpu_usage, memory_usage
+
+    def apply_forecast(self, services: list[dict]):
+        now = self.clock.time()
+        service_names, cpu_history, memory_history = self.get_usage_history(
+            start=now - self.forecast_history, end=now
+        )
+        if service_names is None:
+            logging.error("Couldn't fetch usage history, scaling on current usage.")
+            return
+
+        horizon = max(1, round(self.forecast_lead_time / self.forecast_step))
+        season_length = round(self.forecast_season / self.forecast_step)
+        predicted_cpu_usage = forecast(cpu_history, horizon=horizon, season_length=season_length)
+        predicted_memory_usage = forecast(
+            memory_history, horizon=horizon, season_length=season_length
+        )
+        predictions = {
+            service_name: (float(predicted_cpu_usage[index]), float(predicted_memory_usage[index]))
+            for index, service_name in enumerate(service_names)
+        }
+
+        # The forecast only brings scale ups forward, and holds back scale downs.
+        for service in services:
+            prediction = predictions.get(service["name"], None)
+            if prediction is None:
+                continue
+
+            cpu_usage, memory_usage = prediction
+            if cpu_usage > service["cpu_usage"] or memory_usage > service["memory_usage"]:
+                logging.debug(
+                    "Forecasted usage of service: %s in %ss, CPU: %.2f, memory: %.0f MiB.",
+                    service["name"],
+                    self.forecast_lead_time,
+                    cpu_usage,
+                    memory_usage,
                 )
-                return docker_service
+            service["cpu_usage"] = max(service["cpu_usage"], cpu_usage)
+            service["memory_usage"] = max(service["memory_usage"], memory_usage)
+            # Scale up is decided on the fast signal, it must see the forecast too.
+            if service.get("fast_cpu_usage", None) is not None:
+                service["fast_cpu_usage"] = max(service["fast_cpu_usage"], cpu_usage)
+
+    def get_service_resource_ratios(
+        self,
+        docker_service: DockerService,
+        service_cpu_usage: float,
+        service_memory_usage: float,
+        service_fast_cpu_usage: float | None = None,
+        custom_metrics: dict[str, float] | None = None,
+    ) -> list[dict]:
+        """
+        Returns the usage ratio of every resource. fast_usage reacts quicker to spikes, it's
+        the CPU usage over the fast window, and the usage itself for memory.
+
+        A custom metric's ratio is its value over its target, per replica for an average
+        metric, so it's targeted at 1 within the custom metric tolerance. custom_metrics has
+        the values by query, a metric without a value this tick is left out.
+        """
+        resource_ratios = []
+        if docker_service.cpu_limits is not None and self.cpu_scale_up_threshold is not None:
+            cpu_capacity = docker_service.cpu_limits * docker_service.replicas
+            resource_ratios.append(
+                {
+                    "resource": "CPU",
+                    "usage": service_cpu_usage / cpu_capacity,
+                    "fast_usage": (
+                        service_fast_cpu_usage
+                        if service_fast_cpu_usage is not None
+                        else service_cpu_usage
+                    )
+                    / cpu_capacity,
+                    "up_threshold": self.cpu_scale_up_threshold,
+                    "down_threshold": self.cpu_scale_down_threshold,
+                    "target": docker_service.autopilot_cpu_target or self.cpu_target_utilisation,
+                }
+            )
+        if docker_service.memory_limits is not None and self.memory_scale_up_threshold is not None:
+            resource_ratios.append(
+                {
+                    "resource": "memory",
+                    "usage": service_memory_usage
+                    / (docker_service.memory_limits * docker_service.replicas),
+                    "fast_usage": service_memory_usage
+                    / (docker_service.memory_limits * docker_service.replicas),
+                    "up_threshold": self.memory_scale_up_threshold,
+                    "down_threshold": self.memory_scale_down_threshold,
+                    "target": docker_service.autopilot_memory_target
+                    or self.memory_target_utilisation,
+                }
+            )
+        for metric in docker_service.autopilot_metrics:
+            value = (custom_metrics or {}).get(metric.query, None)
+            if value is None:
+                continue
+            usage = value / metric.target
+            if metric.average:
+                usage /= docker_service.replicas
+            resource_ratios.append(
+                {
+                    "resource": metric.name,
+                    "usage": usage,
+                    "fast_usage": usage,
+                    "up_threshold": 1 + self.custom_metric_tolerance,
+                    "down_threshold": 1 - self.custom_metric_tolerance,
+                    "target": 1.0,
+                }
+            )
+        return resource_ratios
+
+    def get_service_columns(
+        self, autopilot_services: list[tuple[DockerService, dict]], resource_ratios: list[list]
+    ) -> ServiceColumns:
+        width = max((len(ratios) for ratios in resource_ratios), default=0)
+        shape = (len(autopilot_services), width)
+        usage = np.full(shape, np.nan)
+        fast_usage = np.full(shape, np.nan)
+        up_threshold = np.full(shape, np.nan)
+        down_threshold = np.full(shape, np.nan)
+        target = np.full(shape, np.nan)
+        for row, ratios in enumerate(resource_ratios):
+            for column, ratio in enumerate(ratios):
+                usage[row, column] = ratio["usage"]
+                fast_usage[row, column] = ratio["fast_usage"]
+                up_threshold[row, column] = ratio["up_threshold"]
+                down_threshold[row, column] = ratio["down_threshold"]
+                target[row, column] = ratio["target"]
+
+        docker_services = [docker_service for docker_service, _ in autopilot_services]
+        return ServiceColumns(
+            replicas=np.array([service.replicas for service in docker_services], dtype=int),
+            scale_min=np.array(
+                [service.autopilot_scale_min for service in docker_services], dtype=float
+            ),
+            scale_max=np.array(
+                [service.autopilot_scale_max for service in docker_services], dtype=float
+            ),
+            max_step_up=np.array(
+                [
+                    (
+                        service.autopilot_max_step_up
+                        if service.autopilot_max_step_up is not None
+                        else np.inf
+                    )
+                    for service in docker_services
+                ],
+                dtype=float,
+            ),
+            max_step_down=np.array(
+                [
+                    (
+                        service.autopilot_max_step_down
+                        if service.autopilot_max_step_down is not None
+                        else np.inf
+                    )
+                    for service in docker_services
+                ],
+                dtype=float,
+            ),
+            usage=usage,
+            fast_usage=fast_usage,
+            up_threshold=up_threshold,
+            down_threshold=down_threshold,
+            target=target,
+        )
 
-            logging.info("Scaling service: %s up, too little free resources.", docker_service.name)
-            new_replicas = docker_service.replicas + 1
-            docker_service.scale(new_replicas=new_replicas)
-        elif used_cpu_resources < self.cpu_scale_down_threshold:
-            if docker_service.replicas <= docker_service.autopilot_scale_min:
+    def decide_service_replicas(
+        self,
+        autopilot_services: list[tuple[DockerService, dict]],
+        custom_metrics: dict[str, float] | None = None,
+    ) -> tuple[np.ndarray, bool]:
+        """
+        Returns the recommended replicas of every service, and if any service is busy, still
+        scaling or near a threshold. The decisions are made for every service at once, see
+        decisions.decide_replicas, only the logging is per service.
+        """
+        resource_ratios = []
+        for docker_service, service in autopilot_services:
+            ratios = self.get_service_resource_ratios(
+                docker_service=docker_service,
+                service_cpu_usage=service["cpu_usage"],
+                service_memory_usage=service["memory_usage"],
+                service_fast_cpu_usage=service.get("fast_cpu_usage", None),
+                custom_metrics=custom_metrics,
+            )
+            if not ratios:
                 logging.debug(
-                    "Couldn't scale service: %s more down, replicas is at min setting, current replicas: %s.",
+                    "Service: %s has no limits matching the configured thresholds, skipping.",
                     docker_service.name,
-                    docker_service.replicas,
                 )
-                return docker_service
+            resource_ratios.append(ratios)
 
-            logging.info("Scaling service: %s down, too many free resources.", docker_service.name)
-            new_replicas = docker_service.replicas - 1
-            docker_service.scale(new_replicas=new_replicas)
-        elif docker_service.replicas < docker_service.autopilot_scale_min:
-            logging.info(
-                "Scaling service: %s up, is under min (%s) replicas.",
-                docker_service.name,
-                docker_service.autopilot_scale_min,
+        columns = self.get_service_columns(
+            autopilot_services=autopilot_services, resource_ratios=resource_ratios
+        )
+        replica_decisions = decide_replicas(columns)
+
+        running_task_counts = self.docker_state.get_running_task_counts()
+        running_tasks = np.array(
+            [
+                running_task_counts.get(docker_service.id, 0)
+                for docker_service, _ in autopilot_services
+            ],
+            dtype=int,
+        )
+        scaling = running_tasks != columns.replicas
+        for index in np.flatnonzero(scaling):
+            logging.debug(
+                "Service: %s is scaling, running tasks: %s, replicas: %s.",
+                autopilot_services[index][0].name,
+                running_tasks[index],
+                columns.replicas[index],
             )
-            docker_service.scale(new_replicas=docker_service.autopilot_scale_min)
-        elif docker_service.replicas > docker_service.autopilot_scale_max:
+        busy = bool(
+            scaling.any() or get_busy_services(columns, margin=self.threshold_margin).any()
+        )
+
+        for index, new_replicas in zip(replica_decisions.indexes, replica_decisions.new_replicas):
+            docker_service = autopilot_services[index][0]
             logging.info(
-                "Scaling service: %s down, is over max (%s) replicas.",
+                "Scaling service: %s from %s to %s replicas, %s.",
                 docker_service.name,
-                docker_service.autopilot_scale_max,
+                docker_service.replicas,
+                new_replicas,
+                ", ".join(
+                    f"{ratio['resource']} usage: {ratio['usage']:.2f}, target: {ratio['target']:.2f}"
+                    for ratio in resource_ratios[index]
+                ),
             )
-            docker_service.scale(new_replicas=docker_service.autopilot_scale_max)
-        else:
-            logging.info("No scale is needed for service: %s.", docker_service.name)
-        return docker_service
 
-    def check_node_cpu_resources(
-        self, free_cpu_resources: float, total_cpu_cores: float, nodes: list[Node]
-    ):
-        if ((free_cpu_resources / total_cpu_cores) < self.cpu_scale_up_threshold) or (
-            len(nodes) < self.node_scale_min_scale
+        unchanged = replica_decisions.replicas == columns.replicas
+        at_max = columns.replicas >= columns.scale_max
+        at_min = columns.replicas <= columns.scale_min
+        for index in np.flatnonzero(unchanged & replica_decisions.scale_up & at_max):
+            logging.info(
+                "Couldn't scale service: %s more up, replicas is at max setting, current replicas: %s.",
+                autopilot_services[index][0].name,
+                columns.replicas[index],
+            )
+        for index in np.flatnonzero(unchanged & replica_decisions.scale_down & at_min):
+            logging.debug(
+                "Couldn't scale service: %s more down, replicas is at min setting, current replicas: %s.",
+                autopilot_services[index][0].name,
+                columns.replicas[index],
+            )
+        # Over or under a threshold, but the replicas already bring usage to the target.
+        for index in np.flatnonzero(
+            unchanged
+            & ((replica_decisions.scale_up & ~at_max) | (replica_decisions.scale_down & ~at_min))
         ):
-            if len(nodes) < self.node_scale_min_scale:
-                logging.info("Swarm is under minimum scale, adding nodes.")
-                nodes_to_create = self.node_scale_min_scale - len(nodes)
-                for _ in range(nodes_to_create):
-                    self.node_scale_provider.node_create()
-                logging.info("%s nodes is being created.", nodes_to_create)
-                return
-
-            logging.info("Swarm is too low on CPU resources, adding new node.")
-            self.node_scale_provider.node_create()
-            logging.info("New node is being created.")
+            logging.debug(
+                "Service: %s is within its target at %s replicas.",
+                autopilot_services[index][0].name,
+                columns.replicas[index],
+            )
+        logging.debug(
+            "No scale is needed for %s services.",
+            int(
+                np.count_nonzero(
+                    unchanged & ~replica_decisions.scale_up & ~replica_decisions.scale_down
+                )
+            ),
+        )
+        return replica_decisions.replicas, busy
+
+    def stabilise_replicas(self, docker_service: DockerService, recommended_replicas: int) -> int:
+        scale_up_window = docker_service.autopilot_scale_up_window
+        if scale_up_window is None:
+            scale_up_window = self.scale_up_stabilisation_window
+        scale_down_window = docker_service.autopilot_scale_down_window
+        if scale_down_window is None:
+            scale_down_window = self.scale_down_stabilisation_window
+        cooldown = docker_service.autopilot_cooldown
+        if cooldown is None:
+            cooldown = self.scale_cooldown
+
+        return self.scale_history.stabilise(
+            service_name=docker_service.name,
+            current_replicas=docker_service.replicas,
+            recommended_replicas=recommended_replicas,
+            scale_up_window=scale_up_window,
+            scale_down_window=scale_down_window,
+            cooldown=cooldown,
+            now=self.clock.time(),
+        )
+
+    def get_node_free_ratios(
+        self,
+        free_cpu_resources: float,
+        total_cpu_cores: float,
+        free_memory_resources: float | None,
+        total_memory: float | None,
+    ) -> list[dict]:
+        free_ratios = []
+        if self.cpu_scale_up_threshold is not None:
+            free_ratios.append(
+                {
+                    "resource": "CPU",
+                    "free": free_cpu_resources / total_cpu_cores,
+                    "up_threshold": self.cpu_scale_up_threshold,
+                    "down_threshold": self.cpu_scale_down_threshold,
+                }
+            )
+        if self.memory_scale_up_threshold is not None and total_memory:
+            free_ratios.append(
+                {
+                    "resource": "memory",
+                    "free": free_memory_resources / total_memory,
+                    "up_threshold": self.memory_scale_up_threshold,
+                    "down_threshold": self.memory_scale_down_threshold,
+                }
+            )
+        return free_ratios
+
+    def check_node_resources(
+        self,
+        free_cpu_resources: float,
+        total_cpu_cores: float,
+        free_memory_resources: float | None,
+        total_memory: float | None,
+        nodes: list[Node],
+        node_plan: NodePlan | None = None,
+        warm_nodes: list[Node] | None = None,
+    ) -> int:
+        """
+        Adds or removes nodes by the free resources and the node plan. Returns how many nodes
+        were added, promoted from the warm pool or created.
+        """
+        warm_nodes = warm_nodes or []
+        free_ratios = self.get_node_free_ratios(
+            free_cpu_resources=free_cpu_resources,
+            total_cpu_cores=total_cpu_cores,
+            free_memory_resources=free_memory_resources,
+            total_memory=total_memory,
+        )
+        low_resources = [
+            ratio["resource"] for ratio in free_ratios if ratio["free"] < ratio["up_threshold"]
+        ]
+        resources_free = bool(free_ratios) and all(
+            ratio["free"] > ratio["down_threshold"] for ratio in free_ratios
+        )
+
+        tasks_unplaced = node_plan is not None and node_plan.nodes_needed > 0
+
+        if low_resources or tasks_unplaced or len(nodes) < self.node_scale_min_scale:
+            nodes_to_create = max(0, self.node_scale_min_scale - len(nodes))
+            if nodes_to_create:
+                logging.info("Swarm is under minimum scale, adding %s nodes.", nodes_to_create)
+            if tasks_unplaced:
+                logging.info(
+                    "Swarm can't fit every task, %s new nodes are needed.", node_plan.nodes_needed
+                )
+                nodes_to_create = max(
+                    nodes_to_create,
+                    min(node_plan.nodes_needed, self.node_scale_max_scale - len(nodes)),
+                )
+            if low_resources:
+                logging.info(
+                    "Swarm is too low on %s resources, planning new nodes.",
+                    " and ".join(low_resources),
+                )
+                nodes_to_create = max(
+                    nodes_to_create,
+                    self.get_nodes_to_create(
+                        free_cpu_resources=free_cpu_resources,
+                        total_cpu_cores=total_cpu_cores,
+                        free_memory_resources=free_memory_resources,
+                        total_memory=total_memory,
+                        nodes=nodes,
+                    ),
+                )
+            standby_nodes = [node for node in warm_nodes if node.labels.get("Status") == "Standby"]
+            promoted_nodes = []
+            if nodes_to_create and standby_nodes:
+                promoted_nodes = self.node_actuator.promote(
+                    nodes=self.get_docker_nodes(standby_nodes[:nodes_to_create])
+                )
+                logging.info("%s nodes is promoted from the warm pool.", len(promoted_nodes))
+                nodes_to_create -= len(promoted_nodes)
+
+            # Warm pool nodes are servers too, they count against the max scale.
+            nodes_to_create = min(
+                nodes_to_create, self.node_scale_max_scale - len(nodes) - len(warm_nodes)
+            )
+            if nodes_to_create <= 0:
+                return len(promoted_nodes)
+
+            created_nodes = self.node_actuator.create(count=nodes_to_create)
+            logging.info("%s nodes is being created.", len(created_nodes))
+            return len(promoted_nodes) + len(created_nodes)
         elif (
-            (free_cpu_resources / total_cpu_cores) > self.cpu_scale_down_threshold
+            resources_free
             or len(nodes) > self.node_scale_max_scale
+            or any(node.labels.get("Status") == "Draining" for node in nodes)
         ) and nodes:
-            logging.info("Swarm has too many free CPU resources, looking for node to remove.")
-            now = datetime.now().replace(tzinfo=timezone.utc)
-            fifteen_minutes_ago = now - timedelta(minutes=15)
+            self.remove_nodes(
+                free_cpu_resources=free_cpu_resources,
+                total_cpu_cores=total_cpu_cores,
+                free_memory_resources=free_memory_resources,
+                total_memory=total_memory,
+                nodes=nodes,
+                node_plan=node_plan,
+                warm_nodes=warm_nodes,
+            )
+        return 0
 
-            for node in nodes:
-                labels = node.labels
-                if node.created_at > fifteen_minutes_ago:
-                    continue
+    def remove_nodes(
+        self,
+        free_cpu_resources: float,
+        total_cpu_cores: float,
+        free_memory_resources: float | None,
+        total_memory: float | None,
+        nodes: list[Node],
+        node_plan: NodePlan | None,
+        warm_nodes: list[Node],
+    ):
+        """
+        Removes the drained nodes, and drains the least loaded surplus nodes, as many at a time
+        as the disruption budget allows. Draining nodes refill the warm pool before any is
+        removed.
+        """
+        draining_nodes = [node for node in nodes if node.labels.get("Status") == "Draining"]
+        missing_warm_nodes = self.node_scale_provider.get_warm_pool_size() - len(warm_nodes)
+        standby_nodes = draining_nodes[: max(0, missing_warm_nodes)]
+        for node in standby_nodes:
+            labels = node.labels
+            labels["Status"] = "Standby"
+            labels["Pool"] = "warm"
+            if node.update_labels(labels) is False:
+                # It's kept draining, and tried again for the warm pool next tick.
+                logging.error("Label update of node: %s, has failed.", node.name)
+                continue
+            self.drain_started_at.pop(node.name, None)
+            warm_nodes.append(node)
+            logging.info("Node: %s is drained into the warm pool.", node.name)
+        draining_nodes = [node for node in draining_nodes if node not in standby_nodes]
+
+        if draining_nodes:
+            logging.info("Confirming drain has completed on %s nodes.", len(draining_nodes))
+            removed_nodes = self.node_actuator.remove(nodes=self.get_docker_nodes(draining_nodes))
+            for node in removed_nodes:
+                drain_started_at = self.drain_started_at.pop(node.name, None)
+                if drain_started_at is not None:
+                    node_operation_duration.labels(operation="drain").observe(
+                        self.clock.time() - drain_started_at
+                    )
+            draining_nodes = [node for node in draining_nodes if node not in removed_nodes]
+
+        nodes_to_drain = min(
+            self.get_nodes_to_remove(
+                free_cpu_resources=free_cpu_resources,
+                total_cpu_cores=total_cpu_cores,
+                free_memory_resources=free_memory_resources,
+                total_memory=total_memory,
+                nodes=nodes,
+            )
+            - len(draining_nodes),
+            self.node_scale_disruption_budget - len(draining_nodes),
+        )
+        if nodes_to_drain <= 0:
+            return
 
-                logging.info("Found node: %s, trying to remove it.", node.name)
-                docker_node = self.docker_handler.get_node_info(node.name)
-
-                if labels["Status"] == "Running":
-                    logging.info("Drain of node: %s, needed.", node.name)
-                    drain_response = docker_node.drain()
-                    if drain_response is False:
-                        logging.error("Drain of node: %s, has encountered an error.", node.name)
-                        break
-
-                    logging.info("Drain of node: %s, has begun.", node.name)
-                    labels["Status"] = "Draining"
-                    node.update_labels(labels)
-                    logging.debug("Updated label Status to Draining on node: %s.", node.name)
-                elif labels["Status"] == "Draining":
-                    logging.info("Confirming drain has completed on node: %s.", node.name)
-                    confirm_drain_response = docker_node.confirm_drain()
-                    if confirm_drain_response is False:
-                        logging.info("Drain of node: %s, hasn't completed, waiting.", node.name)
-                        break
-
-                    logging.info("Deleting node: %s, from swarm.", node.name)
-                    delete_response = docker_node.remove(docker_node.id)
-                    if delete_response is False:
-                        logging.error(
-                            "Deletion of swarm node: %s, encountered an error.", node.name
-                        )
-                        break
-
-                    logging.info("Deleting node from provider: %s", node.name)
-                    node.delete()
-                    logging.info("Node: %s is set to remove on provider.", node.name)
-                break
-
-    def check_new_joined_nodes(self, nodes):
-        logging.debug("Checking if new nodes has joined the swarm.")
+        logging.info("Swarm has too many free resources, looking for nodes to remove.")
+        fifteen_minutes_ago = self.clock.now() - timedelta(minutes=15)
+        candidates = []
         for node in nodes:
-            labels = node["labels"]
+            if node.labels.get("Status") != "Running" or node.created_at > fifteen_minutes_ago:
+                continue
+            if (
+                node_plan is not None
+                and node.name not in node_plan.removable_nodes
+                and len(nodes) <= self.node_scale_max_scale
+            ):
+                logging.debug(
+                    "Node: %s can't be removed, the other nodes can't fit its tasks.", node.name
+                )
+                continue
+            candidates.append(node)
+        if not candidates:
+            return
+
+        candidates = self.get_docker_nodes(candidates)
+        nodes_usage = self.metrics_handler.get_nodes_usage() or {}
+        node_task_counts = self.docker_state.get_node_task_counts()
+
+        # The least used nodes go first, and the ones running the fewest tasks of those.
+        candidates.sort(
+            key=lambda candidate: (
+                nodes_usage.get(candidate[1].id, 0.0) / max(candidate[1].cpu_cores, 1e-9),
+                node_task_counts.get(candidate[1].id, 0),
+            )
+        )
+        for node, docker_node in candidates[:nodes_to_drain]:
+            logging.info(
+                "Found node: %s, CPU usage: %.2f cores, tasks: %s, draining it.",
+                node.name,
+                nodes_usage.get(docker_node.id, 0.0),
+                node_task_counts.get(docker_node.id, 0),
+            )
+
+        drained_nodes = self.node_actuator.drain(nodes=candidates[:nodes_to_drain])
+        for node in drained_nodes:
+            self.drain_started_at[node.name] = self.clock.time()
+
+    def refill_warm_pool(self, warm_nodes: list[Node], active_nodes: int):
+        """
+        Creates the nodes missing from the warm pool, they join the swarm in the background and
+        are drained once they have joined. The pool shrinks to keep the active nodes and the
+        pool within the max scale.
+        """
+        warm_nodes = [node for node in warm_nodes if node.labels.get("Pool") == "warm"]
+        standby_nodes = sum(1 for node in warm_nodes if node.labels.get("Status") == "Standby")
+        warm_pool_nodes.set(standby_nodes)
+
+        warm_pool_size = min(
+            self.node_scale_provider.get_warm_pool_size(),
+            max(0, self.node_scale_max_scale - active_nodes),
+        )
+        missing_warm_nodes = warm_pool_size - len(warm_nodes)
+        if missing_warm_nodes < 0:
+            surplus_nodes = [
+                node for node in warm_nodes if node.labels.get("Status") == "Standby"
+            ][:-missing_warm_nodes]
+            logging.info("Warm pool is too large, removing %s nodes.", len(surplus_nodes))
+            self.node_actuator.remove(nodes=self.get_docker_nodes(surplus_nodes))
+            return
+        if missing_warm_nodes == 0:
+            return
+
+        logging.info(
+            "Warm pool has %s ready nodes, %s nodes joining, adding %s nodes.",
+            standby_nodes,
+            len(warm_nodes) - standby_nodes,
+            missing_warm_nodes,
+        )
+        self.node_actuator.create(count=missing_warm_nodes, standby=True)
 
-            if labels["Status"] != "Creating":
+    def get_docker_nodes(self, nodes: list[Node]) -> list[tuple[Node, DockerNode]]:
+        docker_nodes = self.docker_state.get_nodes_by_name()
+        return [(node, docker_nodes[node.name]) for node in nodes if node.name in docker_nodes]
+
+    def get_nodes_to_remove(
+        self,
+        free_cpu_resources: float,
+        total_cpu_cores: float,
+        free_memory_resources: float | None,
+        total_memory: float | None,
+        nodes: list[Node],
+    ) -> int:
+        """
+        Returns how many nodes can be removed with the free resources staying inside the
+        thresholds and the min scale, counting the nodes that are draining, and at least the
+        nodes over the max scale.
+        """
+        nodes_over_max_scale = len(nodes) - self.node_scale_max_scale
+        nodes_over_min_scale = len(nodes) - self.node_scale_min_scale
+        node_resources = self.get_node_resources()
+        if node_resources is None:
+            return max(min(1, nodes_over_min_scale), nodes_over_max_scale)
+
+        node_cpu_cores, node_memory = node_resources
+        nodes_to_remove = []
+        if self.cpu_scale_down_threshold is not None:
+            nodes_to_remove.append(
+                get_nodes_surplus(
+                    free=free_cpu_resources,
+                    total=total_cpu_cores,
+                    node_capacity=node_cpu_cores,
+                    up_threshold=self.cpu_scale_up_threshold,
+                    down_threshold=self.cpu_scale_down_threshold,
+                )
+            )
+        if self.memory_scale_down_threshold is not None and total_memory:
+            nodes_to_remove.append(
+                get_nodes_surplus(
+                    free=free_memory_resources,
+                    total=total_memory,
+                    node_capacity=node_memory,
+                    up_threshold=self.memory_scale_up_threshold,
+                    down_threshold=self.memory_scale_down_threshold,
+                )
+            )
+
+        return max(min(nodes_to_remove + [nodes_over_min_scale]), nodes_over_max_scale)
+
+    def plan_nodes(
+        self,
+        nodes: list[Node],
+        docker_services: dict[str, DockerService],
+        unschedulable_tasks: list[dict],
+    ) -> NodePlan | None:
+        """
+        Bin-packs the desired tasks of every service onto the nodes, to find how many new nodes
+        are needed and which nodes can be removed. Tasks the swarm couldn't schedule always get
+        new nodes of their own.
+        """
+        node_resources = self.get_node_resources()
+        docker_nodes = [
+            docker_node
+            for docker_node in self.docker_state.get_nodes()
+            if docker_node.availability == "active" and docker_node.state == "ready"
+        ]
+        if node_resources is None or not docker_nodes:
+            return None
+        new_node_cpu, new_node_memory = node_resources
+
+        # Global services run a task on every node, taking from the capacity of every node.
+        global_cpu = 0.0
+        global_memory = 0.0
+        task_sizes = []
+        task_counts = []
+        for docker_service in docker_services.values():
+            cpu, memory = docker_service.get_task_size()
+            if cpu == 0 and memory == 0:
                 continue
+            if docker_service.mode != "Replicated":
+                global_cpu += cpu
+                global_memory += memory
+            elif docker_service.replicas:
+                task_sizes.append((cpu, memory))
+                task_counts.append(docker_service.replicas)
+
+        running_nodes = {node.name for node in nodes if node.labels.get("Status") == "Running"}
+        docker_node_names = {docker_node.name for docker_node in docker_nodes}
+        creating_nodes = sum(
+            1
+            for node in nodes
+            if node.labels.get("Status") == "Creating" and node.name not in docker_node_names
+        )
+
+        # Nodes that stay are filled first, and the least loaded removable nodes last.
+        node_loads = self.docker_state.get_node_loads()
+        docker_nodes.sort(
+            key=lambda docker_node: (
+                docker_node.name in running_nodes,
+                -node_loads.get(docker_node.id, (0.0, 0.0))[0] / max(docker_node.cpu_cores, 1e-9),
+            )
+        )
+
+        node_plan = plan_nodes(
+            task_sizes=np.array(task_sizes, dtype=float).reshape(-1, 2),
+            task_counts=np.array(task_counts, dtype=int),
+            node_names=[docker_node.name for docker_node in docker_nodes],
+            node_cpu=np.array(
+                [docker_node.cpu_cores - global_cpu for docker_node in docker_nodes]
+            ),
+            node_memory=np.array(
+                [docker_node.memory - global_memory for docker_node in docker_nodes]
+            ),
+            removable=np.array(
+                [docker_node.name in running_nodes for docker_node in docker_nodes]
+            ),
+            pending_nodes=creating_nodes,
+            new_node_cpu=new_node_cpu - global_cpu,
+            new_node_memory=new_node_memory - global_memory,
+            max_new_nodes=self.node_scale_max_scale - len(nodes),
+        )
 
-            now = datetime.now().replace(tzinfo=timezone.utc)
-            one_hour_ago = now - timedelta(hours=1)
+        # The scheduler already knows these don't fit, whatever the packing of the desired tasks
+        # says, so they are packed onto the pending and new nodes only.
+        docker_services_by_id = {
+            docker_service.id: docker_service for docker_service in docker_services.values()
+        }
+        unschedulable_sizes = [
+            docker_services_by_id[task["ServiceID"]].get_task_size()
+            for task in unschedulable_tasks
+            if task["ServiceID"] in docker_services_by_id
+        ]
+        if unschedulable_sizes:
+            unschedulable_plan = plan_nodes(
+                task_sizes=np.array(unschedulable_sizes, dtype=float).reshape(-1, 2),
+                task_counts=np.ones(len(unschedulable_sizes), dtype=int),
+                node_names=[],
+                node_cpu=np.zeros(0),
+                node_memory=np.zeros(0),
+                removable=np.zeros(0, dtype=bool),
+                pending_nodes=creating_nodes,
+                new_node_cpu=new_node_cpu - global_cpu,
+                new_node_memory=new_node_memory - global_memory,
+                max_new_nodes=self.node_scale_max_scale - len(nodes),
+            )
+            logging.info(
+                "%s tasks couldn't be scheduled, they need %s new nodes.",
+                len(unschedulable_sizes),
+                unschedulable_plan.nodes_needed,
+            )
+            node_plan.nodes_needed = max(node_plan.nodes_needed, unschedulable_plan.nodes_needed)
+
+        if node_plan.unplaceable_tasks:
+            logging.error(
+                "%s tasks are larger than a new node, no node scale up can place them.",
+                node_plan.unplaceable_tasks,
+            )
+        logging.debug(
+            "Node plan, new nodes needed: %s, removable nodes: %s.",
+            node_plan.nodes_needed,
+            ", ".join(node_plan.removable_nodes) or "none",
+        )
+        return node_plan
 
-            logging.info("Checking if node: %s, has joined the cluster.", node.name)
+    def get_node_resources(self) -> tuple[float, float] | None:
+        if self.node_resources is None:
             try:
-                confirm_node = self.docker_handler.get_node_info(node.name)
+                self.node_resources = self.node_scale_provider.get_node_resources()
             except Exception:
-                logging.error("Didn't find node in swarm: %s", node.name)
-                confirm_node = None
-
-            if confirm_node:
-                labels["Status"] = "Running"
-                self.node_scale_provider.node_update_labels(id, labels)
-                logging.info("Found node: %s, updated label Status to Running.", node.name)
-            elif node.created_at < one_hour_ago:
-                logging.error(
-                    "Waited for node: %s for one hour, and it didn't show up in swarm. Removing node.",
-                    node.name,
+                logging.exception("Couldn't get the resources of new nodes from the provider.")
+        return self.node_resources
+
+    def get_nodes_to_create(
+        self,
+        free_cpu_resources: float,
+        total_cpu_cores: float,
+        free_memory_resources: float | None,
+        total_memory: float | None,
+        nodes: list[Node],
+    ) -> int:
+        """
+        Returns how many nodes bring the free resources back inside the thresholds, counting the
+        nodes that are still being created, capped by the max scale.
+        """
+        creating_nodes = sum(1 for node in nodes if node.labels.get("Status", None) == "Creating")
+        node_resources = self.get_node_resources()
+        if node_resources is None:
+            logging.info("Node resources are unknown, adding one node at a time.")
+            nodes_needed = 0 if creating_nodes else 1
+        else:
+            node_cpu_cores, node_memory = node_resources
+            nodes_needed = 0
+            if self.cpu_scale_up_threshold is not None:
+                nodes_needed = get_nodes_needed(
+                    free=free_cpu_resources + creating_nodes * node_cpu_cores,
+                    total=total_cpu_cores + creating_nodes * node_cpu_cores,
+                    node_capacity=node_cpu_cores,
+                    up_threshold=self.cpu_scale_up_threshold,
+                    down_threshold=self.cpu_scale_down_threshold,
                 )
-                self.node_scale_provider.node_delete(id)
-                logging.info("Node: %s is set to remove on provider.", node.name)
+            if self.memory_scale_up_threshold is not None and total_memory:
+                nodes_needed = max(
+                    nodes_needed,
+                    get_nodes_needed(
+                        free=free_memory_resources + creating_nodes * node_memory,
+                        total=total_memory + creating_nodes * node_memory,
+                        node_capacity=node_memory,
+                        up_threshold=self.memory_scale_up_threshold,
+                        down_threshold=self.memory_scale_down_threshold,
+                    ),
+                )
+
+        nodes_to_create = max(0, min(nodes_needed, self.node_scale_max_scale - len(nodes)))
+        logging.info(
+            "Nodes needed: %s, being created: %s, creating: %s, max scale: %s.",
+            nodes_needed,
+            creating_nodes,
+            nodes_to_create,
+            self.node_scale_max_scale,
+        )
+        return nodes_to_create
+
+    def reconcile_nodes(self, nodes: list[Node]) -> list[Node]:
+        """
+        Joins the provider's nodes to the swarm's nodes by hostname in one pass, finding the
+        nodes that have joined, are still missing, have timed out or have left the swarm, then
+        applies the label updates and deletes as one batch. Returns the nodes that are kept.
+        A node is only deleted for leaving the swarm once it has been missing for two Docker
+        resync intervals, so a node that is still joining or a gap in the cache keeps it.
+        """
+        if self.docker_state.last_resync is None:
+            return nodes
+
+        logging.debug("Reconciling provider nodes with the swarm.")
+        docker_nodes = self.docker_state.get_nodes_by_name()
+        now = self.clock.now()
+        one_hour_ago = now - timedelta(hours=1)
+        orphan_grace_period = 2 * self.docker_state.resync_interval
+
+        joined_nodes = []
+        standby_nodes = []
+        timed_out_nodes = []
+        orphaned_nodes = []
+        missing_nodes = 0
+        for node in nodes:
+            status = node.labels.get("Status")
+            docker_node = docker_nodes.get(node.name)
+            if status == "Creating":
+                if docker_node is not None and node.labels.get("Pool") == "warm":
+                    standby_nodes.append((node, docker_node))
+                elif docker_node is not None:
+                    joined_nodes.append(node)
+                elif node.created_at < one_hour_ago:
+                    timed_out_nodes.append(node)
+                elif node.labels.get("Pool") != "warm":
+                    missing_nodes += 1
+            elif docker_node is None:
+                if node.name not in self.orphaned_since:
+                    self.orphaned_since[node.name] = now
+                    logging.info(
+                        "Node: %s, labelled %s, isn't in the swarm, removing it if it's still "
+                        "missing in %ss.",
+                        node.name,
+                        status,
+                        orphan_grace_period,
+                    )
+                if (now - self.orphaned_since[node.name]).total_seconds() >= orphan_grace_period:
+                    orphaned_nodes.append(node)
+            if docker_node is not None or status == "Creating":
+                self.orphaned_since.pop(node.name, None)
+
+        for node in joined_nodes:
+            node.labels["Status"] = "Running"
+        for node in self.node_actuator.update_labels(nodes=joined_nodes):
+            node_operation_duration.labels(operation="create").observe(
+                (now - node.created_at).total_seconds()
+            )
+            logging.info(
+                "Found node: %s after %.0fs, updated label Status to Running.",
+                node.name,
+                (now - node.created_at).total_seconds(),
+            )
+
+        for node in self.node_actuator.drain(nodes=standby_nodes, status="Standby"):
+            node_operation_duration.labels(operation="create_standby").observe(
+                (now - node.created_at).total_seconds()
+            )
+            logging.info(
+                "Found node: %s after %.0fs, drained it into the warm pool.",
+                node.name,
+                (now - node.created_at).total_seconds(),
+            )
+
+        for node in timed_out_nodes:
+            logging.error(
+                "Waited for node: %s for one hour, and it didn't show up in swarm. Removing node.",
+                node.name,
+            )
+        for node in orphaned_nodes:
+            logging.warning(
+                "Node: %s, labelled %s, isn't in the swarm anymore. Removing node.",
+                node.name,
+                node.labels.get("Status"),
+            )
+        deleted_nodes = self.node_actuator.delete(nodes=timed_out_nodes + orphaned_nodes)
+        for node in deleted_nodes:
+            self.drain_started_at.pop(node.name, None)
+            logging.info("Node: %s is set to remove on provider.", node.name)
+        # Forget the nodes the provider doesn't have anymore.
+        node_names = {node.name for node in nodes if node not in deleted_nodes}
+        for node_name in list(self.orphaned_since):
+            if node_name not in node_names:
+                del self.orphaned_since[node_name]
+
+        logging.debug(
+            "Nodes joined: %s, still pending: %s, timed out: %s, orphaned: %s.",
+            len(joined_nodes) + len(standby_nodes),
+            missing_nodes,
+            len(timed_out_nodes),
+            len(orphaned_nodes),
+        )
+        pending_nodes.set(missing_nodes)
+        return [node for node in nodes if node not in deleted_nodes]
@@ -4,7 +4,7 @@ from datetime import datetime
 
 class ProviderFactory:
     @staticmethod
-    def get_provider(provider_name, parser_args):
+    def get_provider(provider_name, parser_args, timeout: float = 10.0, pool_size: int = 10):
         module_name = f"autoscale_providers.{provider_name.lower()}"
         try:
             module = importlib.import_module(module_name)
@@ -14,7 +14,8 @@ class ProviderFactory:
         for attr_name in dir(module):
             attr = getattr(module, attr_name)
             if isinstance(attr, type) and issubclass(attr, ProviderBase) and attr != ProviderBase:
-                return attr(parser_args=parser_args)  # Instantiate and return the provider
+                # Instantiate and return the provider
+                return attr(parser_args=parser_args, timeout=timeout, pool_size=pool_size)
 
         raise ValueError(f"No valid provider class found in module '{module_name}'.")
 
@@ -37,10 +38,25 @@ class Node:
 
 class ProviderBase:
     def __init__(self):
-        raise NotImplementedError("A node scale provider must implement this method.")
+        pass
 
     def get_nodes(self) -> list[Node]:
         raise NotImplementedError("A node scale provider must implement this method.")
 
-    def node_create(self) -> Node:
+    def node_create(self, standby: bool = False) -> Node:
+        """
+        Creates a node, labelled with Pool=warm when it's created for the warm pool.
+        """
+        raise NotImplementedError("A node scale provider must implement this method.")
+
+    def get_warm_pool_size(self) -> int:
+        """
+        Returns how many joined, drained nodes the provider keeps ready for scale up.
+        """
+        return 0
+
+    def get_node_resources(self) -> tuple[float, float]:
+        """
+        Returns the CPU cores and memory (MiB) of the nodes the provider creates.
+        """
         raise NotImplementedError("A node scale provider must implement this method.")
@@ -0,0 +1,48 @@
+import math
+
+
+def get_nodes_needed(
+    free: float, total: float, node_capacity: float, up_threshold: float, down_threshold: float
+) -> int:
+    """
+    Returns how many nodes of node_capacity bring the free ratio (free / total) to the middle
+    of the thresholds, using fewer nodes when the middle would overshoot the down threshold.
+    """
+    if total > 0 and free / total >= up_threshold:
+        return 0
+
+    target_ratio = (up_threshold + down_threshold) / 2
+    if node_capacity <= 0 or target_ratio >= 1:
+        return 0
+
+    def get_free_ratio(nodes: int) -> float:
+        return (free + nodes * node_capacity) / (total + nodes * node_capacity)
+
+    # (free + n * capacity) / (total + n * capacity) >= target, solved for n.
+    nodes = max(
+        1, math.ceil((target_ratio * total - free) / (node_capacity * (1 - target_ratio)) - 1e-9)
+    )
+    while (
+        nodes > 1
+        and get_free_ratio(nodes) > down_threshold
+        and get_free_ratio(nodes - 1) >= up_threshold
+    ):
+        nodes -= 1
+    return nodes
+
+
+def get_nodes_surplus(
+    free: float, total: float, node_capacity: float, up_threshold: float, down_threshold: float
+) -> int:
+    """
+    Returns how many nodes of node_capacity can be removed with the free ratio (free / total)
+    staying at or above the middle of the thresholds.
+    """
+    if total <= 0 or free / total <= down_threshold or node_capacity <= 0:
+        return 0
+
+    target_ratio = (up_threshold + down_threshold) / 2
+
+    # (free - n * capacity) / (total - n * capacity) >= target, solved for n.
+    nodes = math.floor((free - target_ratio * total) / (node_capacity * (1 - target_ratio)) + 1e-9)
+    return max(0, nodes)
@@ -0,0 +1,52 @@
+import logging
+import random
+
+from telemetry import tick_errors, tick_interval
+
+
+class AdaptiveScheduler:
+    def __init__(self, interval_min: float, interval_max: float, backoff_max: float):
+        if interval_min <= 0 or interval_min > interval_max:
+            raise ValueError("Loop interval min must be positive and not above loop interval max.")
+
+        self.interval_min = interval_min
+        self.interval_max = interval_max
+        self.backoff_max = backoff_max
+        self.current_interval = interval_min
+        self.error_count = 0
+
+    def next_interval(self, busy: bool) -> float:
+        """
+        Drops to the min interval while anything is busy, and stretches the interval by half
+        for every stable tick until it reaches the max interval.
+        """
+        self.error_count = 0
+        if busy:
+            self.current_interval = self.interval_min
+        else:
+            self.current_interval = min(self.interval_max, self.current_interval * 1.5)
+        tick_interval.set(self.current_interval)
+
+        logging.info(
+            "Next tick in %.1f seconds, %s.",
+            self.current_interval,
+            "swarm is busy" if busy else "swarm is stable",
+        )
+        return self.current_interval
+
+    def backoff(self) -> float:
+        """
+        Exponential backoff from the min interval with equal jitter, capped at the backoff max.
+        """
+        self.error_count += 1
+        backoff = min(self.backoff_max, self.interval_min * 2 ** (self.error_count - 1))
+        self.current_interval = backoff / 2 + random.uniform(0, backoff / 2)
+        tick_interval.set(self.current_interval)
+        tick_errors.inc()
+
+        logging.info(
+            "Next tick in %.1f seconds, backing off after %s errors.",
+            self.current_interval,
+            self.error_count,
+        )
+        return self.current_interval
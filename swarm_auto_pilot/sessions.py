@@ -0,0 +1,79 @@
+import time
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from requests_unixsocket.adapters import UnixAdapter, UnixHTTPConnectionPool
+from telemetry import backend_request_duration, backend_request_errors, get_endpoint
+
+
+class UnixSocketConnectionPool(UnixHTTPConnectionPool):
+    def __init__(self, socket_path: str, timeout: float, maxsize: int):
+        urllib3.connectionpool.HTTPConnectionPool.__init__(
+            self, "localhost", timeout=timeout, maxsize=maxsize
+        )
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+
+class PooledUnixAdapter(UnixAdapter):
+    def __init__(self, timeout: float, pool_size: int):
+        super(PooledUnixAdapter, self).__init__(timeout=timeout, pool_connections=pool_size)
+        self.pool_size = pool_size
+
+    def get_connection(self, url, proxies=None):
+        # UnixAdapter keeps one pool per full URL, which opens a new connection for every
+        # distinct path. Keying on the socket keeps the connections alive between requests.
+        socket_url = f"http+unix://{urlparse(url).netloc}"
+        with self.pools.lock:
+            pool = self.pools.get(socket_url)
+            if pool:
+                return pool
+
+            pool = UnixSocketConnectionPool(
+                socket_path=socket_url, timeout=self.timeout, maxsize=self.pool_size
+            )
+            self.pools[socket_url] = pool
+
+        return pool
+
+
+class BackendSession(requests.Session):
+    def __init__(self, backend: str, timeout: float, pool_size: int):
+        super(BackendSession, self).__init__()
+        self.backend = backend
+        self.timeout = timeout
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+        self.headers["Connection"] = "keep-alive"
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.mount("http+unix://", PooledUnixAdapter(timeout=timeout, pool_size=pool_size))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        labels = {"backend": self.backend, "endpoint": get_endpoint(url), "method": method}
+
+        started_at = time.perf_counter()
+        try:
+            response = super(BackendSession, self).request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            backend_request_errors.labels(**labels).inc()
+            raise
+        finally:
+            backend_request_duration.labels(**labels).observe(time.perf_counter() - started_at)
+
+        if response.status_code >= 400:
+            backend_request_errors.labels(**labels).inc()
+        return response
+
+
+def create_session(
+    backend: str, timeout: float, pool_size: int, headers: dict | None = None
+) -> BackendSession:
+    session = BackendSession(backend=backend, timeout=timeout, pool_size=pool_size)
+    if headers:
+        session.headers.update(headers)
+    return session
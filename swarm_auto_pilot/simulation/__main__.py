@@ -0,0 +1,93 @@
+import argparse
+import logging
+import os
+
+from main import add_main_arguments, create_pilot, main_parser, validate_main_args
+from simulation.provider import SimulatedProvider
+from simulation.runner import Simulation, attach_world, create_world, load_scenario, write_result
+from simulation.virtual_clock import VirtualClock
+
+simulation_parser = argparse.ArgumentParser(
+    "swarm-auto-pilot-simulation",
+    description="Replays a scenario against the pilot, every other argument is a pilot argument.",
+)
+simulation_parser.add_argument(
+    "--scenario",
+    help="Sets the scenario (JSON) with the nodes, services and their load traces.",
+    dest="scenario",
+    type=str,
+    required=True,
+)
+simulation_parser.add_argument(
+    "--output",
+    help="Sets a file the timeline and summary are written to as JSON, otherwise the summary is printed.",
+    dest="output",
+    type=str,
+    default=None,
+)
+simulation_parser.add_argument(
+    "--duration",
+    help="Overrides the simulated duration (in seconds) of the scenario.",
+    dest="duration",
+    type=float,
+    default=None,
+)
+simulation_parser.add_argument(
+    "--timeline_step",
+    help="Sets how often (in simulated seconds) the timeline is sampled.",
+    dest="timeline_step",
+    type=float,
+    default=60.0,
+)
+simulation_parser.add_argument(
+    "--log_level",
+    help="Sets the log level of the pilot during the simulation.",
+    dest="log_level",
+    type=str,
+    default="WARNING",
+)
+
+
+def main():
+    simulation_args, remaining_args = simulation_parser.parse_known_args()
+    # The pilot configures DEBUG logging, unless logging is configured before it.
+    logging.basicConfig(
+        level=simulation_args.log_level.upper(),
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+
+    scenario = load_scenario(simulation_args.scenario)
+    if simulation_args.duration is not None:
+        scenario["duration"] = simulation_args.duration
+    world = create_world(
+        scenario=scenario, base_path=os.path.dirname(os.path.abspath(simulation_args.scenario))
+    )
+    clock = VirtualClock(start=world.start)
+
+    add_main_arguments()
+    main_args, _ = main_parser.parse_known_args(remaining_args)
+    main_args.node_scale_provider = "simulated"
+    main_args.metrics_port = 0
+    validate_main_args(main_args)
+
+    provider_client = SimulatedProvider(
+        world=world,
+        clock=clock,
+        warm_pool_size=scenario.get("node", {}).get("warm_pool_size", 0),
+    )
+    pilot = create_pilot(main_args=main_args, provider_client=provider_client, clock=clock)
+    attach_world(pilot=pilot, world=world, clock=clock)
+
+    simulation = Simulation(
+        world=world,
+        pilot=pilot,
+        clock=clock,
+        duration=scenario["duration"],
+        step=scenario.get("step", 15.0),
+        timeline_step=simulation_args.timeline_step,
+    )
+    write_result(result=simulation.run(), path=simulation_args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import io
+import json
+import logging
+import re
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from clock import Clock
+from durations import parse_duration
+from handlers.prometheus import get_services_usage_query, nodes_usage_query, services_usage_query
+from requests.adapters import BaseAdapter
+from simulation.world import SimulatedServer, SimulatedService, SimulatedTask, SimulatedWorld
+
+
+class SimulatedAdapter(BaseAdapter):
+    """
+    Transport adapter answering requests from the simulated world, mounted on the pilot's
+    sessions in place of the Docker socket and Prometheus, so the handlers run unchanged.
+    """
+
+    def __init__(self, world: SimulatedWorld, clock: Clock):
+        super(SimulatedAdapter, self).__init__()
+        self.world = world
+        self.clock = clock
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = json.loads(request.body) if request.body else None
+
+        status_code, response_body = self.handle(
+            method=request.method, path=url.path, query=query, body=body
+        )
+
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers["Content-Type"] = "application/json"
+        response.raw = io.BytesIO(json.dumps(response_body).encode())
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+    def handle(self, method: str, path: str, query: dict, body: dict | None):
+        raise NotImplementedError("A simulated backend must implement this method.")
+
+
+class SimulatedDockerAdapter(SimulatedAdapter):
+    def handle(self, method: str, path: str, query: dict, body: dict | None):
+        filters = json.loads(query["filters"]) if "filters" in query else {}
+
+        if path == "/_ping":
+            return 200, "OK"
+        if path == "/events":
+            return 200, []
+
+        if path == "/services":
+            services = [
+                self.__get_service_json(service)
+                for service in self.world.services.values()
+                if "name" not in filters or service.name in filters["name"]
+            ]
+            return 200, services
+
+        match = re.fullmatch(r"/services/([^/]+)(/update)?", path)
+        if match:
+            service = self.world.get_service(match.group(1))
+            if service is None:
+                return 404, {"message": f"service {match.group(1)} not found"}
+            if method == "POST" and match.group(2):
+                replicas = body["Mode"]["Replicated"]["Replicas"]
+                self.world.scale_service(service_id=service.id, replicas=replicas)
+                return 200, {"Warnings": []}
+            return 200, self.__get_service_json(service)
+
+        if path == "/nodes":
+            nodes = [
+                self.__get_node_json(server)
+                for server in self.world.get_swarm_servers()
+                if "name" not in filters or server.name in filters["name"]
+            ]
+            return 200, nodes
+
+        match = re.fullmatch(r"/nodes/([^/]+)(/update)?", path)
+        if match:
+            server = self.world.get_server(match.group(1))
+            if server is None or not server.in_swarm:
+                return 404, {"message": f"node {match.group(1)} not found"}
+            if method == "DELETE":
+                self.world.leave_swarm(server_id=server.id)
+                return 200, {}
+            if method == "POST" and match.group(2):
+                self.world.update_server(server_id=server.id, availability=body["Availability"])
+                return 200, {}
+            return 200, self.__get_node_json(server)
+
+        if path == "/tasks":
+            tasks = [
+                {
+                    "ID": task.id,
+                    "ServiceID": service.id,
+                    "NodeID": task.server_id or "",
+                    "DesiredState": "running",
+                    "Status": self.__get_task_status(task),
+                }
+                for service in self.world.services.values()
+                for task in service.tasks
+                if ("service" not in filters or service.id in filters["service"])
+                and ("node" not in filters or task.server_id in filters["node"])
+            ]
+            return 200, tasks
+
+        logging.error("Simulated Docker doesn't support: %s %s.", method, path)
+        return 404, {"message": "page not found"}
+
+    @staticmethod
+    def __get_service_json(service: SimulatedService) -> dict:
+        limits = {}
+        if service.cpu_limits is not None:
+            limits["NanoCPUs"] = int(service.cpu_limits * 1000000000)
+        if service.memory_limits is not None:
+            limits["MemoryBytes"] = int(service.memory_limits * 1024 * 1024)
+
+        return {
+            "ID": service.id,
+            "Version": {"Index": service.version},
+            "Spec": {
+                "Name": service.name,
+                "TaskTemplate": {
+                    "ContainerSpec": {"Labels": service.labels},
+                    "Resources": {"Limits": limits},
+                },
+                "Mode": {"Replicated": {"Replicas": service.replicas}},
+            },
+        }
+
+    def __get_task_status(self, task: SimulatedTask) -> dict:
+        if task.server_id is not None:
+            return {"State": task.state}
+        servers = len(self.world.get_swarm_servers())
+        return {
+            "State": task.state,
+            "Err": f"no suitable node (insufficient resources on {servers} nodes)",
+        }
+
+    @staticmethod
+    def __get_node_json(server: SimulatedServer) -> dict:
+        return {
+            "ID": server.id,
+            "Version": {"Index": server.version},
+            "Description": {
+                "Hostname": server.name,
+                "Resources": {
+                    "NanoCPUs": int(server.cpu_cores * 1000000000),
+                    "MemoryBytes": int(server.memory * 1024 * 1024),
+                },
+            },
+            "Spec": {"Role": "worker", "Availability": server.availability},
+            "Status": {"State": "ready"},
+        }
+
+
+class SimulatedPrometheusAdapter(SimulatedAdapter):
+    rate_window = 300.0
+
+    def handle(self, method: str, path: str, query: dict, body: dict | None):
+        if path == "/api/v1/status/config":
+            return 200, {"status": "success", "data": {"yaml": ""}}
+
+        if path == "/api/v1/query" and "machine_cpu_cores" in query.get("query", ""):
+            # cAdvisor runs as a global service, drained servers don't run it or report.
+            servers = [
+                server for server in self.world.get_swarm_servers() if server.is_schedulable()
+            ]
+            now = self.clock.time()
+            return 200, self.__get_vector(
+                [
+                    ({"resource": "cpu"}, now, sum(server.cpu_cores for server in servers)),
+                    (
+                        {"resource": "memory"},
+                        now,
+                        sum(server.memory for server in servers) * 1024 * 1024,
+                    ),
+                ]
+            )
+
+        if path == "/api/v1/query" and query.get("query") == nodes_usage_query:
+            now = self.clock.time()
+            return 200, self.__get_vector(
+                [
+                    ({"container_label_com_docker_swarm_node_id": server_id}, now, cpu_usage)
+                    for server_id, cpu_usage in self.world.get_servers_usage().items()
+                ]
+            )
+
+        windows = re.findall(r'"window", "([^"]+)"', query.get("query", ""))
+        if path == "/api/v1/query" and query.get("query") == get_services_usage_query(windows):
+            now = self.clock.time()
+            samples = []
+            for window in windows:
+                usage = self.world.get_services_usage(now=now, window=parse_duration(window))
+                for service_name, (cpu_usage, _) in usage.items():
+                    labels = self.__get_labels(service_name, "cpu")
+                    samples.append((dict(labels, window=window), now, cpu_usage))
+            usage = self.world.get_services_usage(now=now, window=self.rate_window)
+            for service_name, (_, memory_usage) in usage.items():
+                samples.append(
+                    (self.__get_labels(service_name, "memory"), now, memory_usage * 1024 * 1024)
+                )
+            return 200, self.__get_vector(samples)
+
+        if path == "/api/v1/query" and query.get("query") == services_usage_query:
+            now = self.clock.time()
+            samples = []
+            usage = self.world.get_services_usage(now=now, window=self.rate_window)
+            for service_name, (cpu_usage, memory_usage) in usage.items():
+                samples.append((self.__get_labels(service_name, "cpu"), now, cpu_usage))
+                samples.append(
+                    (self.__get_labels(service_name, "memory"), now, memory_usage * 1024 * 1024)
+                )
+            return 200, self.__get_vector(samples)
+
+        if path == "/api/v1/query_range" and query.get("query") == services_usage_query:
+            usage_range = self.world.get_services_usage_range(
+                start=float(query["start"]),
+                end=float(query["end"]),
+                step=float(query["step"]),
+                window=self.rate_window,
+            )
+            result = []
+            for service_name, samples in usage_range.items():
+                result.append(
+                    {
+                        "metric": self.__get_labels(service_name, "cpu"),
+                        "values": [[time, str(cpu)] for time, cpu, _ in samples],
+                    }
+                )
+                result.append(
+                    {
+                        "metric": self.__get_labels(service_name, "memory"),
+                        "values": [
+                            [time, str(memory * 1024 * 1024)] for time, _, memory in samples
+                        ],
+                    }
+                )
+            return 200, {"status": "success", "data": {"resultType": "matrix", "result": result}}
+
+        logging.error("Simulated Prometheus doesn't support: %s %s %s.", method, path, query)
+        return 400, {"status": "error", "error": "unsupported query"}
+
+    @staticmethod
+    def __get_labels(service_name: str, resource: str) -> dict:
+        return {
+            "container_label_com_docker_swarm_service_name": service_name,
+            "resource": resource,
+        }
+
+    @staticmethod
+    def __get_vector(samples: list[tuple[dict, float, float]]) -> dict:
+        return {
+            "status": "success",
+            "data": {
+                "resultType": "vector",
+                "result": [
+                    {"metric": labels, "value": [time, str(value)]}
+                    for labels, time, value in samples
+                ],
+            },
+        }
+
+
+class SimulatedHetznerAdapter(SimulatedAdapter):
+    def handle(self, method: str, path: str, query: dict, body: dict | None):
+        path = path.removeprefix("/v1")
+
+        if path == "/servers" and method == "GET":
+            label_selector = query.get("label_selector", "")
+            label_name, _, label_value = label_selector.partition("=")
+            servers = [
+                self.__get_server_json(server)
+                for server in self.world.servers.values()
+                if server.managed
+                and (not label_selector or server.labels.get(label_name) == label_value)
+                and ("name" not in query or server.name == query["name"])
+            ]
+            page = int(query.get("page", 1))
+            per_page = int(query.get("per_page", 25))
+            last_page = max(1, -(-len(servers) // per_page))
+            return 200, {
+                "servers": servers[(page - 1) * per_page : page * per_page],
+                "meta": {
+                    "pagination": {"page": page, "per_page": per_page, "last_page": last_page}
+                },
+            }
+
+        if path == "/server_types":
+            server_type = {
+                "name": query.get("name", "simulated"),
+                "cores": self.world.node_cpu_cores,
+                "memory": self.world.node_memory / 1024,
+            }
+            return 200, {"server_types": [server_type]}
+
+        if path == "/servers" and method == "POST":
+            server = self.world.add_server(
+                name=body["name"], now=self.clock.time(), managed=True, labels=body["labels"]
+            )
+            return 201, {"server": self.__get_server_json(server)}
+
+        match = re.fullmatch(r"/servers/([^/]+)", path)
+        if match:
+            server = self.world.get_server(match.group(1))
+            if server is None or not server.managed:
+                return 404, {"error": {"code": "not_found", "message": "server not found"}}
+            if method == "DELETE":
+                self.world.delete_server(server_id=server.id)
+                return 200, {"action": {"command": "delete_server", "status": "running"}}
+            if method == "PUT":
+                server.labels = dict(body["labels"])
+            return 200, {"server": self.__get_server_json(server)}
+
+        logging.error("Simulated Hetzner doesn't support: %s %s.", method, path)
+        return 404, {"error": {"code": "not_found", "message": "page not found"}}
+
+    @staticmethod
+    def __get_server_json(server: SimulatedServer) -> dict:
+        return {
+            "id": server.id,
+            "name": server.name,
+            "labels": server.labels,
+            "created": datetime.fromtimestamp(server.created_at, tz=timezone.utc).isoformat(),
+        }
@@ -0,0 +1,75 @@
+import threading
+from datetime import datetime, timezone
+
+from clock import Clock
+from providers import Node, ProviderBase
+from simulation.world import SimulatedServer, SimulatedWorld
+
+
+class SimulatedNode(Node):
+    def __init__(self, server: SimulatedServer, world: SimulatedWorld):
+        self.world = world
+        self.id = server.id
+        self.name = server.name
+        self.labels = dict(server.labels)
+        self.created_at = datetime.fromtimestamp(server.created_at, tz=timezone.utc)
+
+    def delete(self) -> bool:
+        self.world.delete_server(self.id)
+        return True
+
+    def update_labels(self, labels: dict) -> dict:
+        server = self.world.get_server(self.id)
+        if server is None:
+            return False
+        server.labels = dict(labels)
+        return server.labels
+
+
+class SimulatedProvider(ProviderBase):
+    """
+    Stand-in for a node scale provider, creating servers in the simulated world that join the
+    swarm after the node boot time.
+    """
+
+    def __str__(self):
+        return "Simulated Provider"
+
+    def __init__(
+        self,
+        world: SimulatedWorld,
+        clock: Clock,
+        node_label: str = "autopilot",
+        warm_pool_size: int = 0,
+    ):
+        self.world = world
+        self.clock = clock
+        self.node_label = node_label
+        self.warm_pool_size = warm_pool_size
+        self.created_nodes = 0
+        self.lock = threading.Lock()
+
+    def get_nodes(self) -> list[SimulatedNode]:
+        return [
+            SimulatedNode(server=server, world=self.world)
+            for server in self.world.servers.values()
+            if server.managed
+        ]
+
+    def get_node_resources(self) -> tuple[float, float]:
+        return self.world.node_cpu_cores, self.world.node_memory
+
+    def get_warm_pool_size(self) -> int:
+        return self.warm_pool_size
+
+    def node_create(self, standby: bool = False) -> SimulatedNode:
+        with self.lock:
+            self.created_nodes += 1
+            name = f"node-autopilot-{self.created_nodes:06d}"
+        labels = {"Type": self.node_label, "Status": "Creating"}
+        if standby:
+            labels["Pool"] = "warm"
+        server = self.world.add_server(
+            name=name, now=self.clock.time(), managed=True, labels=labels
+        )
+        return SimulatedNode(server=server, world=self.world)
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+
+from pilot import Pilot
+from simulation.backends import SimulatedDockerAdapter, SimulatedPrometheusAdapter
+from simulation.traces import LoadTrace
+from simulation.virtual_clock import VirtualClock
+from simulation.world import SimulatedWorld
+
+
+def load_scenario(path: str) -> dict:
+    with open(path) as scenario_file:
+        return json.load(scenario_file)
+
+
+def create_world(scenario: dict, base_path: str) -> SimulatedWorld:
+    """
+    Builds the world of a scenario, see simulation/scenarios/example.json for the format.
+    """
+    start = scenario.get("start", 1735689600.0)
+    duration = scenario["duration"]
+    step = scenario.get("step", 15.0)
+    node = scenario.get("node", {})
+
+    world = SimulatedWorld(
+        start=start,
+        node_cpu_cores=node.get("cpu_cores", 2.0),
+        node_memory=node.get("memory", 4096.0),
+        node_boot_time=node.get("boot_time", 120.0),
+        task_start_time=scenario.get("task_start_time", 10.0),
+    )
+    for server in scenario.get("nodes", []):
+        managed = server.get("managed", False)
+        world.add_server(
+            name=server["name"],
+            now=start - 86400,
+            managed=managed,
+            labels={"Type": "autopilot", "Status": "Running"} if managed else {},
+            cpu_cores=server.get("cpu_cores", None),
+            memory=server.get("memory", None),
+            boot_time=0.0,
+        )
+    for service in scenario["services"]:
+        world.add_service(
+            name=service["name"],
+            replicas=service.get("replicas", 1),
+            cpu_limits=service.get("cpu_limits", None),
+            memory_limits=service.get("memory_limits", None),
+            labels=service.get("labels", {}),
+            trace=LoadTrace.from_config(
+                service.get("demand", {}), base_path=base_path, duration=duration, step=step
+            ),
+        )
+    return world
+
+
+def attach_world(pilot: Pilot, world: SimulatedWorld, clock: VirtualClock):
+    """
+    Mounts the simulated backends on the pilot's Docker and Prometheus sessions.
+    """
+    # Reading proxy settings from the environment on every request dominates a simulation.
+    pilot.docker_handler.session.trust_env = False
+    pilot.metrics_handler.session.trust_env = False
+    pilot.docker_handler.session.mount(
+        "http+unix://", SimulatedDockerAdapter(world=world, clock=clock)
+    )
+    pilot.metrics_handler.session.mount(
+        "http://", SimulatedPrometheusAdapter(world=world, clock=clock)
+    )
+
+
+class Simulation:
+    def __init__(
+        self,
+        world: SimulatedWorld,
+        pilot: Pilot,
+        clock: VirtualClock,
+        duration: float,
+        step: float,
+        timeline_step: float,
+    ):
+        self.world = world
+        self.pilot = pilot
+        self.clock = clock
+        self.duration = duration
+        self.step = step
+        self.timeline_step = timeline_step
+        self.timeline = []
+        self.ticks = 0
+        self.scale_events = 0
+        self.node_seconds = 0.0
+        self.unmet_cpu_seconds = 0.0
+        self.unmet_memory_seconds = 0.0
+        self.max_nodes = 0
+
+    def run(self) -> dict:
+        end = self.world.start + self.duration
+        next_tick = self.clock.time()
+        next_timeline_sample = self.clock.time()
+        replicas = {service.id: service.replicas for service in self.world.services.values()}
+        synced_generation = None
+        self.world.advance(self.clock.time())
+
+        while self.clock.time() < end:
+            now = self.clock.time()
+            if now >= next_tick:
+                # Stands in for the events stream: the state is only resynced after a service
+                # or node changed, the tasks are refreshed by the tick itself.
+                if synced_generation != self.world.generation:
+                    synced_generation = self.world.generation
+                    self.pilot.docker_state.resync()
+                with self.pilot.tracer.trace("tick"):
+                    interval = self.pilot.run_tick()
+                self.ticks += 1
+                next_tick = now + interval
+
+                for service in self.world.services.values():
+                    if service.replicas != replicas.get(service.id, service.replicas):
+                        self.scale_events += 1
+                    replicas[service.id] = service.replicas
+
+            if now >= next_timeline_sample:
+                self.timeline.append(self.get_timeline_sample(now=now))
+                next_timeline_sample = now + self.timeline_step
+
+            step = min(self.step, next_tick - now, end - now)
+            self.account(step=step)
+            self.clock.sleep(step)
+            self.world.advance(self.clock.time())
+
+        summary = self.get_summary()
+        logging.info("Simulation finished: %s", summary)
+        return {"summary": summary, "timeline": self.timeline}
+
+    def account(self, step: float):
+        services = self.world.services.values()
+        self.node_seconds += len(self.world.servers) * step
+        self.unmet_cpu_seconds += (
+            sum(max(0.0, service.cpu_demand - service.cpu_usage) for service in services) * step
+        )
+        self.unmet_memory_seconds += (
+            sum(max(0.0, service.memory_demand - service.memory_usage) for service in services)
+            * step
+        )
+        self.max_nodes = max(self.max_nodes, len(self.world.servers))
+
+    def get_timeline_sample(self, now: float) -> dict:
+        services = self.world.services.values()
+        return {
+            "time": now - self.world.start,
+            "nodes": len(self.world.servers),
+            "swarm_nodes": len(self.world.get_swarm_servers()),
+            "unmet_cpu": sum(
+                max(0.0, service.cpu_demand - service.cpu_usage) for service in services
+            ),
+            "unmet_memory": sum(
+                max(0.0, service.memory_demand - service.memory_usage) for service in services
+            ),
+            "services": {
+                service.name: {
+                    "replicas": service.replicas,
+                    "running": service.get_running_tasks(),
+                    "cpu_demand": service.cpu_demand,
+                    "cpu_usage": service.cpu_usage,
+                    "memory_demand": service.memory_demand,
+                    "memory_usage": service.memory_usage,
+                }
+                for service in services
+            },
+        }
+
+    def get_summary(self) -> dict:
+        return {
+            "duration": self.duration,
+            "ticks": self.ticks,
+            "scale_events": self.scale_events,
+            "node_hours": self.node_seconds / 3600,
+            "max_nodes": self.max_nodes,
+            "unmet_cpu_core_hours": self.unmet_cpu_seconds / 3600,
+            "unmet_memory_mib_hours": self.unmet_memory_seconds / 3600,
+        }
+
+
+def write_result(result: dict, path: str | None):
+    if path is None:
+        print(json.dumps(result["summary"], indent=2))
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as result_file:
+        json.dump(result, result_file)
+    logging.info("Wrote simulation timeline to: %s.", path)
@@ -0,0 +1,88 @@
+import csv
+import os
+
+import numpy as np
+
+
+class LoadTrace:
+    """
+    Demand of a service over time, total CPU (cores) and memory (MiB) across all its replicas.
+    Demand between two samples is interpolated, and held before the first and after the last.
+    """
+
+    def __init__(self, times: np.ndarray, cpu_demand: np.ndarray, memory_demand: np.ndarray):
+        self.times = times
+        self.cpu_demand = cpu_demand
+        self.memory_demand = memory_demand
+
+    def get_demand(self, offset: float) -> tuple[float, float]:
+        cpu_demand = float(np.interp(offset, self.times, self.cpu_demand))
+        memory_demand = float(np.interp(offset, self.times, self.memory_demand))
+        return cpu_demand, memory_demand
+
+    @staticmethod
+    def from_csv(path: str) -> "LoadTrace":
+        """
+        Reads a recorded trace with the columns time, cpu and memory. Time is either seconds
+        or Unix timestamps, the trace starts at its first row either way.
+        """
+        with open(path, newline="") as trace_file:
+            rows = [
+                (float(row["time"]), float(row["cpu"]), float(row["memory"]))
+                for row in csv.DictReader(trace_file)
+            ]
+        if not rows:
+            raise ValueError(f"Trace: {path} has no rows.")
+
+        samples = np.array(sorted(rows))
+        return LoadTrace(
+            times=samples[:, 0] - samples[0, 0],
+            cpu_demand=samples[:, 1],
+            memory_demand=samples[:, 2],
+        )
+
+    @staticmethod
+    def synthetic(
+        duration: float,
+        step: float,
+        cpu: float,
+        memory: float,
+        amplitude: float = 0.0,
+        period: float = 86400.0,
+        phase: float = 0.0,
+        noise: float = 0.0,
+        spikes: list[dict] | None = None,
+        seed: int | None = None,
+    ) -> "LoadTrace":
+        """
+        Generates a daily (or any period) sine shaped trace around the base CPU and memory
+        demand, with relative gaussian noise and spikes of {"at", "duration", "factor"}.
+        """
+        times = np.arange(0.0, duration + step, step)
+        shape = 1 + amplitude * np.sin(2 * np.pi * (times + phase) / period)
+        if noise:
+            shape += np.random.default_rng(seed).normal(0.0, noise, size=times.shape)
+        for spike in spikes or []:
+            in_spike = (times >= spike["at"]) & (times < spike["at"] + spike["duration"])
+            shape[in_spike] *= spike["factor"]
+
+        shape = np.clip(shape, 0.0, None)
+        return LoadTrace(times=times, cpu_demand=cpu * shape, memory_demand=memory * shape)
+
+    @staticmethod
+    def from_config(config: dict, base_path: str, duration: float, step: float) -> "LoadTrace":
+        if "trace" in config:
+            return LoadTrace.from_csv(os.path.join(base_path, config["trace"]))
+
+        return LoadTrace.synthetic(
+            duration=duration,
+            step=step,
+            cpu=config.get("cpu", 0.0),
+            memory=config.get("memory", 0.0),
+            amplitude=config.get("amplitude", 0.0),
+            period=config.get("period", 86400.0),
+            phase=config.get("phase", 0.0),
+            noise=config.get("noise", 0.0),
+            spikes=config.get("spikes", None),
+            seed=config.get("seed", None),
+        )
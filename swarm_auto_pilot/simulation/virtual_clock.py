@@ -0,0 +1,12 @@
+from clock import Clock
+
+
+class VirtualClock(Clock):
+    def __init__(self, start: float):
+        self.current_time = start
+
+    def time(self) -> float:
+        return self.current_time
+
+    def sleep(self, seconds: float):
+        self.current_time += max(0.0, seconds)
@@ -0,0 +1,341 @@
+import bisect
+import itertools
+
+import numpy as np
+from simulation.traces import LoadTrace
+
+
+class SimulatedTask:
+    def __init__(self, task_id: str, service_id: str, created_at: float):
+        self.id = task_id
+        self.service_id = service_id
+        self.server_id = None
+        self.state = "pending"
+        self.started_at = None
+        self.created_at = created_at
+
+
+class SimulatedService:
+    def __init__(
+        self,
+        service_id: str,
+        name: str,
+        replicas: int,
+        cpu_limits: float | None,
+        memory_limits: float | None,
+        labels: dict,
+        trace: LoadTrace,
+    ):
+        self.id = service_id
+        self.name = name
+        self.version = 1
+        self.replicas = replicas
+        self.cpu_limits = cpu_limits
+        self.memory_limits = memory_limits
+        self.labels = labels
+        self.trace = trace
+        self.tasks = []
+        self.cpu_demand = 0.0
+        self.memory_demand = 0.0
+        self.cpu_usage = 0.0
+        self.memory_usage = 0.0
+        self.cpu_history = []
+        self.memory_history = []
+        self.running_history = []
+
+    def get_running_tasks(self) -> int:
+        return sum(1 for task in self.tasks if task.state == "running")
+
+
+class SimulatedServer:
+    def __init__(
+        self,
+        server_id: str,
+        name: str,
+        cpu_cores: float,
+        memory: float,
+        created_at: float,
+        ready_at: float,
+        managed: bool,
+        labels: dict,
+    ):
+        self.id = server_id
+        self.name = name
+        self.version = 1
+        self.cpu_cores = cpu_cores
+        self.memory = memory
+        self.created_at = created_at
+        self.ready_at = ready_at
+        self.managed = managed
+        self.labels = labels
+        self.availability = "active"
+        self.in_swarm = False
+        self.left_swarm = False
+
+    def is_schedulable(self) -> bool:
+        return self.in_swarm and self.availability == "active"
+
+
+class SimulatedWorld:
+    """
+    A swarm of servers and services, where service tasks are placed on the servers that have
+    room for their limits, start after task_start_time, and use their demand up to their limits.
+    """
+
+    def __init__(
+        self,
+        start: float,
+        node_cpu_cores: float,
+        node_memory: float,
+        node_boot_time: float,
+        task_start_time: float,
+    ):
+        self.start = start
+        self.node_cpu_cores = node_cpu_cores
+        self.node_memory = node_memory
+        self.node_boot_time = node_boot_time
+        self.task_start_time = task_start_time
+        self.services = {}
+        self.servers = {}
+        self.history_times = []
+        self.ids = itertools.count(1)
+        # Bumped on every change a Docker service or node event would report.
+        self.generation = 0
+
+    def __create_id(self, prefix: str) -> str:
+        return f"{prefix}{next(self.ids):012d}"
+
+    def add_service(
+        self,
+        name: str,
+        replicas: int,
+        cpu_limits: float | None,
+        memory_limits: float | None,
+        labels: dict,
+        trace: LoadTrace,
+    ) -> SimulatedService:
+        service = SimulatedService(
+            service_id=self.__create_id("service"),
+            name=name,
+            replicas=replicas,
+            cpu_limits=cpu_limits,
+            memory_limits=memory_limits,
+            labels=labels,
+            trace=trace,
+        )
+        self.services[service.id] = service
+        return service
+
+    def add_server(
+        self,
+        name: str,
+        now: float,
+        managed: bool,
+        labels: dict | None = None,
+        cpu_cores: float | None = None,
+        memory: float | None = None,
+        boot_time: float | None = None,
+    ) -> SimulatedServer:
+        server = SimulatedServer(
+            server_id=self.__create_id("node"),
+            name=name,
+            cpu_cores=cpu_cores if cpu_cores is not None else self.node_cpu_cores,
+            memory=memory if memory is not None else self.node_memory,
+            created_at=now,
+            ready_at=now + (boot_time if boot_time is not None else self.node_boot_time),
+            managed=managed,
+            labels=labels or {},
+        )
+        self.servers[server.id] = server
+        return server
+
+    def get_service(self, service_id: str) -> SimulatedService | None:
+        return self.services.get(service_id, None)
+
+    def get_server(self, server_id: str) -> SimulatedServer | None:
+        return self.servers.get(server_id, None)
+
+    def get_swarm_servers(self) -> list[SimulatedServer]:
+        return [server for server in self.servers.values() if server.in_swarm]
+
+    def scale_service(self, service_id: str, replicas: int):
+        service = self.services[service_id]
+        service.replicas = replicas
+        service.version += 1
+        self.generation += 1
+
+    def update_server(self, server_id: str, availability: str):
+        server = self.servers[server_id]
+        server.availability = availability
+        server.version += 1
+        self.generation += 1
+
+    def leave_swarm(self, server_id: str):
+        server = self.servers[server_id]
+        server.in_swarm = False
+        server.left_swarm = True
+        self.generation += 1
+
+    def delete_server(self, server_id: str):
+        if self.servers.pop(server_id, None) is not None:
+            self.generation += 1
+
+    def advance(self, now: float):
+        for server in self.servers.values():
+            if not server.in_swarm and not server.left_swarm and now >= server.ready_at:
+                server.in_swarm = True
+                self.generation += 1
+
+        reserved = {server.id: [0.0, 0.0] for server in self.servers.values()}
+        for service in self.services.values():
+            service.tasks = [
+                task
+                for task in service.tasks
+                if task.server_id is None
+                or (
+                    task.server_id in self.servers
+                    and self.servers[task.server_id].is_schedulable()
+                )
+            ]
+
+            # Pending tasks are removed first, then the newest, like the swarm scheduler does.
+            surplus = len(service.tasks) - service.replicas
+            if surplus > 0:
+                service.tasks.sort(key=lambda task: (task.state == "running", -task.created_at))
+                service.tasks = service.tasks[surplus:]
+            for _ in range(service.replicas - len(service.tasks)):
+                service.tasks.append(
+                    SimulatedTask(
+                        task_id=self.__create_id("task"), service_id=service.id, created_at=now
+                    )
+                )
+
+            for task in service.tasks:
+                if task.server_id is not None:
+                    reserved[task.server_id][0] += service.cpu_limits or 0.0
+                    reserved[task.server_id][1] += service.memory_limits or 0.0
+
+        for service in self.services.values():
+            for task in service.tasks:
+                if task.server_id is None:
+                    self.__place_task(task=task, service=service, reserved=reserved, now=now)
+                if task.state == "starting" and now >= task.started_at + self.task_start_time:
+                    task.state = "running"
+
+            running_tasks = service.get_running_tasks()
+            offset = now - self.start
+            service.cpu_demand, service.memory_demand = service.trace.get_demand(offset)
+            service.cpu_usage = self.__get_usage(
+                service.cpu_demand, service.cpu_limits, running_tasks
+            )
+            service.memory_usage = self.__get_usage(
+                service.memory_demand, service.memory_limits, running_tasks
+            )
+            service.cpu_history.append(service.cpu_usage)
+            service.memory_history.append(service.memory_usage)
+            service.running_history.append(running_tasks)
+        self.history_times.append(now)
+
+    def __place_task(
+        self, task: SimulatedTask, service: SimulatedService, reserved: dict, now: float
+    ):
+        cpu_limits = service.cpu_limits or 0.0
+        memory_limits = service.memory_limits or 0.0
+
+        best_server = None
+        best_free_cpu = None
+        for server in self.servers.values():
+            if not server.is_schedulable():
+                continue
+            free_cpu = server.cpu_cores - reserved[server.id][0]
+            free_memory = server.memory - reserved[server.id][1]
+            if free_cpu < cpu_limits or free_memory < memory_limits:
+                continue
+            if best_free_cpu is None or free_cpu > best_free_cpu:
+                best_server = server
+                best_free_cpu = free_cpu
+
+        if best_server is None:
+            return
+
+        reserved[best_server.id][0] += cpu_limits
+        reserved[best_server.id][1] += memory_limits
+        task.server_id = best_server.id
+        task.state = "starting"
+        task.started_at = now
+
+    @staticmethod
+    def __get_usage(demand: float, limits: float | None, running_tasks: int) -> float:
+        if running_tasks == 0:
+            return 0.0
+        if limits is None:
+            return demand
+        return min(demand, limits * running_tasks)
+
+    def get_servers_usage(self) -> dict[str, float]:
+        """
+        Returns the latest CPU usage of the tasks on every server, splitting the usage of a
+        service evenly over its running tasks.
+        """
+        servers_usage = {}
+        for service in self.services.values():
+            running_tasks = [task for task in service.tasks if task.state == "running"]
+            for task in running_tasks:
+                servers_usage[task.server_id] = servers_usage.get(
+                    task.server_id, 0.0
+                ) + service.cpu_usage / len(running_tasks)
+        return servers_usage
+
+    def get_services_usage(self, now: float, window: float) -> dict[str, tuple[float, float]]:
+        """
+        Returns the CPU usage averaged over the window, like a Prometheus rate, and the latest
+        memory usage of every service that has running tasks.
+        """
+        window_start = bisect.bisect_right(self.history_times, now - window)
+        window_end = bisect.bisect_right(self.history_times, now)
+        if window_end == window_start:
+            return {}
+
+        usage = {}
+        for service in self.services.values():
+            if service.running_history[window_end - 1] == 0:
+                continue
+            cpu_usage = float(np.mean(service.cpu_history[window_start:window_end]))
+            usage[service.name] = (cpu_usage, service.memory_history[window_end - 1])
+        return usage
+
+    def get_services_usage_range(
+        self, start: float, end: float, step: float, window: float
+    ) -> dict[str, list[tuple[float, float, float]]]:
+        # Only the part of the history the range and its first window cover is read.
+        first_sample = bisect.bisect_right(self.history_times, start - window)
+        last_sample = bisect.bisect_right(self.history_times, end)
+        times = np.array(self.history_times[first_sample:last_sample])
+        sample_times = np.arange(start, end + step / 2, step)
+        window_ends = np.searchsorted(times, sample_times, side="right")
+        window_starts = np.searchsorted(times, sample_times - window, side="right")
+
+        usage_range = {}
+        for service in self.services.values():
+            if not service.cpu_history:
+                continue
+            cpu_history = service.cpu_history[first_sample:last_sample]
+            cpu_sums = np.concatenate([[0.0], np.cumsum(cpu_history)])
+            memory_history = service.memory_history[first_sample:last_sample]
+            running_history = service.running_history[first_sample:last_sample]
+
+            samples = []
+            for sample_time, window_start, window_end in zip(
+                sample_times, window_starts, window_ends
+            ):
+                if window_end == window_start or running_history[window_end - 1] == 0:
+                    continue
+                cpu_usage = (cpu_sums[window_end] - cpu_sums[window_start]) / (
+                    window_end - window_start
+                )
+                samples.append(
+                    (float(sample_time), float(cpu_usage), float(memory_history[window_end - 1]))
+                )
+            if samples:
+                usage_range[service.name] = samples
+        return usage_range
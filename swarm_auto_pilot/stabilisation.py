@@ -0,0 +1,91 @@
+import logging
+from collections import deque
+
+
+class ScaleHistory:
+    def __init__(self):
+        self.recommendations = {}
+        self.first_seen = {}
+        self.last_scaled = {}
+
+    def stabilise(
+        self,
+        service_name: str,
+        current_replicas: int,
+        recommended_replicas: int,
+        scale_up_window: float,
+        scale_down_window: float,
+        cooldown: float,
+        now: float,
+    ) -> int:
+        """
+        Returns the replica count to scale to, which is current_replicas when the decision is
+        suppressed. Scale up uses the lowest recommendation of the scale up window, scale down
+        the highest recommendation of the scale down window, and only once the history covers
+        the whole window.
+        """
+        recommendations = self.recommendations.setdefault(service_name, deque())
+        self.first_seen.setdefault(service_name, now)
+        recommendations.append((now, recommended_replicas))
+
+        oldest_needed = now - max(scale_up_window, scale_down_window)
+        while recommendations and recommendations[0][0] < oldest_needed:
+            recommendations.popleft()
+
+        if recommended_replicas == current_replicas:
+            return current_replicas
+
+        last_scaled = self.last_scaled.get(service_name, None)
+        if last_scaled is not None and now - last_scaled < cooldown:
+            logging.info(
+                "Suppressed scale of service: %s from %s to %s replicas, cooldown of %ss has %.0fs left.",
+                service_name,
+                current_replicas,
+                recommended_replicas,
+                cooldown,
+                cooldown - (now - last_scaled),
+            )
+            return current_replicas
+
+        if recommended_replicas > current_replicas:
+            stabilised_replicas = min(
+                replicas
+                for recorded_at, replicas in recommendations
+                if recorded_at >= now - scale_up_window
+            )
+            if stabilised_replicas <= current_replicas:
+                logging.info(
+                    "Suppressed scale up of service: %s to %s replicas, not recommended for the whole %ss window.",
+                    service_name,
+                    recommended_replicas,
+                    scale_up_window,
+                )
+                return current_replicas
+            return stabilised_replicas
+
+        if now - self.first_seen[service_name] < scale_down_window:
+            logging.info(
+                "Suppressed scale down of service: %s to %s replicas, history doesn't cover the %ss window yet.",
+                service_name,
+                recommended_replicas,
+                scale_down_window,
+            )
+            return current_replicas
+
+        stabilised_replicas = max(
+            replicas
+            for recorded_at, replicas in recommendations
+            if recorded_at >= now - scale_down_window
+        )
+        if stabilised_replicas >= current_replicas:
+            logging.info(
+                "Suppressed scale down of service: %s to %s replicas, usage hasn't been low for the whole %ss window.",
+                service_name,
+                recommended_replicas,
+                scale_down_window,
+            )
+            return current_replicas
+        return stabilised_replicas
+
+    def record_scale(self, service_name: str, now: float):
+        self.last_scaled[service_name] = now
@@ -0,0 +1,78 @@
+from urllib.parse import urlparse
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+tick_duration = Histogram(
+    "autopilot_tick_duration_seconds",
+    "Duration of a control loop tick.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+tick_interval = Gauge(
+    "autopilot_tick_interval_seconds", "Interval chosen before the next control loop tick."
+)
+tick_errors = Counter("autopilot_tick_errors_total", "Control loop ticks that backed off.")
+
+backend_request_duration = Histogram(
+    "autopilot_backend_request_duration_seconds",
+    "Duration of requests to the backends.",
+    ["backend", "endpoint", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+backend_request_errors = Counter(
+    "autopilot_backend_request_errors_total",
+    "Requests to the backends that failed or returned an error status.",
+    ["backend", "endpoint", "method"],
+)
+backend_rate_limit_remaining = Gauge(
+    "autopilot_backend_rate_limit_remaining",
+    "Requests left in the rate limit of the backends that report one.",
+    ["backend"],
+)
+
+scale_decisions = Counter(
+    "autopilot_scale_decisions_total",
+    "Service scale decisions that were applied.",
+    ["service", "direction", "result"],
+)
+scale_duration = Histogram(
+    "autopilot_scale_duration_seconds",
+    "Duration of a service scale update.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+node_operation_duration = Histogram(
+    "autopilot_node_operation_duration_seconds",
+    "Duration of node operations, from the start of the operation until it has completed.",
+    ["operation"],
+    buckets=(0.25, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600),
+)
+node_creations = Counter(
+    "autopilot_node_creations_total", "Nodes the pilot asked the provider to create.", ["result"]
+)
+pending_nodes = Gauge(
+    "autopilot_pending_nodes", "Nodes created by the pilot that haven't joined the swarm yet."
+)
+warm_pool_nodes = Gauge(
+    "autopilot_warm_pool_nodes", "Joined and drained nodes ready to be activated on scale up."
+)
+
+cache_requests = Counter(
+    "autopilot_cache_requests_total", "Lookups in the pilot's caches.", ["cache", "result"]
+)
+
+
+def get_endpoint(url: str) -> str:
+    """
+    Returns the first path segment of the URL that names a resource, e.g. services for
+    /services/<id>/update or query_range for /api/v1/query_range, keeping label values bounded.
+    """
+    segments = [
+        segment
+        for segment in urlparse(url).path.split("/")
+        if segment and segment not in ["api", "v1"]
+    ]
+    return segments[0] if segments else "/"
+
+
+def start_metrics_server(port: int):
+    start_http_server(port)
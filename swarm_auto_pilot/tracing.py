@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.children = []
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def to_collapsed(self, stack: str = "") -> list[str]:
+        """
+        Returns the span as collapsed stack lines ("tick;run_tick;get_nodes 1234"), weighted by
+        self time in microseconds, which flamegraph.pl, speedscope and inferno read.
+        """
+        stack = f"{stack};{self.name}" if stack else self.name
+        self_time = self.duration - sum(child.duration for child in self.children)
+
+        lines = [f"{stack} {max(0, round(self_time * 1000000))}"]
+        for child in self.children:
+            lines.extend(child.to_collapsed(stack=stack))
+        return lines
+
+
+class Tracer:
+    def __init__(self, budget: float, history: int, path: str | None = None):
+        self.budget = budget
+        self.path = path
+        self.traces = deque(maxlen=history)
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = getattr(self.local, "span", None)
+        span = Span(name=name, attributes=attributes)
+        if parent is not None:
+            parent.children.append(span)
+
+        self.local.span = span
+        started_at = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - started_at
+            self.local.span = parent
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        try:
+            with self.span(name, **attributes) as root:
+                yield root
+        finally:
+            self.traces.append(root)
+            if root.duration > self.budget:
+                self.dump(root)
+
+    def dump(self, root: Span):
+        logging.warning(
+            "Tick took %.3f seconds, over the %.3f seconds budget: %s.",
+            root.duration,
+            self.budget,
+            ", ".join(f"{child.name}: {child.duration:.3f}s" for child in root.children),
+        )
+        if self.path is None:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        file_name = os.path.join(self.path, f"{root.name}-{root.started_at:.0f}")
+        with open(f"{file_name}.json", "w") as trace_file:
+            json.dump(root.to_dict(), trace_file)
+        with open(f"{file_name}.folded", "w") as collapsed_file:
+            collapsed_file.write("\n".join(root.to_collapsed()) + "\n")
+        logging.info("Wrote slow tick trace to: %s.json and %s.folded.", file_name, file_name)
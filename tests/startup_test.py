@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+package_path = os.path.join(os.path.dirname(__file__), "..", "swarm_auto_pilot")
+
+
+def test_main_starts_with_hetzner_provider():
+    """
+    Starts the pilot through main.py, like the Docker image does, with Hetzner node scaling.
+    Docker and Hetzner aren't reachable here, so the pilot only has to get past its setup.
+    """
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "main.py",
+            "--cpu_scale_up_threshold=0.5",
+            "--cpu_scale_down_threshold=0.85",
+            "--metrics_port=0",
+            "--node_scale_enabled=True",
+            "--node_scale_provider=hetzner",
+            "--api_key=key",
+            "--node_image=ubuntu-24.04",
+            "--node_type=cx22",
+            "--node_location=fsn1",
+        ],
+        cwd=package_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    try:
+        output, _ = process.communicate(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        output, _ = process.communicate()
+
+    assert "Node scale provider: Hetzner Provider" in output, output